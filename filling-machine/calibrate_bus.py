@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Find the fastest stable poll interval and response timeout for each Modbus
+device on this machine and optionally write them into config.json
+(`*_poll_interval`, `*_timeout`). Only read-only transactions are sent, but
+run it with the machine idle.
+Usage:
+    python calibrate_bus.py                          # measure and print
+    python calibrate_bus.py --target-error 0.001 --save
+    python calibrate_bus.py --devices scale --transactions 200
+"""
+import argparse
+import json
+import logging
+
+from config import Config
+from machine.bus_calibration import DEVICES, apply_calibration, calibrate_bus
+from machine.modbus_interface import ModbusInterface
+
+
+def parse_override(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", nargs="+", choices=DEVICES, default=list(DEVICES))
+    parser.add_argument("--transactions", type=int, default=100, help="probes per interval/timeout step")
+    parser.add_argument("--target-error", type=float, default=0.01, help="highest acceptable error rate")
+    parser.add_argument("--margin", type=float, default=1.2, help="safety factor applied to the result")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config.json value (JSON-parsed), e.g. ports")
+    parser.add_argument("--save", action="store_true", help="write the result into config.json")
+    parser.add_argument("--verbose", action="store_true", help="log every step")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    cfg = Config()
+    for override in args.set:
+        key, value = parse_override(override)
+        cfg.set(key, value)
+
+    modbus = ModbusInterface(cfg)
+    try:
+        results = calibrate_bus(modbus, args.devices, transactions=args.transactions,
+                                target_error_rate=args.target_error, margin=args.margin)
+    finally:
+        modbus.close()
+
+    for device, result in results.items():
+        if result is None:
+            print(f"{device:<7} no stable timing found")
+            continue
+        print(f"{device:<7} interval {result['interval'] * 1000:.1f} ms  timeout {result['timeout'] * 1000:.1f} ms  "
+              f"errors {result['error_rate'] * 100:.1f}%  p99 {result['p99'] * 1000:.1f} ms")
+
+    if args.save:
+        # Reload so --set overrides are not persisted along with the result
+        saved = Config()
+        changed = apply_calibration(saved, results)
+        if changed:
+            saved.save()
+            print(f"Saved to config.json: {json.dumps(changed)}")
+
+
+if __name__ == "__main__":
+    main()
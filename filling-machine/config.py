@@ -36,6 +36,22 @@ class Config:
         """
         return dict(self._data.get("mould_weights", {}))
 
+    def speed_profile(self, flavour: str):
+        """
+        Returns the configured speed profile spec for a flavour, falling
+        back to the "default" profile, or None if neither is configured.
+        """
+        profiles = self._data.get("speed_profiles", {})
+        return profiles.get(flavour, profiles.get("default"))
+
+    def as_dict(self) -> dict:
+        """Return a deep copy of the whole configuration."""
+        return json.loads(json.dumps(self._data))
+
+    def sibling_path(self, name: str) -> str:
+        """Return the path of `name` in the same directory as the config file."""
+        return os.path.join(os.path.dirname(self._path), name)
+
     def set(self, key: str, value):
         """Set a config key to a new value in memory."""
         self._data[key] = value
@@ -0,0 +1,97 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands the record over untouched. The stock handler
+    formats the message in `prepare()`, i.e. on the calling (control)
+    thread; here formatting is left to the listener thread. Safe because
+    the queue never leaves the process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (logger, file, line) for records below
+    WARNING: each site may emit `burst` records at once and `rate` records
+    per second on average. Dropped records are counted and the next record
+    that passes from the same site carries the count in `record.suppressed`
+    (see SuppressedCountFormatter); its message is left untouched.
+    Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, clock=time.monotonic):
+        super().__init__()
+        self.rate   = rate
+        self.burst  = burst
+        self._clock = clock
+        self._sites = {}
+        self._lock  = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = self._clock()
+        with self._lock:
+            tokens, last, dropped = self._sites.get(key, (float(self.burst), now, 0))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens < 1.0:
+                self._sites[key] = (tokens, now, dropped + 1)
+                return False
+            self._sites[key] = (tokens - 1.0, now, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    """
+    Formatter that appends "[N similar suppressed]" to records that
+    RateLimitFilter let through after dropping others from the same site.
+    """
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} [{suppressed} similar suppressed]" if suppressed else text
+
+
+def setup_logging(config, handlers, level=logging.DEBUG) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue so that formatting and file/network
+    I/O happen on a background listener thread, never on the control loops.
+    Args:
+        config: Config providing optional `log_levels` ({logger name: level})
+            and `log_rate_limit` ({'rate': per second, 'burst': count}).
+        handlers (list): Output handlers served by the listener thread.
+        level: Root logger level.
+    Returns:
+        QueueListener: Already started; call `stop()` at shutdown to flush.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    limits = config.get("log_rate_limit")
+    if limits:
+        queue_handler.addFilter(RateLimitFilter(limits.get("rate", 10.0), limits.get("burst", 20)))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    # Per-subsystem levels, e.g. {"machine.modbus_interface": "INFO"}
+    for name, name_level in (config.get("log_levels") or {}).items():
+        logging.getLogger(name).setLevel(name_level.upper() if isinstance(name_level, str) else name_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
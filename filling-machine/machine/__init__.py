@@ -2,6 +2,7 @@
 
 from .modbus_interface import ModbusInterface
 from .mqtt_client      import MqttClient
+from .scale_buffer     import ScaleBuffer, ScaleSample
 from .controller       import MachineController
 
-__all__ = ["ModbusInterface", "MqttClient", "MachineController"]
\ No newline at end of file
+__all__ = ["ModbusInterface", "MqttClient", "ScaleBuffer", "ScaleSample", "MachineController"]
\ No newline at end of file
@@ -0,0 +1,409 @@
+# machine/async_bus.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import struct
+import termios
+import tty
+from collections import deque
+
+import minimalmodbus
+
+from machine.bus_scheduler import PRIORITY_COMMAND, PRIORITY_CRITICAL, PRIORITY_REFRESH
+from machine.bus_stats import BusStats, classify_error
+from machine.clock import RealClock
+from machine.modbus_frames import (FrameError, decode_ascii, decode_rtu, encode_ascii,
+                                   encode_rtu, frame_length)
+from machine.modbus_interface import CommandShadow, ModbusInterface, port_settings
+
+logger = logging.getLogger(__name__)
+
+
+def _response_pdu_length(pdu: bytes) -> int:
+    """Length of the normal response PDU to request `pdu`."""
+    function = pdu[0]
+    if function in (1, 2):
+        return 2 + (struct.unpack(">H", pdu[3:5])[0] + 7) // 8
+    if function in (3, 4):
+        return 2 + 2 * struct.unpack(">H", pdu[3:5])[0]
+    return 5                          # 5, 6, 15, 16 echo the address and value/count
+
+
+def _rtu_length(frame: bytes) -> int:
+    """Length of the RTU response at the start of `frame`, or None until its header arrived."""
+    if len(frame) < 3:
+        return None
+    function = frame[1]
+    if function & 0x80:
+        return 5
+    if function in (1, 2, 3, 4):
+        return 5 + frame[2]
+    return 8
+
+
+class SerialLine:
+    """
+    One serial port driven from an asyncio event loop. The port is opened
+    non-blocking and read by the loop's reader callback, so waiting for a
+    response never blocks the loop and cancelling the waiting task abandons
+    the transaction on the spot. A response that may still arrive after
+    that is waited out and discarded before the next request, and RTU
+    requests keep the inter-frame gap after the previous response.
+    Transactions take turns on the line in priority order (PRIORITY_* of
+    the bus scheduler), in submission order within one priority.
+    """
+
+    def __init__(self, port: str, baudrate: int = 9600, ascii_mode: bool = False,
+                 timeout: float = 0.05, bits_per_char: int = 10):
+        """
+        Args:
+            port (str): Serial device, e.g. /dev/ttyCH9344USB1.
+            baudrate (int): Line speed, 8N1.
+            ascii_mode (bool): Modbus ASCII instead of RTU framing.
+            timeout (float): Device response timeout in seconds, on top of
+                the time the request and response take on the wire.
+        """
+        self.port       = port
+        self.baudrate   = baudrate
+        self.ascii_mode = ascii_mode
+        self.timeout    = timeout
+        self.char_time  = bits_per_char / baudrate
+        self.silence    = 0.0 if ascii_mode else max(3.5 * self.char_time, 0.00175)   # RTU inter-frame gap
+        self._fd        = None
+        self._loop      = None
+        self._rx        = bytearray()
+        self._data      = None        # asyncio.Event, set whenever bytes arrive
+        self._quiet_at  = 0.0         # loop time before which an abandoned response may arrive
+        self._busy      = False
+        self._waiting   = []          # heap of (priority, seq, future)
+        self._seq       = itertools.count()
+
+    def open(self) -> None:
+        """Open the port and start reading it. Call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._data = asyncio.Event()
+        self._fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self._fd)
+        attrs = termios.tcgetattr(self._fd)
+        attrs[2] |= termios.CLOCAL | termios.CREAD
+        attrs[4] = attrs[5] = getattr(termios, f"B{self.baudrate}")
+        termios.tcsetattr(self._fd, termios.TCSANOW, attrs)
+        termios.tcflush(self._fd, termios.TCIOFLUSH)
+        self._loop.add_reader(self._fd, self._on_readable)
+        logger.info("Opened %s at %s baud (%s) on the event loop",
+                    self.port, self.baudrate, "ASCII" if self.ascii_mode else "RTU")
+
+    def close(self) -> None:
+        """Stop reading and close the port. Call from the event loop."""
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._fd, 512)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error("Serial port %s failed: %s", self.port, e)
+            self._loop.remove_reader(self._fd)
+            return
+        self._rx += data
+        self._data.set()
+
+    async def _acquire(self, priority: int) -> None:
+        if not self._busy and not self._waiting:
+            self._busy = True
+            return
+        waiter = self._loop.create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()       # handed the line just as we were cancelled
+            raise
+
+    def _release(self) -> None:
+        while self._waiting:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._busy = False
+
+    async def exchange(self, address: int, pdu: bytes, priority: int = PRIORITY_COMMAND) -> bytes:
+        """
+        Send one request and return the response PDU.
+        Raises:
+            minimalmodbus.NoResponseError: if no complete response arrived in time.
+            minimalmodbus.InvalidResponseError: on a checksum, framing or echo error.
+            minimalmodbus.SlaveReportedException: if the device answered with an exception.
+        """
+        if self._fd is None:
+            raise minimalmodbus.NoResponseError(f"Serial port {self.port} is not open")
+        await self._acquire(priority)
+        try:
+            return await self._exchange(address, pdu)
+        finally:
+            self._release()
+
+    async def _exchange(self, address: int, pdu: bytes) -> bytes:
+        wait = self._quiet_at - self._loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._rx.clear()
+
+        frame = encode_ascii(address, pdu) if self.ascii_mode else encode_rtu(address, pdu)
+        response_chars = frame_length(_response_pdu_length(pdu), self.ascii_mode)
+        deadline = self._loop.time() + (len(frame) + response_chars) * self.char_time + self.timeout
+        try:
+            await self._send(frame)
+            reply = await asyncio.wait_for(self._receive(), max(0.0, deadline - self._loop.time()))
+        except asyncio.TimeoutError:
+            raise minimalmodbus.NoResponseError(f"No response from address {address} on {self.port}")
+        except asyncio.CancelledError:
+            self._quiet_at = deadline
+            raise
+        self._quiet_at = self._loop.time() + self.silence
+
+        try:
+            reply_address, reply = decode_ascii(reply) if self.ascii_mode else decode_rtu(reply)
+        except FrameError as e:
+            raise minimalmodbus.InvalidResponseError(f"Checksum or framing error on {self.port}: {e}")
+        if reply_address != address or reply[0] & 0x7F != pdu[0]:
+            raise minimalmodbus.InvalidResponseError(
+                f"Response from address {reply_address} function {reply[0]} on {self.port} "
+                f"does not match request to {address} function {pdu[0]}")
+        if reply[0] & 0x80:
+            raise minimalmodbus.SlaveReportedException(
+                f"Address {address} reported exception code {reply[1]} for function {pdu[0]}")
+        return reply
+
+    async def _send(self, frame: bytes) -> None:
+        view = memoryview(frame)
+        while view:
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                await asyncio.sleep(len(view) * self.char_time)
+
+    async def _receive(self) -> bytes:
+        while True:
+            if self.ascii_mode:
+                end = self._rx.find(b"\r\n")
+                length = None if end < 0 else end + 2
+            else:
+                length = _rtu_length(self._rx)
+            if length is not None and len(self._rx) >= length:
+                frame = bytes(self._rx[:length])
+                del self._rx[:length]
+                if self.ascii_mode:
+                    frame = frame[max(0, frame.rfind(b":")):]
+                return frame
+            self._data.clear()
+            await self._data.wait()
+
+
+class AsyncModbusInterface(CommandShadow):
+    """
+    asyncio counterpart of ModbusInterface for the AsyncRuntime: the same
+    devices, command shadow and transaction statistics, with coroutine
+    methods over one SerialLine per port instead of minimalmodbus
+    instruments and bus scheduler threads. Transactions on different ports
+    run concurrently. Each actuator is expected to have a single writer
+    task, which the runtime provides.
+    """
+
+    RELAY_CHANNELS = ModbusInterface.RELAY_CHANNELS
+    VALVE_LEFT     = ModbusInterface.VALVE_LEFT
+    VALVE_RIGHT    = ModbusInterface.VALVE_RIGHT
+
+    ADDRESSES = {"vfd": 2, "scale": 1, "valves": 1}
+
+    def __init__(self, config, lines: dict = None, clock: RealClock = None):
+        """
+        Args:
+            config: Config (or dict-like) providing ports and retries.
+            lines (dict): Optional prebuilt 'vfd', 'scale' and 'valves'
+                SerialLines; by default opened as given by `port_settings`.
+            clock (RealClock): Time source for latencies and keep-alives.
+        """
+        self.clock = clock or RealClock()
+        if lines is None:
+            lines, by_port = {}, {}
+            for device, (port, baudrate, timeout) in port_settings(config).items():
+                if port not in by_port:
+                    by_port[port] = SerialLine(port, baudrate, ascii_mode=device == "vfd", timeout=timeout)
+                lines[device] = by_port[port]
+        self.lines = lines
+
+        self.vfd_stop_command = config.get("vfd_stop_command")
+        self._scale_history   = deque(maxlen=5)
+        self._coil_mask       = 0
+        self.stats   = BusStats()
+        self.retries = config.get("modbus_retries", 0)
+        self._init_shadow(config.get("command_keepalive_interval", 1.0))
+
+    def open(self) -> None:
+        """Open every serial line. Call from the event loop."""
+        for line in set(self.lines.values()):
+            line.open()
+
+    def close(self) -> None:
+        """Close every serial line. Call from the event loop."""
+        for line in set(self.lines.values()):
+            line.close()
+        logger.info("Modbus transaction statistics:\n%s", self.stats.format())
+        logger.info("AsyncModbusInterface closed.")
+
+    def transaction_stats(self) -> dict:
+        """Transaction latency percentiles and failure counters, see BusStats.snapshot()."""
+        return self.stats.snapshot()
+
+    async def _request(self, device: str, op: str, pdu: bytes, priority: int) -> bytes:
+        """
+        One transaction with `device`, timed into `stats`, retrying timeouts
+        and checksum errors up to `retries` times. A cancelled transaction
+        is not recorded.
+        """
+        start   = self.clock()
+        attempt = 0
+        while True:
+            try:
+                reply = await self.lines[device].exchange(self.ADDRESSES[device], pdu, priority)
+            except Exception as e:
+                kind = classify_error(e)
+                self.stats.count(device, op, kind)
+                if kind == "error" or attempt >= self.retries:
+                    self.stats.record(device, op, self.clock() - start, ok=False)
+                    raise
+                attempt += 1
+                self.stats.count(device, op, "retry")
+                logger.debug("Retrying %s %s after %s (attempt %s)", device, op, kind, attempt)
+                continue
+            self.stats.record(device, op, self.clock() - start)
+            return reply
+
+    async def _read_registers(self, device: str, op: str, address: int, count: int, priority: int) -> tuple:
+        reply = await self._request(device, op, struct.pack(">BHH", 3, address, count), priority)
+        if reply[1] != 2 * count or len(reply) != 2 + 2 * count:
+            raise minimalmodbus.InvalidResponseError(f"Wrong byte count in {device} response: {reply.hex()}")
+        return struct.unpack(f">{count}H", reply[2:])
+
+    async def _write(self, device: str, op: str, key, value, pdu: bytes, urgent: bool) -> None:
+        """Send a register/coil write and record it in the command shadow."""
+        if urgent:
+            priority = PRIORITY_CRITICAL
+        elif self._refresh_only(key, value):
+            priority = PRIORITY_REFRESH
+        else:
+            priority = PRIORITY_COMMAND
+        try:
+            await self._request(device, op, pdu, priority)
+        except asyncio.CancelledError:
+            # The request may or may not have reached the device
+            self.invalidate_shadow(device)
+            raise
+        except Exception as e:
+            self.invalidate_shadow(device)
+            logger.error("Failed to write %s %s=%s: %s", device, op, value, e)
+            raise
+        self._shadow_store(key, value)
+
+    async def read_load_cell_sample(self) -> tuple:
+        """
+        Read the load cell and return both the raw and the smoothed weight.
+        Returns:
+            tuple: (raw weight, smoothed weight) in kilograms.
+        """
+        high, low = await self._read_registers("scale", "read", 0x0000, 2, PRIORITY_CRITICAL)
+        raw = (high << 16) | low
+        if raw > 0x7FFFFFFF:
+            raw -= 0x100000000
+        weight = raw / 1000.0
+        self._scale_history.append(weight)
+        return weight, sum(self._scale_history) / len(self._scale_history)
+
+    async def set_vfd_state(self, state: int) -> bool:
+        """
+        Write the VFD control register; the stop command goes at critical priority.
+        Returns:
+            bool: True if the register was written, False if skipped.
+        """
+        key = ("vfd", 0x2000)
+        if self._shadow_is_current(key, state):
+            return False
+        await self._write("vfd", "write_state", key, state, struct.pack(">BHH", 6, 0x2000, state),
+                          urgent=state == self.vfd_stop_command)
+        return True
+
+    async def set_vfd_speed(self, speed: int) -> bool:
+        """
+        Write the VFD speed reference (Hz × 100); zero goes at critical priority.
+        Returns:
+            bool: True if the register was written, False if skipped.
+        """
+        key = ("vfd", 0x2001)
+        if self._shadow_is_current(key, speed):
+            return False
+        await self._write("vfd", "write_speed", key, speed, struct.pack(">BHH", 6, 0x2001, speed),
+                          urgent=speed == 0)
+        return True
+
+    async def read_vfd_block(self) -> tuple:
+        """
+        Read the VFD control word, speed reference and status word in one transaction.
+        Returns:
+            tuple: (control, speed reference ×100, status) as read back from the drive.
+        """
+        return await self._read_registers("vfd", "read_block", 0x2000, 3, PRIORITY_REFRESH)
+
+    async def verify_vfd(self, state: int, speed: int) -> dict:
+        """
+        Read the drive back and rewrite only the registers that differ, as
+        ModbusInterface.verify_vfd does.
+        Returns:
+            dict: {'state', 'speed', 'status', 'written'}
+        """
+        control, reported_speed, status = await self.read_vfd_block()
+        written = []
+        for key, target, reported, write in ((("vfd", 0x2000), state, control, self.set_vfd_state),
+                                             (("vfd", 0x2001), speed, reported_speed, self.set_vfd_speed)):
+            if reported == target:
+                self._shadow_confirm(key, target)
+                continue
+            logger.warning("VFD register %#06x reads %s, expected %s; rewriting", key[1], reported, target)
+            with self._shadow_lock:
+                self._shadow.pop(key, None)
+            await write(target)
+            written.append(key[1])
+        return {"state": control, "speed": reported_speed, "status": status, "written": written}
+
+    async def set_valves(self, mask: int) -> bool:
+        """
+        Set every relay channel in one Write Multiple Coils transaction.
+        A mask that closes any open relay goes at critical priority.
+        Returns:
+            bool: True if the coils were written, False if skipped.
+        Raises:
+            ValueError: if mask does not fit the relay board.
+        """
+        if not 0 <= mask < (1 << self.RELAY_CHANNELS):
+            raise ValueError(f"Valve mask out of range: {mask}")
+        closing = bool(self._coil_mask & ~mask)
+        self._coil_mask = mask
+        key = ("valves", "mask")
+        if self._shadow_is_current(key, mask):
+            return False
+        nbytes = (self.RELAY_CHANNELS + 7) // 8
+        pdu = struct.pack(">BHHB", 15, 0x0000, self.RELAY_CHANNELS, nbytes) + mask.to_bytes(nbytes, "little")
+        await self._write("valves", "write_mask", key, mask, pdu, urgent=closing)
+        return True
@@ -0,0 +1,389 @@
+# machine/async_runtime.py
+
+import asyncio
+import inspect
+import logging
+import queue
+import threading
+from functools import partial
+
+from minimalmodbus import NoResponseError
+
+from machine.async_bus import AsyncModbusInterface
+
+logger = logging.getLogger(__name__)
+
+
+class MqttBridge:
+    """
+    MQTT client as seen from the control loop: `publish` only queues the
+    message and a forwarding thread hands it to the real MqttClient, so
+    spool writes and socket calls never hold up the loop.
+    """
+
+    def __init__(self, mqtt):
+        self.mqtt    = mqtt
+        self._queue  = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._forward, name="mqtt-bridge", daemon=True)
+        self._thread.start()
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        self._queue.put((topic, payload, qos, retain))
+
+    def _forward(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            try:
+                self.mqtt.publish(*message)
+            except Exception:
+                logger.exception("MQTT publish failed (%s)", message[0])
+
+    def disconnect(self):
+        """Forward what is already queued, then disconnect the client."""
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+        self.mqtt.disconnect()
+
+
+class AsyncRuntime:
+    """
+    Runs a MachineController on one asyncio event loop instead of a thread
+    per loop. The scale, VFD, valve, monitor and filling loops, the initial
+    tare and the clean cycle are tasks on a single control thread, over an
+    AsyncModbusInterface, so controller state is only touched between
+    their await points and stopping cancels them along with any bus
+    transaction in flight.
+    Other threads reach the controller through `submit()` (ControllerProxy
+    does so for the UI) and MQTT goes out through a MqttBridge. The
+    watchdog stays a thread of its own, so it still notices the event loop
+    itself stalling.
+    """
+
+    def __init__(self, controller, bus: AsyncModbusInterface):
+        """
+        Args:
+            controller (MachineController): Built with `bus` as its modbus
+                interface and a MqttBridge as its MQTT client; not started.
+            bus (AsyncModbusInterface): The machine's devices.
+        """
+        self.controller  = controller
+        self.bus         = bus
+        self._commands   = queue.SimpleQueue()
+        self._loop       = None
+        self._loop_ident = None
+        self._thread     = None
+        self._started    = threading.Event()
+        self._failed     = False
+        self._stop_lock  = threading.Lock()
+        self._stopped    = False
+        self._stopping   = None
+        self._tasks      = []
+        self._clean_task = None
+        self._vfd_wake   = None
+        self._valve_wake = None
+        self._sample     = None       # asyncio.Event, replaced after every scale sample
+
+    def start(self) -> None:
+        """Start the control thread and its tasks."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="control-loop", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._failed:
+            raise RuntimeError("Control loop failed to start")
+
+    def stop(self) -> None:
+        """
+        Cancel the control tasks, bring the outputs to a safe state and
+        close the controller. Blocks until done; later calls do nothing.
+        """
+        with self._stop_lock:
+            if self._thread is None or self._stopped:
+                return
+            self._stopped = True
+        if not self._failed:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self.controller.kill_all.set()
+        self.controller.close()
+        logger.info("AsyncRuntime: stopped")
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        """
+        Run `fn(*args, **kwargs)` on the control thread. Safe to call from
+        any thread; calls made before `start()` run once the loop is up.
+        """
+        self._commands.put((fn, args, kwargs))
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._drain_commands)
+        except RuntimeError:
+            logger.warning("Control loop stopped; dropped %s", getattr(fn, "__name__", fn))
+
+    def start_clean_cycle(self) -> None:
+        self.submit(self._start_clean)
+
+    def stop_clean_cycle(self) -> None:
+        self.submit(self._stop_clean)
+
+    def _run(self) -> None:
+        try:
+            asyncio.run(self._main())
+        except Exception:
+            self._failed = True
+            logger.exception("Control loop failed")
+        finally:
+            self._started.set()
+
+    async def _main(self) -> None:
+        ctrl = self.controller
+        self._loop       = asyncio.get_running_loop()
+        self._loop_ident = threading.get_ident()
+        self.bus.open()
+        self._stopping   = asyncio.Event()
+        self._vfd_wake   = asyncio.Event()
+        self._valve_wake = asyncio.Event()
+        self._sample     = asyncio.Event()
+        ctrl._setpoint_hook = self._setpoint_changed
+        self._tasks = [asyncio.create_task(coro, name=name) for name, coro in (
+            ("scale", self._scale()), ("vfd", self._vfd()), ("valves", self._valves()),
+            ("monitor", self._monitor()), ("filling", self._filling()), ("tare", self._initial_tare()),
+        )]
+        if ctrl.trace is not None:
+            ctrl.trace.start(ctrl.trace_meta())
+        ctrl._filling_event.set()
+        self._started.set()
+        logger.info("AsyncRuntime: control tasks started")
+        self._drain_commands()
+        await self._stopping.wait()
+        await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        ctrl = self.controller
+        tasks = self._tasks + ([self._clean_task] if self._clean_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        ctrl._setpoint_hook = None
+
+        ctrl.vfd_speed = 0
+        ctrl.vfd_state = ctrl.vfd_stop_cmd
+        ctrl.valve1 = False
+        ctrl.valve2 = False
+        async def stop_vfd():
+            await self.bus.set_vfd_state(ctrl.vfd_stop_cmd)
+            await self.bus.set_vfd_speed(0)
+        for result in await asyncio.gather(stop_vfd(), self.bus.set_valves(0), return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error("Failed to stop an output on shutdown: %s", result)
+        self.bus.close()
+
+    def _drain_commands(self) -> None:
+        while True:
+            try:
+                fn, args, kwargs = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Error in command %s", getattr(fn, "__name__", fn))
+
+    def _setpoint_changed(self, pending: str) -> None:
+        wake = self._vfd_wake if pending == "_vfd_pending" else self._valve_wake
+        if threading.get_ident() == self._loop_ident:
+            wake.set()
+        else:
+            self._loop.call_soon_threadsafe(wake.set)
+
+    @staticmethod
+    async def _due(schedule) -> None:
+        """Sleep until the schedule's next deadline and count the run."""
+        while not schedule.poll():
+            await asyncio.sleep(schedule.remaining())
+
+    @staticmethod
+    async def _changed_or_due(schedule, wake: asyncio.Event) -> None:
+        """Sleep until a setpoint change sets `wake` or the schedule's next deadline."""
+        if not wake.is_set():
+            try:
+                await asyncio.wait_for(wake.wait(), schedule.remaining())
+            except asyncio.TimeoutError:
+                pass
+        wake.clear()
+
+    async def _next_sample(self, timeout: float) -> None:
+        """Sleep until the next scale sample, at most `timeout` seconds."""
+        try:
+            await asyncio.wait_for(self._sample.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _scale(self) -> None:
+        ctrl = self.controller
+        schedule = ctrl.loops.schedule("scale", ctrl._scale_interval)
+        while True:
+            try:
+                ctrl._record_sample(*await self.bus.read_load_cell_sample())
+                sample, self._sample = self._sample, asyncio.Event()
+                sample.set()
+            except NoResponseError as e:
+                logger.debug("Scale no response: %s", e)
+            except Exception:
+                logger.exception("Error in scale task")
+            await self._due(schedule)
+
+    async def _vfd(self) -> None:
+        ctrl = self.controller
+        schedule = ctrl.loops.schedule("vfd", ctrl._vfd_interval)
+        verify_due = 0.0
+        while True:
+            await self._changed_or_due(schedule, self._vfd_wake)
+            with ctrl._vfd_cond:
+                changed = ctrl._vfd_pending
+                ctrl._vfd_pending = False
+                state, speed = ctrl._vfd_state, ctrl._vfd_speed
+            if not schedule.poll() and not changed:
+                continue
+            try:
+                if not ctrl._vfd_verify or changed:
+                    await self.bus.set_vfd_state(state)
+                    await self.bus.set_vfd_speed(speed)
+                    verify_due = 0.0
+                elif ctrl._clock() >= verify_due:
+                    reported = await self.bus.verify_vfd(state, speed)
+                    ctrl.vfd_reported = (reported["state"], reported["speed"], reported["status"])
+                    verify_due = ctrl._clock() + ctrl._vfd_verify_interval
+                ctrl._feed_watchdog("modbus_vfd")
+            except NoResponseError as e:
+                logger.debug("VFD no response: %s", e)
+            except Exception:
+                logger.exception("Error in VFD task")
+
+    async def _valves(self) -> None:
+        ctrl = self.controller
+        schedule = ctrl.loops.schedule("valves", ctrl._valve_interval)
+        while True:
+            await self._changed_or_due(schedule, self._valve_wake)
+            with ctrl._valve_cond:
+                changed = ctrl._valve_pending
+                ctrl._valve_pending = False
+                valve1, valve2 = ctrl._valve1, ctrl._valve2
+            if not schedule.poll() and not changed:
+                continue
+            try:
+                await self.bus.set_valves((self.bus.VALVE_LEFT if valve1 else 0) |
+                                          (self.bus.VALVE_RIGHT if valve2 else 0))
+                ctrl._feed_watchdog("modbus_valve")
+            except NoResponseError as e:
+                logger.debug("Valve no response: %s", e)
+            except Exception:
+                logger.exception("Error in valve task")
+
+    async def _monitor(self) -> None:
+        ctrl = self.controller
+        schedule = ctrl.loops.schedule("monitor", ctrl._telemetry_tick)
+        while True:
+            ctrl._publish_telemetry()
+            await self._due(schedule)
+
+    async def _filling(self) -> None:
+        ctrl = self.controller
+        while True:
+            if ctrl._cleaning_active:
+                await asyncio.sleep(ctrl._read_interval)
+                continue
+            ctrl._fill_tick()
+            await self._next_sample(ctrl._fsm.idle_time(ctrl._read_interval))
+
+    async def _initial_tare(self) -> None:
+        ctrl = self.controller
+        try:
+            await asyncio.sleep(ctrl.initial_tare_delay)
+            watch = ctrl.stability.watch(ctrl.scale_buffer, ctrl._settle_timeout)
+            result = watch.poll()
+            while result is None:
+                await self._next_sample(max(0.0, watch.deadline - ctrl._clock()))
+                result = watch.poll()
+            ctrl._apply_initial_tare(ctrl._settle_result(result, ctrl._settle_timeout))
+        except Exception:
+            logger.exception("Initial tare failed")
+
+    def _start_clean(self) -> None:
+        if self._clean_task is not None and not self._clean_task.done():
+            return  # already cleaning
+        self._clean_task = asyncio.create_task(self._clean(), name="clean")
+        logger.info("Cleaning cycle started")
+
+    def _stop_clean(self) -> None:
+        ctrl = self.controller
+        if self._clean_task is not None:
+            self._clean_task.cancel()
+        ctrl.vfd_state = ctrl.vfd_stop_cmd
+        ctrl.vfd_speed = 0
+        def close_valves():
+            ctrl.valve1 = False
+            ctrl.valve2 = False
+            logger.info("Cleaning cycle stopped: valves closed")
+        self._loop.call_later(ctrl.config.get("clean_stop_delay"), close_valves)
+        logger.info("Cleaning cycle stop initiated")
+
+    async def _clean(self) -> None:
+        """The controller's clean cycle; stopped by cancelling it."""
+        ctrl = self.controller
+        cfg = ctrl.config
+        ctrl._cleaning_active = True
+        try:
+            ctrl.valve1 = True
+            await asyncio.sleep(cfg.get("clean_initial_delay"))
+            ctrl.clean_speed = cfg.get("clean_speed")
+            ctrl.vfd_state = ctrl.vfd_run_cmd
+            ctrl.vfd_speed = int(ctrl.clean_speed * 100)
+            left_open = True
+            while True:
+                ctrl.clean_speed = cfg.get("clean_speed")
+                ctrl.vfd_speed = int(ctrl.clean_speed * 100)
+                if left_open:
+                    ctrl.valve2 = True
+                    await asyncio.sleep(cfg.get("clean_toggle_delay"))
+                    ctrl.valve1 = False
+                else:
+                    ctrl.valve1 = True
+                    await asyncio.sleep(cfg.get("clean_toggle_delay"))
+                    ctrl.valve2 = False
+                left_open = not left_open
+                await asyncio.sleep(cfg.get("clean_interval"))
+        finally:
+            logger.info("Exiting clean loop")
+            ctrl._cleaning_active = False
+
+
+class ControllerProxy:
+    """
+    What the Tk UI holds instead of the MachineController while an
+    AsyncRuntime runs it. Attribute reads go straight to the controller,
+    as they did from the UI thread before; method calls and assignments
+    are queued to the control thread, and start/stop and the clean cycle
+    are the runtime's.
+    """
+
+    _RUNTIME_METHODS = ("start", "stop", "start_clean_cycle", "stop_clean_cycle")
+
+    def __init__(self, runtime: AsyncRuntime):
+        object.__setattr__(self, "_runtime", runtime)
+
+    def __getattr__(self, name):
+        if name in self._RUNTIME_METHODS:
+            return getattr(self._runtime, name)
+        value = getattr(self._runtime.controller, name)
+        if inspect.ismethod(value):
+            return partial(self._runtime.submit, value)
+        return value
+
+    def __setattr__(self, name, value):
+        self._runtime.submit(setattr, self._runtime.controller, name, value)
@@ -0,0 +1,176 @@
+# machine/benchmark.py
+
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+from machine.clock import RealClock
+from machine.compensation import OvershootCompensation
+from machine.controller import MachineController
+from machine.cycle_record import CycleRecord, CycleWriter
+from machine.flow_split import FlowSplit
+from machine.modbus_interface import ModbusInterface
+from machine.simulation import BusMeter, NullMqtt, SimulatedPlant
+from machine.trace import TraceRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class TrayOperator:
+    """
+    Plays the operator: puts an empty tray on the scale whenever the
+    controller waits for one and takes it off once both moulds are filled,
+    recording the true product mass of every mould.
+    """
+
+    def __init__(self, controller: MachineController, plant: SimulatedPlant, delay: float = 0.5):
+        self.controller = controller
+        self.plant      = plant
+        self.delay      = delay
+        self.cycles     = []          # (placed_at, removed_at, {'left': kg, 'right': kg}, target)
+        self._placed_at = None
+        self._next_place = 0.0
+
+    def step(self, now: float) -> None:
+        ctrl = self.controller
+        if self.plant.tray_weight is None:
+            if ctrl._state == ctrl.STATE_WAITING_FOR_MOULD and ctrl._initial_tare_done and now >= self._next_place:
+                self.plant.place_tray(ctrl.mould_weight)
+                self._placed_at = now
+        elif ctrl._state == ctrl.STATE_WAIT_REMOVAL:
+            poured = self.plant.remove_tray()
+            self.cycles.append((self._placed_at, now, poured, ctrl.desired_volume))
+            self._next_place = now + self.delay
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarise(cycles: list, meter: BusMeter, modbus: ModbusInterface) -> dict:
+    """
+    Reduce recorded tray cycles to throughput, accuracy and bus figures.
+    """
+    report = {"trays": len(cycles)}
+    if cycles:
+        elapsed = cycles[-1][1] - cycles[0][0]
+        report["trays_per_hour"] = 3600.0 * len(cycles) / elapsed if elapsed > 0 else 0.0
+        report["cycle_time_mean"] = sum(c[1] - c[0] for c in cycles) / len(cycles)
+        errors = [poured[side] - target for _, _, poured, target in cycles for side in ("left", "right")]
+        mean = sum(errors) / len(errors)
+        report["error_mean"] = mean
+        report["error_std"]  = math.sqrt(sum((e - mean) ** 2 for e in errors) / len(errors))
+        report["error_min"]  = min(errors)
+        report["error_max"]  = max(errors)
+        report["error_p95_abs"] = _percentile([abs(e) for e in errors], 0.95)
+    report["bus_utilisation"] = meter.utilisation()
+    report["bus_transactions"] = dict(meter.count)
+    report["command_shadow"] = modbus.shadow_stats()
+    report["bus_queueing"] = modbus.scheduler_stats()
+    report["transactions"] = modbus.transaction_stats()
+    return report
+
+
+def run_benchmark(config, trays: int = 5, plant_options: dict = None,
+                  latency: float = 0.005, operator_delay: float = 0.5,
+                  flavour: str = None, timeout: float = None, clock: RealClock = None,
+                  scratch_dir: str = None, trace_dir: str = None) -> dict:
+    """
+    Drive a MachineController against a SimulatedPlant for `trays` cycles.
+    Args:
+        config (Config): Machine configuration (poll intervals, speeds, ...).
+        trays (int): Number of tray cycles to run.
+        plant_options (dict): Keyword arguments for SimulatedPlant.
+        latency (float): Simulated device turnaround per transaction (s).
+        operator_delay (float): Time between removing a tray and placing the next (s).
+        flavour (str): Flavour to select, or None for the default.
+        timeout (float): Give up after this many seconds; default scales with `trays`.
+        clock (RealClock): Time base of the whole run; a SimClock (created in
+            the calling thread) runs it as fast as the host can compute.
+        scratch_dir (str): Where the run keeps its learned tables and cycle
+            records; by default a temporary directory removed afterwards.
+        trace_dir (str): Keep a trace of the run in this directory; no trace
+            is recorded otherwise.
+    Returns:
+        dict: Report as produced by `summarise`.
+    """
+    options = {"run_command": config.get("vfd_run_command")}
+    options.update(plant_options or {})
+    clock  = clock or RealClock()
+    plant  = SimulatedPlant(clock=clock, **options)
+    meter  = BusMeter(clock)
+    modbus = ModbusInterface(config, instruments=plant.instruments(meter, latency=latency, sleep=clock.sleep),
+                             clock=clock)
+    controller = MachineController(config, modbus, NullMqtt(), clock=clock)
+
+    # Never learn into the machine's real compensation/flow split tables or records
+    scratch = scratch_dir or tempfile.mkdtemp(prefix="filler-bench-")
+    try:
+        controller.compensation = OvershootCompensation(os.path.join(scratch, "compensation.json"))
+        controller.flow_split = FlowSplit(os.path.join(scratch, "flow_split.json"),
+                                          fixed=config.get("parallel_fill_split", {}))
+        controller.cycle_writer = CycleWriter(os.path.join(scratch, "records"),
+                                              CycleRecord.columns(controller.CYCLE_EVENTS))
+        controller.trace = TraceRecorder(trace_dir, controller._fsm.states) if trace_dir else None
+        if flavour:
+            controller.select_flavour(flavour)
+
+        operator = TrayOperator(controller, plant, operator_delay)
+        deadline = clock() + (timeout if timeout is not None else 60.0 * trays + 30.0)
+        controller.start()
+        try:
+            while len(operator.cycles) < trays and clock() < deadline:
+                operator.step(clock())
+                clock.sleep(0.02)
+        finally:
+            stopper = clock.thread(controller.stop)
+            stopper.start()
+            clock.join(stopper, timeout=5.0)
+            modbus.close()
+
+        if len(operator.cycles) < trays:
+            logger.warning("Benchmark timed out after %s of %s trays", len(operator.cycles), trays)
+        report = summarise(operator.cycles, meter, modbus)
+        report["trace"] = controller.trace.path if controller.trace is not None else None
+        report["loops"] = controller.loops.stats()
+        return report
+    finally:
+        if scratch_dir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def format_report(report: dict) -> str:
+    """Render a benchmark report as plain text."""
+    lines = [f"Trays completed:   {report['trays']}"]
+    if report["trays"]:
+        lines += [
+            f"Trays per hour:    {report['trays_per_hour']:.1f}",
+            f"Mean cycle time:   {report['cycle_time_mean']:.2f} s",
+            f"Mould error (g):   mean {report['error_mean'] * 1000:+.1f}  std {report['error_std'] * 1000:.1f}  "
+            f"min {report['error_min'] * 1000:+.1f}  max {report['error_max'] * 1000:+.1f}  "
+            f"p95|e| {report['error_p95_abs'] * 1000:.1f}",
+        ]
+    for device, fraction in sorted(report["bus_utilisation"].items()):
+        lines.append(f"Bus {device:<7}       {fraction * 100:5.1f}% busy, "
+                     f"{report['bus_transactions'].get(device, 0)} transactions")
+    if report.get("trace"):
+        lines.append(f"Trace:             {report['trace']}")
+    shadow = report["command_shadow"]
+    lines.append(f"Command shadow:    {shadow['written']} written, {shadow['skipped']} skipped")
+    for name, s in report.get("transactions", {}).items():
+        lines.append(f"Latency {name:<17} n={s['count']} p50 {s['p50'] * 1000:.1f} ms p99 {s['p99'] * 1000:.1f} ms "
+                     f"max {s['max'] * 1000:.1f} ms, {s['timeout']} timeouts, {s['crc']} CRC, {s['retry']} retries")
+    for name, s in report.get("loops", {}).items():
+        lines.append(f"Loop {name:<8}     period {s['period'] * 1000:.1f} ms, {s['runs']} runs, {s['missed']} missed, "
+                     f"jitter p99 {s['jitter_p99'] * 1000:.1f} ms max {s['jitter_max'] * 1000:.1f} ms")
+    for port, classes in sorted(report.get("bus_queueing", {}).items()):
+        for name, s in classes.items():
+            if s["count"] or s["dropped"]:
+                lines.append(f"Queue {port:<6} {name:<8} n={s['count']} wait mean {s['wait_mean'] * 1000:.1f} ms "
+                             f"max {s['wait_max'] * 1000:.1f} ms, {s['late']} late, "
+                             f"{s['dropped']} dropped, {s['coalesced']} coalesced")
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+# machine/bus_calibration.py
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEVICES = ("vfd", "scale", "valves")
+
+# Config keys each device's calibrated timing is written to
+CONFIG_KEYS = {
+    "vfd":    ("vfd_poll_interval", "vfd_timeout"),
+    "scale":  ("scale_poll_interval", "scale_timeout"),
+    "valves": ("valve_poll_interval", "valve_timeout"),
+}
+
+DEFAULT_INTERVALS = (0.1, 0.05, 0.03, 0.02, 0.015, 0.01, 0.005, 0.002, 0.0)
+DEFAULT_TIMEOUTS  = (0.1, 0.05, 0.03, 0.02, 0.01)
+
+
+def measure(modbus, device: str, interval: float, timeout: float, transactions: int) -> dict:
+    """
+    Run `transactions` read-only probes against `device` at the given
+    spacing and response timeout.
+    Returns:
+        dict: {'interval', 'timeout', 'errors', 'error_rate', 'p99'}; p99 is
+              the transaction time in seconds, excluding the spacing.
+    """
+    modbus.set_timing(device, interval=interval, timeout=timeout)
+    # Let late replies to the previous step drain and its spacing lapse
+    time.sleep(max(interval, timeout))
+    modbus.stats.discard(device, "probe")
+    errors = 0
+    for _ in range(transactions):
+        try:
+            modbus.probe(device)
+        except Exception as e:
+            errors += 1
+            logger.debug("Probe of %s failed at interval=%s timeout=%s: %s", device, interval, timeout, e)
+    latency = modbus.transaction_stats().get(f"{device}/probe", {})
+    return {
+        "interval":   interval,
+        "timeout":    timeout,
+        "errors":     errors,
+        "error_rate": errors / transactions if transactions else 0.0,
+        "p99":        latency.get("p99", 0.0),
+    }
+
+
+def calibrate_device(modbus, device: str, intervals=DEFAULT_INTERVALS, timeouts=DEFAULT_TIMEOUTS,
+                     transactions: int = 100, target_error_rate: float = 0.01,
+                     margin: float = 1.2) -> dict:
+    """
+    Find the fastest stable timing for one device.
+    Steps the transaction spacing down from the slowest candidate with the
+    most generous timeout and keeps the last spacing whose error rate stays
+    within `target_error_rate`. It then does the same for the response
+    timeout at that spacing. Both results are widened by `margin`.
+    Returns:
+        dict: {'interval', 'timeout', 'error_rate', 'p99', 'steps': [measure() results]},
+              or None if even the slowest candidate misses the target.
+    """
+    intervals = sorted(intervals, reverse=True)
+    timeouts  = sorted(timeouts, reverse=True)
+    steps = []
+
+    best = None
+    for interval in intervals:
+        result = measure(modbus, device, interval, timeouts[0], transactions)
+        steps.append(result)
+        logger.info("Calibrating %s: interval %.3fs -> %.1f%% errors", device, interval, result["error_rate"] * 100)
+        if result["error_rate"] > target_error_rate:
+            break
+        best = result
+    if best is None:
+        logger.error("Calibration of %s failed: %.1f%% errors at the slowest interval",
+                     device, steps[0]["error_rate"] * 100)
+        return None
+
+    for timeout in timeouts[1:]:
+        result = measure(modbus, device, best["interval"], timeout, transactions)
+        steps.append(result)
+        logger.info("Calibrating %s: timeout %.3fs -> %.1f%% errors", device, timeout, result["error_rate"] * 100)
+        if result["error_rate"] > target_error_rate:
+            break
+        best = result
+
+    return {
+        "interval":   round(best["interval"] * margin, 4),
+        "timeout":    round(best["timeout"] * margin, 4),
+        "error_rate": best["error_rate"],
+        "p99":        best["p99"],
+        "steps":      steps,
+    }
+
+
+def calibrate_bus(modbus, devices=DEVICES, **options) -> dict:
+    """
+    Calibrate each device in turn (see `calibrate_device`). Retries are
+    disabled while measuring so the raw error rate is seen, and each
+    device's original timing is restored once it has been measured.
+    Returns:
+        dict: device -> calibrate_device() result.
+    """
+    retries, modbus.retries = modbus.retries, 0
+    results = {}
+    try:
+        for device in devices:
+            interval, timeout = modbus.timing(device)
+            try:
+                results[device] = calibrate_device(modbus, device, **options)
+            finally:
+                modbus.set_timing(device, interval=interval, timeout=timeout)
+    finally:
+        modbus.retries = retries
+    return results
+
+
+def apply_calibration(config, results: dict) -> dict:
+    """
+    Write calibrated intervals and timeouts into `config` (in memory; call
+    `config.save()` to persist). Devices that failed calibration are left alone.
+    Returns:
+        dict: The config keys that were set.
+    """
+    changed = {}
+    for device, result in results.items():
+        if result is None:
+            continue
+        interval_key, timeout_key = CONFIG_KEYS[device]
+        changed[interval_key] = result["interval"]
+        changed[timeout_key]  = result["timeout"]
+    for key, value in changed.items():
+        config.set(key, value)
+    return changed
@@ -0,0 +1,244 @@
+# machine/bus_scheduler.py
+
+import logging
+
+from machine.clock import RealClock
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+PRIORITY_CRITICAL = 0       # stop the pump, close a valve, the next scale sample
+PRIORITY_COMMAND  = 1       # setpoint changes
+PRIORITY_REFRESH  = 2       # keep-alive rewrites and status polls
+
+PRIORITY_NAMES = {
+    PRIORITY_CRITICAL: "critical",
+    PRIORITY_COMMAND:  "command",
+    PRIORITY_REFRESH:  "refresh",
+}
+
+# Default time, from when its device may transmit, by which a transaction should start (s)
+DEFAULT_DEADLINES = {
+    PRIORITY_CRITICAL: 0.02,
+    PRIORITY_COMMAND:  0.1,
+    PRIORITY_REFRESH:  1.0,
+}
+
+
+class TransactionDropped(Exception):
+    """Raised by `Transaction.result` when the transaction never reached the bus."""
+
+
+class Transaction:
+    """
+    One queued bus transaction; a minimal future the submitter waits on.
+    """
+
+    def __init__(self, func, device: str, priority: int, deadline: float,
+                 key=None, drop_late: bool = False, submitted: float = None, seq: int = 0,
+                 clock: RealClock = None):
+        self.func      = func
+        self.device    = device
+        self.priority  = priority
+        self.deadline  = deadline
+        self.key       = key
+        self.drop_late = drop_late
+        self.submitted = submitted
+        self.seq       = seq
+        self.started   = None
+        self._done     = (clock or RealClock()).event()
+        self._result   = None
+        self._error    = None
+
+    def sort_key(self) -> tuple:
+        """Priority class first, then earliest deadline, then submission order."""
+        return (self.priority, self.deadline, self.seq)
+
+    def _finish(self, result=None, error: BaseException = None) -> None:
+        self._result, self._error = result, error
+        self._done.set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def result(self, timeout: float = None):
+        """
+        Wait for the transaction and return what its function returned.
+        Raises:
+            TimeoutError: if it has not completed within `timeout`.
+            TransactionDropped: if it was superseded or expired unsent.
+            Exception: whatever the transaction itself raised.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.device} transaction not completed within {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class BusScheduler:
+    """
+    Serialises every transaction on one serial port through a single worker
+    thread. Pending transactions run most urgent priority class first and,
+    within a class, earliest deadline first, so a stop-pump write or the
+    next scale sample never waits behind a keep-alive refresh.
+
+    Each device on the port keeps a minimum interval between the starts of
+    its own transactions (`intervals`), a fixed rate that the transaction
+    time does not stretch; while one device is still spacing, ready work
+    for another device on the same port goes ahead. A write submitted
+    with the `key` of a still-queued write replaces it: the older write is
+    superseded and the newer one inherits its place in the queue.
+    The queue rarely holds more than a handful of entries, so it is a plain
+    list scanned for the best ready transaction rather than a heap.
+    """
+
+    def __init__(self, name: str, intervals: dict = None, deadlines: dict = None,
+                 clock: RealClock = None):
+        self.name       = name
+        self.intervals  = {device: interval or 0.0 for device, interval in (intervals or {}).items()}
+        self.deadlines  = dict(DEFAULT_DEADLINES)
+        self.deadlines.update(deadlines or {})
+        self._clock     = clock or RealClock()
+        self._cond      = self._clock.condition()
+        self._pending   = []
+        self._ready_at  = {}        # device -> earliest start of its next transaction
+        self._seq       = 0
+        self._closed    = False
+        self._stats     = {p: self._empty_stats() for p in PRIORITY_NAMES}
+        self._thread    = self._clock.thread(self._run, name=f"bus-{name}")
+        self._thread.start()
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {"count": 0, "wait_total": 0.0, "wait_max": 0.0,
+                "late": 0, "dropped": 0, "coalesced": 0}
+
+    def submit(self, func, device: str, priority: int = PRIORITY_COMMAND,
+               key=None, deadline: float = None, drop_late: bool = False) -> Transaction:
+        """
+        Queue `func()` to run on the bus worker.
+        Args:
+            func (callable): Performs the transaction; its return value is the result.
+            device (str): Device on this port, for per-device spacing.
+            priority (int): One of the PRIORITY_* classes.
+            key: Register/coil identity; a queued write with the same key is superseded.
+            deadline (float): Seconds by which it should start once the device
+                may transmit; defaults to the priority class deadline.
+            drop_late (bool): Give up instead of running once the deadline has passed.
+        Returns:
+            Transaction: Future for the result.
+        Raises:
+            RuntimeError: if the scheduler has been closed.
+        """
+        now = self._clock()
+        budget = self.deadlines[priority] if deadline is None else deadline
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Bus scheduler {self.name} is closed")
+            # Waits and deadlines count from when the device's spacing allows it to transmit
+            eligible = max(now, self._ready_at.get(device, now))
+            self._seq += 1
+            txn = Transaction(func, device, priority, eligible + budget, key, drop_late, eligible,
+                              self._seq, self._clock)
+            if key is not None:
+                for index, old in enumerate(self._pending):
+                    if old.key == key:
+                        txn.priority  = min(txn.priority, old.priority)
+                        txn.deadline  = min(txn.deadline, old.deadline)
+                        txn.submitted = old.submitted
+                        txn.drop_late = txn.drop_late and old.drop_late
+                        self._pending[index] = txn
+                        self._stats[old.priority]["coalesced"] += 1
+                        old._finish(error=TransactionDropped(f"{device} write {key!r} superseded"))
+                        break
+                else:
+                    self._pending.append(txn)
+            else:
+                self._pending.append(txn)
+            self._cond.notify()
+        return txn
+
+    def call(self, func, device: str, priority: int = PRIORITY_COMMAND, key=None,
+             deadline: float = None, drop_late: bool = False, timeout: float = None):
+        """Submit `func` and wait for its result (see `submit` and `Transaction.result`)."""
+        return self.submit(func, device, priority, key, deadline, drop_late).result(timeout)
+
+    def _next_ready(self, now: float):
+        """Pop the most urgent transaction whose device may transmit; else the time to wait."""
+        best, wake = None, None
+        for txn in self._pending:
+            ready_at = self._ready_at.get(txn.device, now)
+            if ready_at > now:
+                wake = ready_at if wake is None else min(wake, ready_at)
+            elif best is None or txn.sort_key() < best.sort_key():
+                best = txn
+        if best is not None:
+            self._pending.remove(best)
+            return best, None
+        return None, (None if wake is None else wake - now)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    txn, wait = self._next_ready(self._clock())
+                    if txn is not None:
+                        break
+                    self._cond.wait(wait)
+            self._execute(txn)
+
+    def _execute(self, txn: Transaction) -> None:
+        now = self._clock()
+        stats = self._stats[txn.priority]
+        if now > txn.deadline:
+            if txn.drop_late:
+                with self._cond:
+                    stats["dropped"] += 1
+                txn._finish(error=TransactionDropped(f"{txn.device} transaction expired unsent"))
+                return
+            with self._cond:
+                stats["late"] += 1
+        txn.started = now
+        wait = max(0.0, now - txn.submitted)
+        with self._cond:
+            stats["count"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+        with self._cond:
+            self._ready_at[txn.device] = now + self.intervals.get(txn.device, 0.0)
+        try:
+            result, error = txn.func(), None
+        except Exception as e:
+            result, error = None, e
+        txn._finish(result, error)
+
+    def stats(self) -> dict:
+        """
+        Queueing latency per priority class.
+        Returns:
+            dict: {class name: {'count', 'wait_mean', 'wait_max', 'late',
+                   'dropped', 'coalesced'}} with waits in seconds.
+        """
+        with self._cond:
+            report = {}
+            for priority, name in PRIORITY_NAMES.items():
+                s = self._stats[priority]
+                report[name] = {
+                    "count":     s["count"],
+                    "wait_mean": s["wait_total"] / s["count"] if s["count"] else 0.0,
+                    "wait_max":  s["wait_max"],
+                    "late":      s["late"],
+                    "dropped":   s["dropped"],
+                    "coalesced": s["coalesced"],
+                }
+            return report
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Refuse new work, let the worker drain the queue and exit."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._clock.join(self._thread, timeout)
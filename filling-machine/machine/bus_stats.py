@@ -0,0 +1,141 @@
+# machine/bus_stats.py
+
+import threading
+
+import minimalmodbus
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram over integer microseconds.
+    Values are kept in log-linear buckets: each power-of-two range is split
+    into 2**(`sub_bits` - 1) equal sub-buckets, so every recorded value is known to
+    within 1 / 2**(sub_bits - 1) of itself (about 3% at the default) whether
+    it is 200 us or 2 s, in a fixed few hundred counters.
+    """
+
+    def __init__(self, sub_bits: int = 5, max_value_us: int = 60_000_000):
+        self.sub_bits   = sub_bits
+        self._half      = 1 << (sub_bits - 1)
+        self._counts    = [0] * (self._index(max_value_us) + 1)
+        self._max_index = len(self._counts) - 1
+        self.count      = 0
+        self.total_us   = 0
+        self.min_us     = None
+        self.max_us     = 0
+
+    def _index(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.sub_bits)
+        return shift * self._half + (value >> shift)
+
+    def _upper(self, index: int) -> int:
+        """Largest value that falls into bucket `index`."""
+        shift = max(0, index // self._half - 1)
+        return ((index - shift * self._half + 1) << shift) - 1
+
+    def record(self, seconds: float) -> None:
+        value = max(0, int(seconds * 1e6))
+        self._counts[min(self._index(value), self._max_index)] += 1
+        self.count    += 1
+        self.total_us += value
+        self.min_us    = value if self.min_us is None else min(self.min_us, value)
+        self.max_us    = max(self.max_us, value)
+
+    def percentile(self, fraction: float) -> float:
+        """Value (s) at or below which `fraction` of the recordings fall."""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(fraction * self.count)))
+        seen = 0
+        for index, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                if index == self._max_index:          # overflow bucket
+                    return self.max_us / 1e6
+                return min(self._upper(index), self.max_us) / 1e6
+        return self.max_us / 1e6
+
+    def summary(self) -> dict:
+        """{'count', 'mean', 'p50', 'p90', 'p99', 'max'} with times in seconds."""
+        return {
+            "count": self.count,
+            "mean":  self.total_us / self.count / 1e6 if self.count else 0.0,
+            "p50":   self.percentile(0.50),
+            "p90":   self.percentile(0.90),
+            "p99":   self.percentile(0.99),
+            "max":   self.max_us / 1e6,
+        }
+
+
+def classify_error(error: BaseException) -> str:
+    """Counter name for a failed transaction: 'timeout', 'crc' or 'error'."""
+    if isinstance(error, minimalmodbus.NoResponseError):
+        return "timeout"
+    if isinstance(error, minimalmodbus.InvalidResponseError):
+        if "checksum" in str(error).lower():
+            return "crc"
+    return "error"
+
+
+class BusStats:
+    """
+    Transaction latency and failure counters per (device, operation), e.g.
+    ('scale', 'read') or ('vfd', 'write_speed'). Latency covers the whole
+    transaction on the wire, including retries; failed attempts are counted
+    as 'timeout', 'crc' or 'error', and every repeat attempt as 'retry'.
+    """
+
+    COUNTERS = ("ok", "timeout", "crc", "error", "retry")
+
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._entries = {}
+
+    def _entry(self, device: str, op: str) -> dict:
+        key = (device, op)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {"latency": LatencyHistogram(), **{name: 0 for name in self.COUNTERS}}
+            self._entries[key] = entry
+        return entry
+
+    def record(self, device: str, op: str, seconds: float, ok: bool = True) -> None:
+        """Record one completed (or finally failed) transaction."""
+        with self._lock:
+            entry = self._entry(device, op)
+            entry["latency"].record(seconds)
+            if ok:
+                entry["ok"] += 1
+
+    def count(self, device: str, op: str, counter: str) -> None:
+        """Bump one of the failure counters ('timeout', 'crc', 'error', 'retry')."""
+        with self._lock:
+            self._entry(device, op)[counter] += 1
+
+    def discard(self, device: str, op: str) -> None:
+        """Forget everything recorded for one device/operation."""
+        with self._lock:
+            self._entries.pop((device, op), None)
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: {'device/op': {'count', 'mean', 'p50', 'p90', 'p99', 'max',
+                   'ok', 'timeout', 'crc', 'error', 'retry'}} with times in seconds.
+        """
+        with self._lock:
+            report = {}
+            for (device, op), entry in sorted(self._entries.items()):
+                stats = entry["latency"].summary()
+                stats.update((name, entry[name]) for name in self.COUNTERS)
+                report[f"{device}/{op}"] = stats
+            return report
+
+    def format(self) -> str:
+        """One line per device/operation, times in milliseconds."""
+        lines = []
+        for name, s in self.snapshot().items():
+            lines.append(f"{name:<18} n={s['count']} p50={s['p50'] * 1000:.1f}ms p99={s['p99'] * 1000:.1f}ms "
+                         f"max={s['max'] * 1000:.1f}ms timeout={s['timeout']} crc={s['crc']} "
+                         f"error={s['error']} retry={s['retry']}")
+        return "\n".join(lines)
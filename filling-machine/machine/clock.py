@@ -0,0 +1,319 @@
+# machine/clock.py
+
+import threading
+import time
+
+
+class RealClock:
+    """
+    Time source and blocking primitives of the controller stack, backed by
+    `time` and `threading`. Calling the clock returns monotonic seconds, so
+    it fits wherever a `clock=time.monotonic` callable is taken. Components
+    that sleep, wait or start threads do so through their clock, so that a
+    SimClock can run the same code faster than real time.
+    """
+
+    def __call__(self) -> float:
+        return time.monotonic()
+
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+    def time(self) -> float:
+        """Wall-clock (epoch) seconds, for timestamps people read."""
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def event(self):
+        return threading.Event()
+
+    def condition(self):
+        return threading.Condition()
+
+    def rlock(self):
+        return threading.RLock()
+
+    def thread(self, target, name: str = None, daemon: bool = True) -> threading.Thread:
+        return threading.Thread(target=target, name=name, daemon=daemon)
+
+    def timer(self, delay: float, function):
+        """Thread calling `function` after `delay` seconds unless cancelled first."""
+        return threading.Timer(delay, function)
+
+    def join(self, thread: threading.Thread, timeout: float = None) -> None:
+        thread.join(timeout)
+
+
+class _Waiter:
+    """One thread blocked on a SimClock until `ready()` or its deadline."""
+
+    __slots__ = ("ready", "deadline", "counted", "woken", "ok", "cond")
+
+    def __init__(self, ready, deadline, counted, cond):
+        self.ready    = ready
+        self.deadline = deadline
+        self.counted  = counted
+        self.woken    = False
+        self.ok       = False
+        self.cond     = cond
+
+
+class SimClock(RealClock):
+    """
+    Discrete-event clock. Simulated time stands still while any of its
+    threads runs and jumps straight to the earliest pending timeout once
+    all of them are blocked in `sleep`, `join` or on one of its events,
+    conditions or locks, so a shift of controller, bus and plant threads
+    takes only as long as their computation.
+    Its threads are the one that created the clock and those made with
+    `thread()` or `timer()`. Blocking on anything else (a plain lock, real
+    I/O) holds simulated time still until it returns, and other threads
+    may use the clock's primitives without holding time back.
+    """
+
+    def __init__(self, start: float = 0.0, epoch: float = None):
+        """
+        Args:
+            start (float): Initial monotonic time.
+            epoch (float): Wall-clock time at `start`; defaults to now.
+        """
+        self._now     = start
+        self._epoch   = time.time() - start if epoch is None else epoch - start
+        self._lock    = threading.Lock()
+        self._waiters = []
+        self._threads = {threading.get_ident()}
+        self._active  = 1             # clock threads not blocked on the clock
+
+    def __call__(self) -> float:
+        return self._now
+
+    def monotonic_ns(self) -> int:
+        return round(self._now * 1e9)
+
+    def time(self) -> float:
+        return self._epoch + self._now
+
+    def sleep(self, seconds: float) -> None:
+        self._block(lambda: False, max(0.0, seconds))
+
+    def event(self):
+        return _SimEvent(self)
+
+    def condition(self):
+        return _SimCondition(self)
+
+    def rlock(self):
+        return _SimRLock(self)
+
+    def thread(self, target, name: str = None, daemon: bool = True) -> threading.Thread:
+        return _SimThread(self, target, name, daemon)
+
+    def timer(self, delay: float, function):
+        cancelled = self.event()
+        def run():
+            if not cancelled.wait(delay):
+                function()
+        timer = self.thread(run)
+        timer.cancel = cancelled.set
+        return timer
+
+    def join(self, thread: threading.Thread, timeout: float = None) -> None:
+        if isinstance(thread, _SimThread):
+            if not self._block(lambda: thread.finished, timeout):
+                return
+        thread.join(timeout)
+
+    def _block(self, ready, timeout: float = None) -> bool:
+        """
+        Wait until `ready()` is true or `timeout` simulated seconds pass.
+        `ready` is evaluated under the clock lock, by whichever thread
+        changed something, and may claim what it waited for (a lock).
+        Returns:
+            bool: True if ready, False on timeout.
+        """
+        with self._lock:
+            if ready():
+                return True
+            if timeout is not None and timeout <= 0:
+                return False
+            waiter = _Waiter(ready, None if timeout is None else self._now + timeout,
+                             threading.get_ident() in self._threads, threading.Condition(self._lock))
+            self._waiters.append(waiter)
+            if waiter.counted:
+                self._active -= 1
+                self._advance_if_idle()
+            while not waiter.woken:
+                waiter.cond.wait()
+            self._waiters.remove(waiter)
+            return waiter.ok
+
+    def _wake(self) -> None:
+        """Release every waiter that is now ready or past its deadline. Call with the lock held."""
+        for waiter in self._waiters:
+            if waiter.woken:
+                continue
+            if waiter.ready():
+                waiter.ok = True
+            elif waiter.deadline is None or waiter.deadline > self._now:
+                continue
+            waiter.woken = True
+            if waiter.counted:
+                self._active += 1
+            waiter.cond.notify()
+
+    def _advance_if_idle(self) -> None:
+        """Once every clock thread is blocked, jump to the next deadline. Call with the lock held."""
+        while self._active == 0:
+            due = [w.deadline for w in self._waiters if not w.woken and w.deadline is not None]
+            if not due:
+                return                # only a thread outside the clock can end this wait
+            self._now = max(self._now, min(due))
+            self._wake()
+
+
+class _SimThread(threading.Thread):
+
+    def __init__(self, clock: SimClock, target, name: str, daemon: bool):
+        super().__init__(target=target, name=name, daemon=daemon)
+        self._clock   = clock
+        self.finished = False
+
+    def start(self) -> None:
+        # Counted from here, so time cannot move on before the thread first runs
+        with self._clock._lock:
+            self._clock._active += 1
+        try:
+            super().start()
+        except Exception:
+            with self._clock._lock:
+                self._clock._active -= 1
+                self._clock._advance_if_idle()
+            raise
+
+    def run(self) -> None:
+        clock = self._clock
+        with clock._lock:
+            clock._threads.add(threading.get_ident())
+        try:
+            super().run()
+        finally:
+            with clock._lock:
+                clock._threads.discard(threading.get_ident())
+                self.finished = True
+                clock._active -= 1
+                clock._wake()
+                clock._advance_if_idle()
+
+
+class _SimEvent:
+
+    def __init__(self, clock: SimClock):
+        self._clock = clock
+        self._flag  = False
+
+    def is_set(self) -> bool:
+        return self._flag
+
+    def set(self) -> None:
+        with self._clock._lock:
+            self._flag = True
+            self._clock._wake()
+
+    def clear(self) -> None:
+        self._flag = False
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._clock._block(lambda: self._flag, timeout)
+
+
+class _SimRLock:
+
+    def __init__(self, clock: SimClock):
+        self._clock = clock
+        self._owner = None
+        self._count = 0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        me = threading.get_ident()
+        def take():
+            if self._owner is None or self._owner == me:
+                self._owner = me
+                self._count += 1
+                return True
+            return False
+        if not blocking:
+            with self._clock._lock:
+                return take()
+        return self._clock._block(take, None if timeout < 0 else timeout)
+
+    def release(self) -> None:
+        with self._clock._lock:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("cannot release un-acquired lock")
+            self._count -= 1
+            if self._count == 0:
+                self._owner = None
+                self._clock._wake()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def _release_all(self) -> int:
+        with self._clock._lock:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("cannot wait on un-acquired lock")
+            count, self._count, self._owner = self._count, 0, None
+            self._clock._wake()
+        return count
+
+    def _restore(self, count: int) -> None:
+        self.acquire()
+        self._count = count
+
+
+class _SimCondition:
+
+    def __init__(self, clock: SimClock):
+        self._clock      = clock
+        self._lock       = _SimRLock(clock)
+        self._generation = 0
+
+    def __enter__(self) -> bool:
+        return self._lock.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
+
+    def wait(self, timeout: float = None) -> bool:
+        generation = self._generation
+        count = self._lock._release_all()
+        try:
+            return self._clock._block(lambda: self._generation != generation, timeout)
+        finally:
+            self._lock._restore(count)
+
+    def wait_for(self, predicate, timeout: float = None):
+        deadline = None if timeout is None else self._clock() + timeout
+        result = predicate()
+        while not result:
+            wait = None
+            if deadline is not None:
+                wait = deadline - self._clock()
+                if wait <= 0:
+                    break
+            self.wait(wait)
+            result = predicate()
+        return result
+
+    def notify(self, n: int = 1) -> None:
+        self.notify_all()
+
+    def notify_all(self) -> None:
+        with self._clock._lock:
+            self._generation += 1
+            self._clock._wake()
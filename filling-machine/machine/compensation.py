@@ -0,0 +1,103 @@
+# machine/compensation.py
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OvershootCompensation:
+    """
+    Learned stop-early offsets, keyed by flavour, side and speed profile.
+    Each entry is an exponentially weighted estimate of how far the settled
+    pour lands past the point the pump was stopped for. Subtracting it from
+    the target on the next fill cancels the systematic overshoot. The table
+    is persisted as JSON so learning survives restarts.
+    """
+
+    def __init__(self, path: str, alpha: float = 0.3, max_offset: float = 0.1):
+        self._path       = path
+        self.alpha       = alpha
+        self.max_offset  = max_offset
+        self._lock       = threading.Lock()
+        self._dirty      = False
+        self._table      = self._load()
+
+    @staticmethod
+    def key(flavour: str, side: str, profile: str) -> str:
+        """Table key for one flavour/side/speed-profile combination."""
+        return f"{flavour}/{side}/{profile}"
+
+    def _load(self) -> dict:
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable compensation table %r: %s", self._path, e)
+            return {}
+        table = {}
+        for key, entry in data.items():
+            try:
+                table[key] = {"offset": float(entry["offset"]), "count": int(entry["count"])}
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Ignoring malformed compensation entry %r", key)
+        logger.info("Loaded %s compensation entries from %s", len(table), self._path)
+        return table
+
+    def offset(self, flavour: str, side: str, profile: str) -> float:
+        """
+        Stop-early offset (kg) for the next fill; 0.0 until something was learned.
+        """
+        with self._lock:
+            entry = self._table.get(self.key(flavour, side, profile))
+            return entry["offset"] if entry else 0.0
+
+    def update(self, flavour: str, side: str, profile: str, overshoot: float) -> float:
+        """
+        Fold a measured overshoot into the estimate.
+        Args:
+            overshoot (float): Settled pour minus the target the pump was
+                stopped for (kg); negative for an underfill.
+        Returns:
+            float: The new offset, clamped to ±max_offset.
+        """
+        key = self.key(flavour, side, profile)
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is None:
+                offset = overshoot
+                count = 1
+            else:
+                offset = (1 - self.alpha) * entry["offset"] + self.alpha * overshoot
+                count = entry["count"] + 1
+            offset = max(-self.max_offset, min(self.max_offset, offset))
+            self._table[key] = {"offset": offset, "count": count}
+            self._dirty = True
+        logger.info("Compensation %s: overshoot=%+.3f offset=%+.3f n=%s", key, overshoot, offset, count)
+        return offset
+
+    def snapshot(self) -> dict:
+        """Copy of the current table, in the form `save()` writes."""
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._table.items()}
+
+    def save(self) -> None:
+        """Write the table to disk if it changed; the file is replaced atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._table)
+            self._dirty = False
+        tmp = self._path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.error("Failed to save compensation table %r: %s", self._path, e)
+            with self._lock:
+                self._dirty = True
@@ -1,9 +1,10 @@
 # machine/controller.py
 
+import json
 import threading
-import time
 import logging
 from datetime import datetime
+from functools import partial
 from typing import Any
 
 import minimalmodbus
@@ -12,15 +13,37 @@ from minimalmodbus import NoResponseError
 from config import Config
 from machine.modbus_interface import ModbusInterface
 from machine.mqtt_client import MqttClient
-
-import gpiod
-
-chip = gpiod.Chip('gpiochip0')
-left_button_line = chip.get_line(17)
-right_button_line = chip.get_line(18)
-
-left_button_line.request(consumer="left_button", type=gpiod.LINE_REQ_DIR_IN, flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
-right_button_line.request(consumer="right_button", type=gpiod.LINE_REQ_DIR_IN, flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+from machine.scale_buffer import ScaleBuffer
+from machine.flow import FlowEstimator
+from machine.flow_control import PIController, flow_setpoint
+from machine.compensation import OvershootCompensation
+from machine.flow_split import FlowSplit
+from machine.periodic import PeriodicScheduler
+from machine.speed_profile import RampLimiter, SpeedProfile, legacy_profile
+from machine.clock import RealClock
+from machine.cycle_record import CycleRecord, CycleWriter
+from machine.stability import StabilityDetector
+from machine.state_machine import State, StateMachine
+from machine.telemetry import TelemetryPublisher
+from machine.trace import TraceRecorder
+
+logger = logging.getLogger(__name__)
+
+# Manual top-up buttons are optional so the controller can run off the
+# machine (tests, simulation); without them the buttons read as released
+try:
+    import gpiod
+
+    chip = gpiod.Chip('gpiochip0')
+    left_button_line = chip.get_line(17)
+    right_button_line = chip.get_line(18)
+
+    left_button_line.request(consumer="left_button", type=gpiod.LINE_REQ_DIR_IN, flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+    right_button_line.request(consumer="right_button", type=gpiod.LINE_REQ_DIR_IN, flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+except (ImportError, OSError) as e:
+    logger.warning("GPIO buttons unavailable, manual top-up buttons disabled: %s", e)
+    left_button_line = None
+    right_button_line = None
 
 class MachineController:
     """
@@ -35,11 +58,33 @@ class MachineController:
     STATE_FILL_RIGHT_FAST  = "fill_right_fast"
     STATE_FILL_RIGHT_SLOW  = "fill_right_slow"
     STATE_WAIT_REMOVAL     = "wait_removal"
+    STATE_FILL_BOTH        = "fill_both"
 
-    def __init__(self, config: Config, modbus: ModbusInterface, mqtt: MqttClient):
+    # Timestamped events of a tray cycle, in order, for production records
+    CYCLE_EVENTS = (
+        STATE_CONFIRMING_MOULD, STATE_FILL_LEFT_FAST, STATE_FILL_LEFT_SLOW, "left_cutoff",
+        STATE_PREP_RIGHT, STATE_FILL_RIGHT_FAST, STATE_FILL_RIGHT_SLOW, "right_cutoff",
+        STATE_WAIT_REMOVAL, STATE_FILL_BOTH,
+    )
+
+    def __init__(self, config: Config, modbus: ModbusInterface, mqtt: MqttClient, clock: RealClock = None):
         self.config = config
         self.modbus = modbus
         self.mqtt   = mqtt
+        # Time source, sleeps, waits and threads of every loop; a SimClock
+        # runs the controller faster than real time
+        self._clock = clock or RealClock()
+        self.trace  = None       # TraceRecorder, set up below if configured
+
+        # Setpoint change notification for the actuator threads; must exist
+        # before the setpoint properties below are first assigned
+        self._vfd_cond      = self._clock.condition()
+        self._valve_cond    = self._clock.condition()
+        self._vfd_pending   = False
+        self._valve_pending = False
+        # Called with the pending flag's name after every setpoint change,
+        # by runtimes whose actuator loops do not wait on the conditions
+        self._setpoint_hook = None
         
         # VFD command codes from config
         self.vfd_run_cmd  = config.get("vfd_run_command")
@@ -53,6 +98,7 @@ class MachineController:
         self.valve1         = False      # left valve state
         self.valve2         = False      # right valve state
         self.actual_weight  = 0.0        # last read weight
+        self.flavour        = "Food_Service"
         self.desired_volume = config.get("Food_Service")
         # Tare weight for the default flavour
         self.mould_weight   = config.mould_weights.get("Food_Service")
@@ -62,34 +108,98 @@ class MachineController:
         self._mould_tol        = config.get("mould_tolerance")      # ±10% example
         self._fill_tol         = config.get("fill_tolerance")       # ±15%
         self._removal_tol      = config.get("removal_tolerance")    # e.g. 0.02 kg
-        self._read_interval    = config.get("controller_interval")    # e.g. 0.1s
+        self._read_interval    = config.get("controller_interval", 0.05)  # max time between fill ticks
         self._valve_delay      = config.get("valve_start_delay")    # e.g. 0.1s
         self._post_fill_delay  = config.get("post_fill_delay")      # e.g. 1.0s
-        self._confirm_readings = config.get("confirm_readings")     # e.g. 3
-        self._confirm_removals = config.get("confirm_removals")     # e.g. 3
-
-        # Modbus polling intervals
+        # How long a mould reading / an empty scale must hold before it is
+        # believed, in seconds. Older configs count readings instead, which
+        # were taken `controller_interval` apart.
+        self._confirm_mould_time   = config.get(
+            "confirm_mould_time", (config.get("confirm_readings", 3) - 1) * self._read_interval)   # e.g. 0.1s
+        self._confirm_removal_time = config.get(
+            "confirm_removal_time", (config.get("confirm_removals", 30) - 1) * self._read_interval)  # e.g. 1.5s
+
+        # Modbus polling intervals; every periodic loop runs on a fixed
+        # monotonic schedule whose jitter and missed deadlines are kept in
+        # `loops`. The scale is read once per `scale_poll_interval`.
         self._vfd_interval   = config.get("vfd_interval")    # e.g. 0.05s
-        self._scale_interval = config.get("scale_interval")  # e.g. 0.02s
+        self._scale_interval = config.get("scale_poll_interval")  # e.g. 0.03s
         self._valve_interval = config.get("valve_interval")  # e.g. 0.1s
+        self.loops           = PeriodicScheduler(self._clock)
+        # Refresh the VFD by reading back its control/speed/status block and
+        # rewriting only what differs, instead of blindly rewriting both,
+        # once per `vfd_verify_interval` and once after every change
+        self._vfd_verify     = config.get("vfd_verify", False)
+        self._vfd_verify_interval = config.get("vfd_verify_interval", 1.0)
+        self.vfd_reported    = None      # (control, speed reference ×100, status) last read back
+
+        # Timestamped history of every scale read; consumers average new
+        # samples from here instead of sleeping and re-reading actual_weight
+        self.scale_buffer    = ScaleBuffer(config.get("scale_buffer_size", 512), clock=self._clock)
+
+        # Settling: wait until the scale is statistically stable rather than
+        # for a fixed time, capped at `_settle_timeout`
+        self.stability = StabilityDetector(
+            samples=config.get("stable_samples", 8),
+            max_std=config.get("stable_max_std", 0.003),
+            max_slope=config.get("stable_max_slope", 0.01),
+        )
+        self._settle_timeout = config.get("settle_timeout", 3.0)
+
+        # Telemetry: per-field topics on change, one combined message per
+        # interval and a retained snapshot for late subscribers
+        self._telemetry_tick = config.get("telemetry_tick", 0.1)
+        self.telemetry = TelemetryPublisher(
+            mqtt,
+            interval=config.get("telemetry_interval", 1.0),
+            snapshot_interval=config.get("telemetry_snapshot_interval", 30.0),
+            deadbands=config.get("telemetry_deadbands", {}),
+            encoding=config.get("telemetry_encoding", "json"),
+            clock=self._clock,
+            wall_clock=self._clock.time,
+        )
+        # Bus transaction statistics (latency percentiles, error counters)
+        # are published every `bus_stats_interval` seconds; None disables
+        self._bus_stats_interval = config.get("bus_stats_interval", 60.0)
+        self._bus_stats_sent     = self._clock()
 
         self.speed_fast        = config.get("fast_speed")           # e.g. 150.0 Hz
         self.speed_slow        = config.get("slow_speed")           # e.g. 50.0 Hz
+        # Per-flavour speed profile from config.json; None runs the
+        # fast/slow pair above. Speed changes are rate-limited if it says so.
+        self.speed_profile     = self._load_speed_profile(self.flavour)
+        self._ramp             = RampLimiter()
+
+        # Optional closed-loop flow control: a PI loop trims the pump speed
+        # so the measured flow tracks a setpoint derived from the remaining
+        # mass, holding the fill profile through viscosity changes
+        self.flow_control      = config.get("flow_control", False)
+        self._flow_max         = config.get("flow_setpoint_max", 0.3)      # kg/s
+        self._flow_min         = config.get("flow_setpoint_min", 0.02)     # kg/s
+        self._flow_approach    = config.get("flow_approach_time", 1.5)     # s
+        self._flow_pi          = PIController(
+            kp=config.get("flow_kp", 20.0),                                # Hz per kg/s
+            ki=config.get("flow_ki", 40.0),                                # Hz per kg/s per s
+            out_min=config.get("flow_min_speed", 1.0),                     # Hz
+            out_max=self.speed_fast,
+        )
         # Cleaning speed (Hz), configurable via UI and config.json
         self.clean_speed       = config.get("clean_speed")
 
-        # State machine internals
-        self._state         = self.STATE_WAITING_FOR_MOULD
+        # State machine internals; the loop ticks the table-driven machine
+        # and in-state waits are timers or settle watches, never sleeps
+        self._fsm           = self._build_fill_machine()
+        self._settle        = None       # SettleWatch of the current state, if any
         self._tare_weight   = 0.0
         self._baseline_empty = 0.0
-        self._consec_count  = 0
+        self._empty_since   = None       # when the scale last started reading empty
 
         # Thread control
-        self.kill_all       = threading.Event()
+        self.kill_all       = self._clock.event()
         self._threads       = []
         
         # Cleaning control
-        self._clean_stop   = threading.Event()
+        self._clean_stop   = self._clock.event()
         self._clean_thread = None
         self._cleaning_active = False
 
@@ -102,7 +212,7 @@ class MachineController:
         self._last_right_pour = 0.0
 
         # Fill activation event, only start filling when UI Fill tab selected
-        self._filling_event = threading.Event()
+        self._filling_event = self._clock.event()
         
         # Manual top-up button state
         self._left_button_active = False
@@ -122,33 +232,178 @@ class MachineController:
 
         # store last “beat” timestamp per thread
         self._last_heartbeat = {
-            "modbus_vfd": time.time(),
-            "modbus_valve": time.time(),
-            "modbus_scale": time.time(),
+            "modbus_vfd": self._clock(),
+            "modbus_valve": self._clock(),
+            "modbus_scale": self._clock(),
         }
         self.watchdog_ok = True
 
-        self._watchdog_thread = threading.Thread(
-            target=self._watchdog_loop, daemon=True
-        )
+        self._watchdog_thread = self._clock.thread(self._watchdog_loop)
         self._watchdog_thread.start()
 
         # Adaptive filling configuration
         self.adaptive_filling = config.get("adaptive_filling", False)
 
+        # Predictive cut-off: stop the pump early by the mass still in flight
+        # (flow rate × lag between stop command and the scale seeing flow end)
+        self.predictive_cutoff = config.get("predictive_cutoff", False)
+        self._cutoff_lag       = config.get("cutoff_lag", 0.25)        # seconds
+        self._valve_cutoff_lag = config.get("valve_cutoff_lag", 0.1)   # seconds, valve closed with pump running
+        self.flow_estimator    = FlowEstimator(config.get("flow_window", 0.5))
+        self.flow_rate         = 0.0                                    # kg/s, last estimate
+
+        # Learned per-flavour overshoot, applied as a stop-early offset
+        self.compensation = OvershootCompensation(
+            config.sibling_path(config.get("compensation_file", "compensation.json")),
+            alpha=config.get("compensation_alpha", 0.3),
+            max_offset=config.get("compensation_max_offset", 0.1),
+        )
+        self._applied_offset = {"left": 0.0, "right": 0.0}
+        self._last_overshoot = {"left": None, "right": None}
+
+        # Parallel fill: both valves open at once for the listed flavours,
+        # each mould's share of the weight taken from the learned flow split.
+        # Until each side has enough single-valve measurements, and for one
+        # tray every `_parallel_recalibrate`, trays are filled in sequence.
+        self.parallel_flavours     = set(config.get("parallel_fill_flavours", []))
+        self._parallel_min_samples = config.get("parallel_fill_min_samples", 3)
+        self._parallel_recalibrate = config.get("parallel_fill_recalibrate", 20)
+        self.flow_split = FlowSplit(
+            config.sibling_path(config.get("flow_split_file", "flow_split.json")),
+            alpha=config.get("flow_split_alpha", 0.2),
+            fixed=config.get("parallel_fill_split", {}),
+        )
+        self._parallel       = False     # current tray is filled in parallel
+        self._parallel_trays = 0         # parallel trays since the last sequential one
+        self._lead_pour      = None      # estimated pour of the mould closed first
+
+        # Per-tray production records, written to daily files off-thread
+        self._cycle = None
+        self.cycle_writer = CycleWriter(
+            config.sibling_path(config.get("cycle_record_dir", "records")),
+            CycleRecord.columns(self.CYCLE_EVENTS),
+            flush_interval=config.get("cycle_flush_interval", 5.0),
+            parquet=config.get("cycle_parquet", False),
+        )
+        self._fsm.add_listener(self._record_transition)
+
+        # Binary trace of scale samples, setpoints and transitions for
+        # replaying incidents; a new file per run and per flavour
+        trace_dir = config.get("trace_dir")
+        if trace_dir:
+            self.trace = TraceRecorder(config.sibling_path(trace_dir), self._fsm.states,
+                                       keep=config.get("trace_keep", 50))
+
         # Initial tare configuration
         self.initial_tare_delay = config.get("initial_tare_delay", 2.0)
-        self.initial_tare_samples = config.get("initial_tare_samples", 10)
+        if config.get("initial_tare_samples") is not None:
+            logger.warning("initial_tare_samples is no longer used; the initial tare "
+                           "waits for stable_samples settled readings instead")
         self._initial_tare_done = False
 
+    def _update_setpoint(self, attr: str, value, cond: threading.Condition, pending: str) -> None:
+        """
+        Store a new actuator setpoint and wake the actuator thread if it changed.
+        """
+        with cond:
+            if getattr(self, attr, None) == value:
+                return
+            setattr(self, attr, value)
+            setattr(self, pending, True)
+            cond.notify_all()
+        if self._setpoint_hook is not None:
+            self._setpoint_hook(pending)
+        if self.trace is not None:
+            self.trace.setpoint(self._clock(), attr.lstrip("_"), value)
+
+    @property
+    def vfd_state(self) -> int:
+        """VFD control command the VFD thread keeps on the bus."""
+        return self._vfd_state
+
+    @vfd_state.setter
+    def vfd_state(self, value: int) -> None:
+        self._update_setpoint("_vfd_state", value, self._vfd_cond, "_vfd_pending")
+
+    @property
+    def vfd_speed(self) -> int:
+        """VFD speed reference (Hz × 100) the VFD thread keeps on the bus."""
+        return self._vfd_speed
+
+    @vfd_speed.setter
+    def vfd_speed(self, value: int) -> None:
+        self._update_setpoint("_vfd_speed", value, self._vfd_cond, "_vfd_pending")
+
+    @property
+    def valve1(self) -> bool:
+        """Left valve setpoint."""
+        return self._valve1
+
+    @valve1.setter
+    def valve1(self, value: bool) -> None:
+        self._update_setpoint("_valve1", value, self._valve_cond, "_valve_pending")
+
+    @property
+    def valve2(self) -> bool:
+        """Right valve setpoint."""
+        return self._valve2
+
+    @valve2.setter
+    def valve2(self, value: bool) -> None:
+        self._update_setpoint("_valve2", value, self._valve_cond, "_valve_pending")
+
+    @property
+    def _state(self) -> str:
+        """Current state of the fill state machine."""
+        return self._fsm.state
+
+    @_state.setter
+    def _state(self, value: str) -> None:
+        self._fsm.reset(value)
+
+    def _wake_actuators(self) -> None:
+        """Wake both actuator threads, e.g. so they notice kill_all."""
+        for cond in (self._vfd_cond, self._valve_cond):
+            with cond:
+                cond.notify_all()
+
     def select_flavour(self, name: str) -> None:
         """
         Change target volume and mould weight based on flavour.
         """
+        self.flavour        = name
         self.desired_volume = self.config.get(name)
         # Update mould weight from nested mould_weights
         self.mould_weight   = self.config.mould_weights.get(name)
-        logging.info(f"Flavour selected: {name}, volume={self.desired_volume}, mould={self.mould_weight}")
+        self.speed_profile  = self._load_speed_profile(name)
+        logger.info("Flavour selected: %s, volume=%s, mould=%s", name, self.desired_volume, self.mould_weight)
+        if self.trace is not None and self.trace.path is not None:
+            self.trace.start(self.trace_meta())
+
+    def trace_meta(self) -> dict:
+        """State a trace starts from: everything the replay needs besides the records."""
+        return {
+            "flavour":        self.flavour,
+            "desired_volume": self.desired_volume,
+            "mould_weight":   self.mould_weight,
+            "state":          self._state,
+            "baseline_empty": self._baseline_empty,
+            "tare_weight":    self._tare_weight,
+            "compensation":   self.compensation.snapshot(),
+            "flow_split":     self.flow_split.snapshot(),
+            "config":         self.config.as_dict(),
+            "started":        self._clock.time(),
+        }
+
+    def _load_speed_profile(self, flavour: str) -> SpeedProfile:
+        spec = self.config.speed_profile(flavour)
+        if spec is None:
+            return None
+        try:
+            return SpeedProfile.from_config(spec)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Invalid speed profile for %s, using fast/slow speeds: %s", flavour, e)
+            return None
 
     def enable_filling(self) -> None:
         """Allow filling loop to start after UI Fill tab selected."""
@@ -160,6 +415,8 @@ class MachineController:
         How much has been poured into the left mould so far.
         Retained after fill until tray removal.
         """
+        if self._state == self.STATE_FILL_BOTH:
+            return self._parallel_pour("left")
         # During left fill phases, compute live pour
         if self._left_tare is not None and self._state in (self.STATE_FILL_LEFT_FAST, self.STATE_FILL_LEFT_SLOW):
             poured = self.actual_weight - self._left_tare
@@ -173,6 +430,8 @@ class MachineController:
         How much has been poured into the right mould so far.
         Retained after fill until tray removal.
         """
+        if self._state == self.STATE_FILL_BOTH:
+            return self._parallel_pour("right")
         # During right fill phases, compute live pour
         if self._right_tare is not None and self._state in (self.STATE_FILL_RIGHT_FAST, self.STATE_FILL_RIGHT_SLOW):
             poured = self.actual_weight - self._right_tare
@@ -180,6 +439,11 @@ class MachineController:
         # Otherwise, use last recorded pour
         return self._last_right_pour
 
+    def _parallel_pour(self, side: str) -> float:
+        """Estimated pour into `side` while both valves are open."""
+        poured = (self.actual_weight - self._tare_weight) * self.flow_split.share(self.flavour, side)
+        return max(0.0, min(self.desired_volume, poured))
+
     @property
     def mould_tare_weight(self) -> float:
         """Weight of tray + moulds when first placed (before filling)."""
@@ -188,12 +452,12 @@ class MachineController:
     def start_manual_topup(self, side: str, initiated_by_ui: bool = False):
         """Directly activate manual top-up for the given side, setting valve and VFD."""
         if side == "left":
-            logging.info(f"Manual LEFT top-up activated ({'UI' if initiated_by_ui else 'Button'}).")
+            logger.info("Manual LEFT top-up activated (%s).", 'UI' if initiated_by_ui else 'Button')
             self.valve1 = True
             self.vfd_state = self.vfd_run_cmd
             self.vfd_speed = int(self.speed_slow * 100)
         elif side == "right":
-            logging.info(f"Manual RIGHT top-up activated ({'UI' if initiated_by_ui else 'Button'}).")
+            logger.info("Manual RIGHT top-up activated (%s).", 'UI' if initiated_by_ui else 'Button')
             self.valve2 = True
             self.vfd_state = self.vfd_run_cmd
             self.vfd_speed = int(self.speed_slow * 100)
@@ -201,57 +465,61 @@ class MachineController:
     def stop_manual_topup(self, side: str, initiated_by_ui: bool = False):
         """Directly deactivate manual top-up for the given side, setting valve and VFD."""
         if side == "left":
-            logging.info(f"Manual LEFT top-up deactivated ({'UI' if initiated_by_ui else 'Button'}).")
+            logger.info("Manual LEFT top-up deactivated (%s).", 'UI' if initiated_by_ui else 'Button')
             self.valve1 = False
         elif side == "right":
-            logging.info(f"Manual RIGHT top-up deactivated ({'UI' if initiated_by_ui else 'Button'}).")
+            logger.info("Manual RIGHT top-up deactivated (%s).", 'UI' if initiated_by_ui else 'Button')
             self.valve2 = False
         # Always stop the VFD and set speed to 0 when top-up is stopped
         self.vfd_state = self.vfd_stop_cmd
         self.vfd_speed = 0
             
     def handle_left_button(self):
+        if left_button_line is None:
+            return
         button_pressed = not left_button_line.get_value()
         manual_states = [self.STATE_WAITING_FOR_MOULD, self.STATE_WAIT_REMOVAL]
         log_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-        logging.debug(
-            f"[{log_time}] [GPIO] LEFT button raw value={left_button_line.get_value()} | interpreted_pressed={button_pressed} | "
-            f"_left_button_active={self._left_button_active} | state={self._state}"
+        logger.debug(
+            "[%s] [GPIO] LEFT button raw value=%s | interpreted_pressed=%s | _left_button_active=%s | state=%s",
+            log_time, left_button_line.get_value(), button_pressed, self._left_button_active, self._state
         )
         if button_pressed and self._state in manual_states:
             if not self._left_button_active:
-                logging.info(
-                    f"[{log_time}] [GPIO] LEFT button PRESSED: activating manual top-up. _left_button_active={self._left_button_active}, state={self._state}"
+                logger.info(
+                    "[%s] [GPIO] LEFT button PRESSED: activating manual top-up. _left_button_active=%s, state=%s", log_time, self._left_button_active, self._state
                 )
                 self._left_button_active = True
                 self.start_manual_topup("left")
         else:
             if self._left_button_active:
-                logging.info(
-                    f"[{log_time}] [GPIO] LEFT button RELEASED: deactivating manual top-up. _left_button_active={self._left_button_active}, state={self._state}"
+                logger.info(
+                    "[%s] [GPIO] LEFT button RELEASED: deactivating manual top-up. _left_button_active=%s, state=%s", log_time, self._left_button_active, self._state
                 )
                 self.stop_manual_topup("left")
                 self._left_button_active = False
 
     def handle_right_button(self):
+        if right_button_line is None:
+            return
         button_pressed = not right_button_line.get_value()
         manual_states = [self.STATE_WAITING_FOR_MOULD, self.STATE_WAIT_REMOVAL]
         log_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-        logging.debug(
-            f"[{log_time}] [GPIO] RIGHT button raw value={right_button_line.get_value()} | interpreted_pressed={button_pressed} | "
-            f"_right_button_active={self._right_button_active} | state={self._state}"
+        logger.debug(
+            "[%s] [GPIO] RIGHT button raw value=%s | interpreted_pressed=%s | _right_button_active=%s | state=%s",
+            log_time, right_button_line.get_value(), button_pressed, self._right_button_active, self._state
         )
         if button_pressed and self._state in manual_states:
             if not self._right_button_active:
-                logging.info(
-                    f"[{log_time}] [GPIO] RIGHT button PRESSED: activating manual top-up. _right_button_active={self._right_button_active}, state={self._state}"
+                logger.info(
+                    "[%s] [GPIO] RIGHT button PRESSED: activating manual top-up. _right_button_active=%s, state=%s", log_time, self._right_button_active, self._state
                 )
                 self._right_button_active = True
                 self.start_manual_topup("right")
         else:
             if self._right_button_active:
-                logging.info(
-                    f"[{log_time}] [GPIO] RIGHT button RELEASED: deactivating manual top-up. _right_button_active={self._right_button_active}, state={self._state}"
+                logger.info(
+                    "[%s] [GPIO] RIGHT button RELEASED: deactivating manual top-up. _right_button_active=%s, state=%s", log_time, self._right_button_active, self._state
                 )
                 self.stop_manual_topup("right")
                 self._right_button_active = False
@@ -261,12 +529,14 @@ class MachineController:
         Start background threads for modbus, monitoring, and filling loops.
         """
         for fn in (self._vfd_loop, self._valve_loop, self._scale_loop, self._monitor_loop, self._filling_loop):
-            t = threading.Thread(target=fn, daemon=True)
+            t = self._clock.thread(fn)
             self._threads.append(t)
             t.start()
-        logging.info("MachineController: threads started")
+        if self.trace is not None:
+            self.trace.start(self.trace_meta())
+        logger.info("MachineController: threads started")
         self._filling_event.set()
-        tare_thread = threading.Thread(target=self._initial_tare, daemon=True)
+        tare_thread = self._clock.thread(self._initial_tare)
         tare_thread.start()
 
     def start_clean_cycle(self) -> None:
@@ -276,9 +546,9 @@ class MachineController:
         if self._clean_thread and self._clean_thread.is_alive():
             return  # already cleaning
         self._clean_stop.clear()
-        self._clean_thread = threading.Thread(target=self._clean_loop, daemon=True)
+        self._clean_thread = self._clock.thread(self._clean_loop)
         self._clean_thread.start()
-        logging.info("Cleaning cycle started")
+        logger.info("Cleaning cycle started")
 
     def stop_clean_cycle(self) -> None:
         """
@@ -293,10 +563,10 @@ class MachineController:
         def close_valves():
             self.valve1 = False
             self.valve2 = False
-            logging.info("Cleaning cycle stopped: valves closed")
-        threading.Timer(delay, close_valves).start()
+            logger.info("Cleaning cycle stopped: valves closed")
+        self._clock.timer(delay, close_valves).start()
 
-        logging.info("Cleaning cycle stop initiated")
+        logger.info("Cleaning cycle stop initiated")
 
 
     def stop(self) -> None:
@@ -313,128 +583,247 @@ class MachineController:
         # Ensure the filling loop unblocks if waiting for UI
         self._filling_event.set()
         self.kill_all.set()
+        self._wake_actuators()
         for t in self._threads:
-            t.join()
-        time.sleep(1)  # allow time for threads to exit
+            self._clock.join(t)
+        self._clock.sleep(1)  # allow time for threads to exit
+        self.close()
 
-        # Always disconnect MQTT
+    def close(self) -> None:
+        """
+        Save learned state, close the records and disconnect MQTT once the
+        control loops have exited.
+        """
+        logger.info("Loop timing:\n%s", self.loops.format())
+
+        self.compensation.save()
+        self.flow_split.save()
+        self.cycle_writer.close()
+        if self.trace is not None:
+            self.trace.close()
+
+        # Final bus statistics for the shift, then always disconnect MQTT
+        try:
+            self.publish_bus_stats()
+        except Exception:
+            logger.exception("Error publishing bus statistics")
         try:
             self.mqtt.disconnect()
         except Exception:
-            logging.exception("Error during MQTT shutdown")
+            logger.exception("Error during MQTT shutdown")
 
-        logging.info("MachineController: stopped")
+        logger.info("MachineController: stopped")
 
     def _feed_watchdog(self, name:str):
-        self._last_heartbeat[name] = time.time()
+        self._last_heartbeat[name] = self._clock()
         
     def _watchdog_loop(self):
         """Periodically check that each thread has called _feed_watchdog recently."""
+        schedule = self.loops.schedule("watchdog", self.watchdog_interval)
         while not self.kill_all.is_set():
-            now = time.time()
+            now = self._clock()
             all_good = True
             for name, ts in self._last_heartbeat.items():
                 if now - ts > self.watchdog_threshold:
-                    logging.error(f"Watchdog: {name} thread unresponsive!")
+                    logger.error("Watchdog: %s thread unresponsive!", name)
                     all_good = False
             if all_good and not self.watchdog_ok:
-                logging.info("Watchdog: all threads healthy again.")
+                logger.info("Watchdog: all threads healthy again.")
             self.watchdog_ok = all_good
-            time.sleep(self.watchdog_interval)
+            schedule.wait(self.kill_all)
+
+    def _settled_weight(self, max_wait: float, offset: float = 0.0) -> float:
+        """
+        Wait until the scale settles (at most `max_wait` seconds) and return
+        the mean weight of the stable window minus `offset`.
+        """
+        return self._settle_result(self.stability.wait_until_stable(self.scale_buffer, max_wait), max_wait, offset)
+
+    def _settle_result(self, result: tuple, max_wait: float, offset: float = 0.0) -> float:
+        """
+        Turn a `(stable, mean)` settle result into a weight minus `offset`,
+        falling back to the last reading if no sample arrived.
+        """
+        stable, mean = result
+        if not stable:
+            logger.warning("Scale not stable after %ss; using last window mean", max_wait)
+        if mean is None:
+            return self.actual_weight - offset
+        return mean - offset
 
     def _initial_tare(self) -> None:
         """Perform a one-off tare a few seconds after startup.
-        Waits `initial_tare_delay`, then averages `initial_tare_samples` readings
-        spaced by `_scale_interval` and sets `_tare_weight` to that average.
+        Waits `initial_tare_delay`, then waits for the scale to settle and sets
+        `_tare_weight` to the mean of the stable window.
         """
         try:
-            # Allow other threads (especially scale loop) to start and stabilise
-            time.sleep(self.initial_tare_delay)
+            # Allow other threads (especially scale loop) to start
+            self._clock.sleep(self.initial_tare_delay)
 
-            readings = []
-            for _ in range(int(self.initial_tare_samples)):
-                time.sleep(self._scale_interval)
-                readings.append(self.actual_weight)
-
-            if readings:
-                tare_avg = sum(readings) / len(readings)
-            else:
-                tare_avg = self.actual_weight
-
-            self._tare_weight = tare_avg
-            self._baseline_empty = tare_avg
-            self._initial_tare_done = True
-            logging.info(f"Initial tare complete: tare_weight={tare_avg:.3f} kg from {len(readings)} samples")
+            self._apply_initial_tare(self._settled_weight(self._settle_timeout))
         except Exception:
-            logging.exception("Initial tare failed")
+            logger.exception("Initial tare failed")
+
+    def _apply_initial_tare(self, tare_avg: float) -> None:
+        """Take the settled empty-scale weight as tare and empty baseline."""
+        self._tare_weight = tare_avg
+        self._baseline_empty = tare_avg
+        self._initial_tare_done = True
+        logger.info("Initial tare complete: tare_weight=%.3f kg", tare_avg)
 
     def _vfd_loop(self) -> None:
         """
-        Poll VFD commands at its own interval.
+        Push VFD setpoints to the bus as soon as they change, refreshing them
+        every `_vfd_interval` otherwise. With `vfd_verify` the refresh reads
+        the drive back and only rewrites registers that diverge, once per
+        `vfd_verify_interval` and on the first refresh after a change. The
+        setpoints are written once more when the loop exits.
         """
+        schedule = self.loops.schedule("vfd", self._vfd_interval)
+        verify_due = 0.0
         while not self.kill_all.is_set():
+            with self._vfd_cond:
+                if not self._vfd_pending:
+                    self._vfd_cond.wait(timeout=schedule.remaining())
+                changed = self._vfd_pending
+                self._vfd_pending = False
+                state, speed = self._vfd_state, self._vfd_speed
+            if not schedule.poll() and not changed:
+                continue
             try:
-                self.modbus.set_vfd_state(self.vfd_state)
-                self.modbus.set_vfd_speed(self.vfd_speed)
+                if not self._vfd_verify or changed:
+                    self.modbus.set_vfd_state(state)
+                    self.modbus.set_vfd_speed(speed)
+                    verify_due = 0.0
+                elif self._clock() >= verify_due:
+                    reported = self.modbus.verify_vfd(state, speed)
+                    self.vfd_reported = (reported["state"], reported["speed"], reported["status"])
+                    verify_due = self._clock() + self._vfd_verify_interval
                 self._feed_watchdog("modbus_vfd")
-                if int(time.time() * 10) % 5 == 0:  # Every 0.5 seconds
-                    logging.debug(f"VFD loop heartbeat: {self._last_heartbeat['modbus_vfd']}")
+                if int(self._clock.time() * 10) % 5 == 0:  # Every 0.5 seconds
+                    logger.debug("VFD loop heartbeat: %s", self._last_heartbeat['modbus_vfd'])
             except NoResponseError as e:
-                logging.debug(f"VFD no response: {e}")
+                logger.debug("VFD no response: %s", e)
             except Exception:
-                logging.exception("Error in VFD loop")
-            time.sleep(self._vfd_interval)
+                logger.exception("Error in VFD loop")
+
+        # Shutting down: write the latest setpoints (the stop command left by
+        # stop()) once more, even if they changed while the last write ran
+        with self._vfd_cond:
+            self._vfd_pending = False
+            state, speed = self._vfd_state, self._vfd_speed
+        try:
+            self.modbus.set_vfd_state(state)
+            self.modbus.set_vfd_speed(speed)
+        except Exception:
+            logger.exception("Failed to write the final VFD setpoints")
 
     def _valve_loop(self) -> None:
         """
-        Poll valve states at their own interval.
+        Push valve setpoints to the bus as soon as they change, refreshing
+        them every `_valve_interval` otherwise, and once more on exit.
         """
+        schedule = self.loops.schedule("valves", self._valve_interval)
         while not self.kill_all.is_set():
+            with self._valve_cond:
+                if not self._valve_pending:
+                    self._valve_cond.wait(timeout=schedule.remaining())
+                changed = self._valve_pending
+                self._valve_pending = False
+                valve1, valve2 = self._valve1, self._valve2
+            if not schedule.poll() and not changed:
+                continue
             try:
-                self.modbus.set_valve("left",  "open" if self.valve1 else "close")
-                self.modbus.set_valve("right", "open" if self.valve2 else "close")
+                mask = (ModbusInterface.VALVE_LEFT if valve1 else 0) | (ModbusInterface.VALVE_RIGHT if valve2 else 0)
+                self.modbus.set_valves(mask)
                 self._feed_watchdog("modbus_valve")
-                if int(time.time() * 10) % 5 == 0:
-                    logging.debug(f"Valve loop heartbeat: {self._last_heartbeat['modbus_valve']}")
-                print(f"Valve1: {self.valve1}, Valve2: {self.valve2}")
+                if int(self._clock.time() * 10) % 5 == 0:
+                    logger.debug("Valve loop heartbeat: %s", self._last_heartbeat['modbus_valve'])
+                logger.debug("Valve1: %s, Valve2: %s", valve1, valve2)
             except NoResponseError as e:
-                logging.debug(f"Valve no response: {e}")
+                logger.debug("Valve no response: %s", e)
             except Exception:
-                logging.exception("Error in valve loop")
-            time.sleep(self._valve_interval)
+                logger.exception("Error in valve loop")
+
+        # Shutting down: write the latest valve setpoints once more
+        with self._valve_cond:
+            self._valve_pending = False
+            valve1, valve2 = self._valve1, self._valve2
+        try:
+            self.modbus.set_valves((ModbusInterface.VALVE_LEFT if valve1 else 0) | (ModbusInterface.VALVE_RIGHT if valve2 else 0))
+        except Exception:
+            logger.exception("Failed to write the final valve setpoints")
 
     def _scale_loop(self) -> None:
         """
         Poll load cell at its own interval.
         """
+        schedule = self.loops.schedule("scale", self._scale_interval)
         while not self.kill_all.is_set():
             try:
-                self.actual_weight = self.modbus.read_load_cell()
-                self._feed_watchdog("modbus_scale")
-                if int(time.time() * 10) % 5 == 0:
-                    logging.debug(f"Scale loop heartbeat: {self._last_heartbeat['modbus_scale']}")
+                self._record_sample(*self.modbus.read_load_cell_sample())
+                if int(self._clock.time() * 10) % 5 == 0:
+                    logger.debug("Scale loop heartbeat: %s", self._last_heartbeat['modbus_scale'])
             except NoResponseError as e:
-                logging.debug(f"Scale no response: {e}")
+                logger.debug("Scale no response: %s", e)
             except Exception:
-                logging.exception("Error in scale loop")
-            # time.sleep(self._scale_interval)
+                logger.exception("Error in scale loop")
+            schedule.wait(self.kill_all)
+
+    def _record_sample(self, raw: float, weight: float) -> None:
+        """Store one scale reading and feed the scale heartbeat."""
+        t = self._clock()
+        self.scale_buffer.append(raw, weight, t)
+        if self.trace is not None:
+            self.trace.sample(t, raw, weight)
+        self.actual_weight = weight
+        self._feed_watchdog("modbus_scale")
+
+    def telemetry_fields(self) -> dict:
+        """Current machine state, keyed by telemetry field/topic name."""
+        fields = {
+            "ActualWeight": round(self.actual_weight, 4),
+            "VFDState":     self.vfd_state,
+            "VFDSpeed":     self.vfd_speed,
+            "Valve1State":  int(self.valve1),
+            "Valve2State":  int(self.valve2),
+            "FillStatus":   self.filling_status,
+        }
+        if self.vfd_reported is not None:
+            # Read back from the drive's speed reference register, so this
+            # is what the drive was told, not its output frequency
+            fields["VFDSpeedReference"] = self.vfd_reported[1]
+            fields["VFDStatus"]         = self.vfd_reported[2]
+        return fields
 
     def _monitor_loop(self) -> None:
         """
-        Publish telemetry over MQTT.
+        Publish telemetry over MQTT, sampled once per telemetry tick.
         """
+        schedule = self.loops.schedule("monitor", self._telemetry_tick)
         while not self.kill_all.is_set():
-            try:
-                logging.debug(f"Telemetry: weight={self.actual_weight}, VFD={self.vfd_state}@{self.vfd_speed}, valve1={self.valve1}, valve2={self.valve2}, status={self.filling_status}")
-                self.mqtt.publish("FillingMachine/ActualWeight", self.actual_weight)
-                self.mqtt.publish("FillingMachine/VFDState",      self.vfd_state)
-                self.mqtt.publish("FillingMachine/VFDSpeed",      self.vfd_speed)
-                self.mqtt.publish("FillingMachine/Valve1State",   int(self.valve1))
-                self.mqtt.publish("FillingMachine/Valve2State",   int(self.valve2))
-                self.mqtt.publish("FillingMachine/FillStatus",    self.filling_status)
-            except Exception:
-                logging.exception("Error in monitor loop")
-            time.sleep(0.1)
+            self._publish_telemetry()
+            schedule.wait(self.kill_all)
+
+    def _publish_telemetry(self) -> None:
+        """One telemetry tick, plus the bus statistics when they are due."""
+        try:
+            self.telemetry.publish(self.telemetry_fields())
+            now = self._clock()
+            if self._bus_stats_interval is not None and now - self._bus_stats_sent >= self._bus_stats_interval:
+                self._bus_stats_sent = now
+                self.publish_bus_stats()
+        except Exception:
+            logger.exception("Error in monitor loop")
+
+    def publish_bus_stats(self) -> None:
+        """
+        Publish the Modbus transaction statistics and the loop timing since
+        startup as one JSON message.
+        """
+        self.mqtt.publish(f"{self.telemetry.prefix}/BusStats",
+                          json.dumps({"t": self._clock.time(), "transactions": self.modbus.transaction_stats(),
+                                      "loops": self.loops.stats()}))
 
     def _detect_mould(self) -> bool:
         """
@@ -445,11 +834,133 @@ class MachineController:
             return False
         w = self.actual_weight
         net_empty = w - self._baseline_empty
-        logging.debug(
-            f"Detect mould check: raw={w:.3f} empty={self._baseline_empty:.3f} net_empty={net_empty:.3f} target={self.mould_weight:.3f} tol={self._mould_tol:.3f}"
+        logger.debug(
+            "Detect mould check: raw=%.3f empty=%.3f net_empty=%.3f target=%.3f tol=%.3f", w, self._baseline_empty, net_empty, self.mould_weight, self._mould_tol
         )
         return abs(net_empty - self.mould_weight) <= self.mould_weight * self._mould_tol
 
+    def _fill_profile(self) -> SpeedProfile:
+        """The flavour's speed profile, or one built from the live fast/slow settings."""
+        if self.speed_profile is not None:
+            return self.speed_profile
+        return legacy_profile(self.speed_fast, self.speed_slow, self._fill_tol,
+                              self.adaptive_filling, self.desired_volume)
+
+    def _set_fill_speed(self, remaining: float, now: float, share: float = 1.0) -> None:
+        """
+        Set the VFD speed from the profile for `remaining` kg, or from the
+        flow loop when enabled, rate-limited by the profile's ramps. With
+        `share` < 1 only part of the flow reaches the mould, so the speed
+        is raised to match (up to the profile's top speed).
+        """
+        profile = self._fill_profile()
+        hz = profile.speed(remaining, self.desired_volume)
+        if share < 1.0:
+            hz = min(hz / max(share, 0.5), profile.top_speed)
+        if self.flow_control:
+            hz = self._closed_loop_speed(remaining, hz, share, profile.top_speed, now)
+        hz = self._ramp.limit(hz, now, profile.ramp_up, profile.ramp_down)
+        self.vfd_speed = int(hz * 100)
+
+    def _closed_loop_speed(self, remaining: float, open_loop: float, share: float,
+                           top_speed: float, now: float) -> float:
+        """
+        Speed from the PI flow loop. Until the flow estimate is available
+        the open-loop profile speed is used and seeds the loop, so the
+        hand-over is bumpless.
+        """
+        rate = self.flow_estimator.rate(self.scale_buffer, now)
+        if rate is None or not self._flow_pi.active:
+            self._flow_pi.reset(open_loop)
+            return open_loop
+        self._flow_pi.out_max = top_speed
+        # The scale sees the total flow; the mould only its share of it
+        setpoint = flow_setpoint(remaining, self._flow_max, self._flow_min, self._flow_approach) / share
+        hz = self._flow_pi.update(setpoint, rate, now)
+        logger.debug("Flow loop: setpoint=%.3f rate=%.3f kg/s speed=%.2fHz", setpoint, rate, hz)
+        return hz
+
+    def _start_pump_ramp(self) -> None:
+        """A fill starts from standstill: restart the ramp and the flow loop."""
+        self._ramp.reset(0.0)
+        self._flow_pi.reset()
+
+    def _speed_profile_key(self) -> str:
+        """Identify the speed settings a fill ran with, for compensation lookup."""
+        key = self._fill_profile().name
+        if self.flow_control:
+            key += "-pi"
+        return key + "-parallel" if self._parallel else key
+
+    def _fill_target_reached(self, net: float, side: str, share: float = 1.0, lag: float = None) -> bool:
+        """
+        Return True when the pump should stop for the current mould.
+        The target is reduced by the learned overshoot for this flavour, side
+        and speed profile. With predictive cut-off, the measured net weight
+        plus the mass still expected to arrive after the stop command must
+        reach that target. `share` is the mould's fraction of the measured
+        flow when more than one valve is open; `lag` overrides the cut-off lag.
+        """
+        offset = self.compensation.offset(self.flavour, side, self._speed_profile_key())
+        self._applied_offset[side] = offset
+        target = self.desired_volume - offset
+
+        rate = self.flow_estimator.rate(self.scale_buffer, self._clock())
+        self.flow_rate = rate if rate is not None else 0.0
+        if net >= target:
+            return True
+        if not self.predictive_cutoff or rate is None or rate <= 0.0:
+            return False
+        in_flight = rate * share * (self._cutoff_lag if lag is None else lag)
+        if net + in_flight >= target:
+            logger.info(
+                "Predictive cut-off: net=%.3f rate=%.3fkg/s in_flight=%.3f target=%.3f", net, rate, in_flight, target
+            )
+            return True
+        return False
+
+    def _learn_overshoot(self, side: str, avg_pour: float) -> None:
+        """
+        Feed the settled pour of a finished mould back into the compensation
+        table; the overshoot is measured against the target actually used.
+        """
+        target = self.desired_volume - self._applied_offset[side]
+        self._last_overshoot[side] = avg_pour - target
+        self.compensation.update(self.flavour, side, self._speed_profile_key(), avg_pour - target)
+
+    def _mark_cycle(self, event: str) -> None:
+        if self._cycle is not None:
+            self._cycle.mark(event, self._clock.time())
+
+    def _record_transition(self, old: str, new: str) -> None:
+        """
+        Keep the production record of the current tray in step with the
+        filling state machine: a cycle starts when a mould is first seen,
+        is discarded if it is not confirmed, captures tares and pours once
+        both moulds are done and is written out when the tray is removed.
+        """
+        if old == self.STATE_WAITING_FOR_MOULD and new == self.STATE_CONFIRMING_MOULD:
+            self._cycle = CycleRecord(self.flavour, self.desired_volume, self.mould_weight,
+                                      self._speed_profile_key(), self._clock.time())
+        if self.trace is not None:
+            self.trace.transition(self._clock(), new, self._baseline_empty, self._tare_weight)
+        self._mark_cycle(new)
+        if self._cycle is None:
+            return
+        if new == self.STATE_WAIT_REMOVAL:
+            self._cycle.update(
+                mould_tare=self._mould_tare,
+                left_tare=self._left_tare, left_pour=self._last_left_pour,
+                left_overshoot=self._last_overshoot["left"], left_offset=self._applied_offset["left"],
+                right_tare=self._right_tare, right_pour=self._last_right_pour,
+                right_overshoot=self._last_overshoot["right"], right_offset=self._applied_offset["right"],
+            )
+        elif new == self.STATE_WAITING_FOR_MOULD:
+            if old == self.STATE_WAIT_REMOVAL:
+                self._cycle.finish(self._clock.time())
+                self.cycle_writer.write(self._cycle.as_row())
+            self._cycle = None
+
     def _clean_loop(self) -> None:
         """
         Internal cleaning cycle loop:
@@ -460,7 +971,7 @@ class MachineController:
         cfg = self.config
         # initial left-open and VFD start
         self.valve1 = True
-        time.sleep(cfg.get("clean_initial_delay"))
+        self._clock.sleep(cfg.get("clean_initial_delay"))
         self.clean_speed = self.config.get("clean_speed")
         self.vfd_state = self.vfd_run_cmd
         self.vfd_speed = int(self.clean_speed * 100)
@@ -477,201 +988,286 @@ class MachineController:
             self.vfd_speed = int(self.clean_speed * 100)
             if left_open:
                 self.valve2 = True
-                time.sleep(toggle_delay)
+                self._clock.sleep(toggle_delay)
                 self.valve1 = False
             else:
                 self.valve1 = True
-                time.sleep(toggle_delay)
+                self._clock.sleep(toggle_delay)
                 self.valve2 = False
             left_open = not left_open
-            time.sleep(interval)
+            self._clock.sleep(interval)
 
-        logging.info("Exiting clean loop")
+        logger.info("Exiting clean loop")
         self._cleaning_active = False
 
+    def _build_fill_machine(self) -> StateMachine:
+        """Transition table of the multi-stage fill cycle."""
+        return StateMachine([
+            State(self.STATE_WAITING_FOR_MOULD, on_tick=self._tick_waiting),
+            State(self.STATE_CONFIRMING_MOULD,  on_tick=self._tick_confirming, on_exit=self._clear_settle),
+            State(self.STATE_FILL_LEFT_FAST,    on_tick=partial(self._tick_fill_fast, "left")),
+            State(self.STATE_FILL_LEFT_SLOW,    on_tick=partial(self._tick_fill_slow, "left"), on_exit=self._clear_settle),
+            State(self.STATE_PREP_RIGHT,        on_tick=self._tick_prep_right),
+            State(self.STATE_FILL_RIGHT_FAST,   on_tick=partial(self._tick_fill_fast, "right")),
+            State(self.STATE_FILL_RIGHT_SLOW,   on_tick=partial(self._tick_fill_slow, "right"), on_exit=self._clear_settle),
+            State(self.STATE_WAIT_REMOVAL,      on_tick=self._tick_wait_removal),
+            State(self.STATE_FILL_BOTH,         on_tick=self._tick_fill_both),
+        ], initial=self.STATE_WAITING_FOR_MOULD,
+           clock=self._clock, wall_clock=self._clock.time)
+
+    def _clear_settle(self, now: float) -> None:
+        self._settle = None
+
+    def _poll_settle(self, now: float, max_wait: float, offset: float = 0.0) -> float:
+        """
+        Poll the running settle watch; return the settled weight minus
+        `offset` once it is done, or None while the scale is still settling.
+        """
+        result = self._settle.poll(now)
+        if result is None:
+            return None
+        self._settle = None
+        return self._settle_result(result, max_wait, offset)
+
+    def _tick_waiting(self, now: float) -> str:
+        """1) Wait until a mould tray is placed."""
+        w = self.actual_weight
+        net_empty = w - self._baseline_empty
+        logger.debug(
+            "WAITING_FOR_MOULD: raw=%.3f empty=%.3f net_empty=%.3f target=%.3f tol=%.3f",
+            w, self._baseline_empty, net_empty, self.mould_weight, self._mould_tol
+        )
+        if abs(net_empty - self.mould_weight) <= self.mould_weight * self._mould_tol:
+            self._parallel = self._use_parallel_fill()
+            return self.STATE_CONFIRMING_MOULD
+        return None
+
+    def _use_parallel_fill(self) -> bool:
+        """Decide whether the next tray is filled with both valves open."""
+        if self.flavour not in self.parallel_flavours:
+            return False
+        if self.flow_split.samples(self.flavour) < self._parallel_min_samples:
+            logger.info("Flow split for %s not learned yet; filling in sequence", self.flavour)
+            return False
+        if self._parallel_recalibrate and self._parallel_trays >= self._parallel_recalibrate:
+            logger.info("Filling one tray in sequence to refresh the %s flow split", self.flavour)
+            self._parallel_trays = 0
+            return False
+        return True
+
+    def _tick_confirming(self, now: float) -> str:
+        """
+        1.1) Confirm the mould reading holds for confirm_mould_time, then wait for the user to
+        finish adjusting moulds (scale settled, at most mould_adjust_delay),
+        tare, open the left valve and start the pump after valve_start_delay.
+        """
+        if self._fsm.pending():
+            return None                      # left valve opening; pump starts on its timer
+        if self._settle is not None:
+            tare_avg = self._poll_settle(now, self.config.get("mould_adjust_delay"))
+            if tare_avg is not None:
+                self._tare_weight = tare_avg
+                self._left_tare   = tare_avg
+                self._mould_tare  = tare_avg
+                self.valve1       = True
+                if self._parallel:
+                    self._right_tare = tare_avg
+                    self.valve2      = True
+                self._fsm.after(self._valve_delay, self._start_fill, now)
+            return None
+
+        w = self.actual_weight
+        net_empty = w - self._baseline_empty
+        logger.debug(
+            "CONFIRMING_MOULD: raw=%.3f empty=%.3f net_empty=%.3f target=%.3f tol=%.3f held=%.2f",
+            w, self._baseline_empty, net_empty, self.mould_weight, self._mould_tol, self._fsm.time_in_state(now)
+        )
+        if abs(net_empty - self.mould_weight) > self.mould_weight * self._mould_tol:
+            return self.STATE_WAITING_FOR_MOULD
+        if self._fsm.time_in_state(now) >= self._confirm_mould_time:
+            delay = self.config.get("mould_adjust_delay")
+            logger.info("Mould confirmed; waiting up to %s seconds for the scale to settle before taring and filling", delay)
+            self._settle = self.stability.watch(self.scale_buffer, delay, now)
+        return None
+
+    def _start_fill(self, now: float) -> str:
+        self.vfd_state = self.vfd_run_cmd
+        self._start_pump_ramp()
+        self._set_fill_speed(self.desired_volume, now)
+        return self.STATE_FILL_BOTH if self._parallel else self.STATE_FILL_LEFT_FAST
+
+    def _tick_fill_fast(self, side: str, now: float) -> str:
+        """2) / 5) Fast-fill until within fill tolerance."""
+        w = self.actual_weight
+        logger.debug("Entering state: %s, weight=%s", self._state, w)
+        running_hz = self.vfd_speed / 100.0
+        self._set_fill_speed(self.desired_volume - (w - self._tare_weight), now)
+        if (w - self._tare_weight) >= self.desired_volume * (1 - self._fill_tol):
+            if not self._parallel:
+                # Steady single-valve flow at full speed teaches the flow split
+                self.flow_split.update(self.flavour, side, self.flow_estimator.rate(self.scale_buffer, now), running_hz)
+            return self.STATE_FILL_LEFT_SLOW if side == "left" else self.STATE_FILL_RIGHT_SLOW
+        return None
+
+    def _tick_fill_both(self, now: float) -> str:
+        """
+        Parallel fill: both valves open, the weight gained since the tare
+        shared between the moulds by the flow split. The mould that reaches
+        its target first has its valve closed while the pump keeps running;
+        the other mould then finishes as in a sequential fill, tared as if
+        its estimated share were already on the scale.
+        """
+        w = self.actual_weight
+        net = w - self._tare_weight
+        share = {side: self.flow_split.share(self.flavour, side) for side in ("left", "right")}
+        est = {side: net * share[side] for side in share}
+        lead = max(est, key=est.get)
+        logger.debug("Parallel fill: weight=%s left=%.3f right=%.3f", w, est["left"], est["right"])
+
+        # Only `share` of the flow reaches the lead mould: speed up so it
+        # fills at the rate a sequential fill would
+        self._set_fill_speed(self.desired_volume - est[lead], now, share[lead])
+        if not self._fill_target_reached(est[lead], lead, share[lead], self._valve_cutoff_lag):
+            return None
+
+        self._mark_cycle(f"{lead}_cutoff")
+        if lead == "left":
+            self.valve1 = False
+        else:
+            self.valve2 = False
+        # Mass already past the valve but not yet seen by the scale belongs to the lead mould
+        in_flight = share[lead] * max(self.flow_rate, 0.0) * self._valve_cutoff_lag
+        self._lead_pour = est[lead] + in_flight
+        follow = "right" if lead == "left" else "left"
+        self._tare_weight = self._mould_tare + self._lead_pour
+        if follow == "left":
+            self._left_tare = self._tare_weight
+        else:
+            self._right_tare = self._tare_weight
+        logger.info("Parallel fill: %s valve closed at an estimated %.3f kg (%.3f in flight); finishing %s", lead, self._lead_pour, in_flight, follow)
+        return self.STATE_FILL_LEFT_FAST if follow == "left" else self.STATE_FILL_RIGHT_FAST
+
+    def _tick_fill_slow(self, side: str, now: float) -> str:
+        """
+        3) / 6) Slow-fill until the target is reached, stop the pump, close
+        the valve after post_fill_delay and take the settled weight as the pour.
+        """
+        if self._fsm.pending():
+            return None                      # pump stopped; valve closes on its timer
+        if self._settle is not None:
+            tare = self._left_tare if side == "left" else self._right_tare
+            avg_pour = self._poll_settle(now, self._settle_timeout, offset=tare)
+            if avg_pour is None:
+                return None
+            return self._finish_fill(side, avg_pour)
+
+        w = self.actual_weight
+        logger.debug("Entering state: %s, weight=%s", self._state, w)
+        self._set_fill_speed(self.desired_volume - (w - self._tare_weight), now)
+        if self._fill_target_reached(w - self._tare_weight, side):
+            self._mark_cycle(f"{side}_cutoff")
+            # Stop VFD immediately; the valve closes once the line has drained
+            self.vfd_speed = 0
+            self.vfd_state = self.vfd_stop_cmd
+            self._fsm.after(self._post_fill_delay, partial(self._close_fill_valve, side), now)
+        return None
+
+    def _close_fill_valve(self, side: str, now: float) -> None:
+        if side == "left":
+            self.valve1 = False
+        else:
+            self.valve2 = False
+        # Wait for the scale to settle and take the stable mean as the pour
+        self._settle = self.stability.watch(self.scale_buffer, self._settle_timeout, now)
+
+    def _finish_fill(self, side: str, avg_pour: float) -> str:
+        """Record the settled pour of a finished mould and pick the next state."""
+        self._learn_overshoot(side, avg_pour)
+        if self._parallel:
+            return self._finish_parallel_fill(side, avg_pour)
+        # Record the raw averaged pour amount (allowing overshoot to be visible)
+        if side == "left":
+            self._last_left_pour = avg_pour
+            # The settled weight doubles as the right-hand tare
+            self._right_tare = self._left_tare + avg_pour
+            return self.STATE_PREP_RIGHT
+        self._last_right_pour = avg_pour
+        self._empty_since = None
+        self.compensation.save()
+        self.flow_split.save()
+        return self.STATE_WAIT_REMOVAL
+
+    def _finish_parallel_fill(self, side: str, avg_pour: float) -> str:
+        """
+        Record both pours of a parallel tray: the mould finished last was
+        measured, the one closed first is the flow-split estimate.
+        """
+        lead = "right" if side == "left" else "left"
+        pours = {side: avg_pour, lead: self._lead_pour}
+        self._last_left_pour  = pours["left"]
+        self._last_right_pour = pours["right"]
+        self._last_overshoot[lead] = None
+        self._parallel_trays += 1
+        self._empty_since = None
+        self.compensation.save()
+        return self.STATE_WAIT_REMOVAL
+
+    def _tick_prep_right(self, now: float) -> str:
+        """4) Prep right: open valve, start fast fill."""
+        logger.debug("Entering state: %s, weight=%s", self._state, self.actual_weight)
+        # Right tare is the settled weight after the left fill
+        self._tare_weight  = self._right_tare
+        self.valve2        = True
+        self.vfd_state     = self.vfd_run_cmd
+        self._start_pump_ramp()
+        self._set_fill_speed(self.desired_volume, now)
+        return self.STATE_FILL_RIGHT_FAST
+
+    def _tick_wait_removal(self, now: float) -> str:
+        """7) Wait for tray removal (scale empty for confirm_removal_time)."""
+        w = self.actual_weight
+        net_empty = w - self._baseline_empty
+        logger.debug(
+            "WAIT_REMOVAL: raw=%.3f empty=%.3f net_empty=%.3f tol=%.3f since=%s", w, self._baseline_empty, net_empty, self._removal_tol, self._empty_since
+        )
+        if abs(net_empty) > self._removal_tol:
+            self._empty_since = None
+            return None
+        if self._empty_since is None:
+            self._empty_since = now
+        if now - self._empty_since < self._confirm_removal_time:
+            return None
+        self._empty_since = None
+        # Clear retained pour and tare data
+        self._last_left_pour  = 0.0
+        self._last_right_pour = 0.0
+        self._left_tare       = None
+        self._right_tare      = None
+        self._mould_tare      = None
+        # Update baselines for next cycle
+        self._baseline_empty = w
+        self._tare_weight    = w
+        return self.STATE_WAITING_FOR_MOULD
+
     def _filling_loop(self) -> None:
         """
-        Full multi-stage fill state machine.
+        Tick the fill state machine on every new scale sample, and at least
+        every `_read_interval` seconds so timers and buttons are never late.
         """
         while not self.kill_all.is_set():
             if self._cleaning_active:
-                time.sleep(0.1)
+                self._clock.sleep(self._read_interval)
                 continue
 
-            try:
-                self.handle_left_button()
-                self.handle_right_button()
-                # even when I'm holding down the button, occassionally the VFD is told to stop by something.
-
-                w = self.actual_weight
-                net_fill  = w - self._tare_weight
-                net_empty = w - self._baseline_empty
-
-                # 1) Waiting until a mould tray is placed
-                if self._state == self.STATE_WAITING_FOR_MOULD:
-                    logging.debug(
-                        f"WAITING_FOR_MOULD: raw={w:.3f} empty={self._baseline_empty:.3f} net_empty={net_empty:.3f} "
-                        f"target={self.mould_weight:.3f} tol={self._mould_tol:.3f}"
-                    )
-                    if abs(net_empty - self.mould_weight) <= self.mould_weight * self._mould_tol:
-                        self._consec_count = 1
-                        self._state = self.STATE_CONFIRMING_MOULD
-
-                # 1.1) Confirm consecutive mould readings
-                elif self._state == self.STATE_CONFIRMING_MOULD:
-                    logging.debug(
-                        f"CONFIRMING_MOULD: raw={w:.3f} empty={self._baseline_empty:.3f} net_empty={net_empty:.3f} "
-                        f"target={self.mould_weight:.3f} tol={self._mould_tol:.3f} count={self._consec_count}"
-                    )
-                    if abs(net_empty - self.mould_weight) <= self.mould_weight * self._mould_tol:
-                        self._consec_count += 1
-                        if self._consec_count >= self._confirm_readings:
-                            # Delay before starting fill to allow user to adjust moulds
-                            delay = self.config.get("mould_adjust_delay")
-                            logging.info(f"Mould confirmed; waiting {delay} seconds for user adjustment before taring and filling")
-                            time.sleep(delay)
-                            # Record tare and start left fill (average 5 readings)
-                            readings = []
-                            for _ in range(5):
-                                time.sleep(self._scale_interval)
-                                readings.append(self.actual_weight)
-                            tare_avg = sum(readings) / len(readings)
-                            self._tare_weight = tare_avg
-                            self._left_tare = tare_avg
-                            self._mould_tare = tare_avg
-                            self.valve1     = True
-                            time.sleep(self._valve_delay)
-                            self.vfd_state  = self.vfd_run_cmd
-                            self.vfd_speed  = int(self.speed_fast * 100)
-                            self._state     = self.STATE_FILL_LEFT_FAST
-                    else:
-                        self._state = self.STATE_WAITING_FOR_MOULD
-
-                # 2) Fast-fill left until within fill tolerance
-                elif self._state == self.STATE_FILL_LEFT_FAST:
-                    logging.debug(f"Entering state: {self._state}, weight={w}")
-                    self.vfd_speed = int(self.speed_fast * 100)
-                    if (w - self._tare_weight) >= self.desired_volume * (1 - self._fill_tol):
-                        self.vfd_speed = int(self.speed_slow * 100)
-                        self._state    = self.STATE_FILL_LEFT_SLOW
-
-                # 3) Slow-fill left until target reached
-                elif self._state == self.STATE_FILL_LEFT_SLOW:
-                    logging.debug(f"Entering state: {self._state}, weight={w}")
-                    self.vfd_speed = int(self.speed_slow * 100)
-                    # Adaptive speed fine-tuning if enabled
-                    if self.adaptive_filling:
-                        remaining = self.desired_volume - (w - self._tare_weight)
-                        logging.debug(f"Adaptive filling active. Remaining={remaining:.3f}kg")
-                        if remaining <= 0.05:
-                            self.vfd_speed = int(self.speed_slow * 100 * 0.50)
-                        elif remaining <= 0.10:
-                            self.vfd_speed = int(self.speed_slow * 100 * 0.75)
-                    if (w - self._tare_weight) >= self.desired_volume:
-                        # Stop VFD and close left valve immediately
-                        self.vfd_speed = 0
-                        self.vfd_state = self.vfd_stop_cmd
-                        time.sleep(self._post_fill_delay)
-                        self.valve1 = False
-                        time.sleep(self._post_fill_delay)
-
-                        # Allow scale readings to settle and average a few samples
-                        sample_count = 10
-                        readings = []
-                        for _ in range(sample_count):
-                            time.sleep(self._scale_interval)
-                            readings.append(self.actual_weight - self._left_tare)
-                            time.sleep(self._scale_interval)
-                        avg_pour = sum(readings) / len(readings)
-                        # Record the raw averaged pour amount (allowing overshoot to be visible)
-                        self._last_left_pour = avg_pour
-
-                        # Post-fill delay before moving to next stage
-                        self._state = self.STATE_PREP_RIGHT
-
-                # 4) Prep right: open valve, start fast fill
-                elif self._state == self.STATE_PREP_RIGHT:
-                    logging.debug(f"Entering state: {self._state}, weight={w}")
-                    self._consec_count = 0
-                    # Average right tare with 5 readings
-                    readings = []
-                    for _ in range(5):
-                        time.sleep(self._scale_interval)
-                        readings.append(self.actual_weight)
-                    tare_avg = sum(readings) / len(readings)
-                    self._right_tare = tare_avg
-                    self._tare_weight  = tare_avg
-                    self.valve2        = True
-                    self.vfd_state     = self.vfd_run_cmd
-                    self.vfd_speed     = int(self.speed_fast * 100)
-                    self._state        = self.STATE_FILL_RIGHT_FAST
-
-                # 5) Fast-fill right
-                elif self._state == self.STATE_FILL_RIGHT_FAST:
-                    logging.debug(f"Entering state: {self._state}, weight={w}")
-                    self.vfd_speed = int(self.speed_fast * 100)
-                    if (w - self._tare_weight) >= self.desired_volume * (1 - self._fill_tol):
-                        self.vfd_speed = int(self.speed_slow * 100)
-                        self._state    = self.STATE_FILL_RIGHT_SLOW
-
-                # 6) Slow-fill right until done
-                elif self._state == self.STATE_FILL_RIGHT_SLOW:
-                    logging.debug(f"Entering state: {self._state}, weight={w}")
-                    self.vfd_speed = int(self.speed_slow * 100)
-                    # Adaptive speed fine-tuning if enabled
-                    if self.adaptive_filling:
-                        remaining = self.desired_volume - (w - self._tare_weight)
-                        logging.debug(f"Adaptive filling active. Remaining={remaining:.3f}kg")
-                        if remaining <= 0.05:
-                            self.vfd_speed = int(self.speed_slow * 100 * 0.50)
-                        elif remaining <= 0.10:
-                            self.vfd_speed = int(self.speed_slow * 100 * 0.75)
-                    if (w - self._tare_weight) >= self.desired_volume:
-                        # Stop VFD and close right valve immediately
-                        self.vfd_speed = 0
-                        self.vfd_state = self.vfd_stop_cmd
-                        time.sleep(self._post_fill_delay)
-                        self.valve2 = False
-                        time.sleep(self._post_fill_delay)
-
-                        # Allow scale readings to settle and average a few samples
-                        sample_count = 10
-                        readings = []
-                        for _ in range(sample_count):
-                            time.sleep(self._scale_interval)
-                            readings.append(self.actual_weight - self._right_tare)
-                            time.sleep(self._scale_interval)
-                        avg_pour = sum(readings) / len(readings)
-                        # Record the raw averaged pour amount (allowing overshoot to be visible)
-                        self._last_right_pour = avg_pour
-
-                        # Post-fill delay before moving to wait removal stage
-                        time.sleep(self._post_fill_delay)
-                        self._state = self.STATE_WAIT_REMOVAL
-                        self._consec_count = 0
-
-                # 7) Wait for tray removal (multiple zero readings)
-                elif self._state == self.STATE_WAIT_REMOVAL:
-                    logging.debug(
-                        f"WAIT_REMOVAL: raw={w:.3f} empty={self._baseline_empty:.3f} net_empty={net_empty:.3f} tol={self._removal_tol:.3f} count={self._consec_count}"
-                    )
-                    if abs(net_empty) <= self._removal_tol:
-                        self._consec_count += 1
-                        if self._consec_count >= self._confirm_removals:
-                            # Clear retained pour and tare data
-                            self._last_left_pour  = 0.0
-                            self._last_right_pour = 0.0
-                            self._left_tare       = None
-                            self._right_tare      = None
-                            self._mould_tare      = None
-                            # Update baselines for next cycle
-                            self._baseline_empty = w
-                            self._tare_weight    = w
-                            self._state          = self.STATE_WAITING_FOR_MOULD
-                    else:
-                        self._consec_count = 0
-
-            except Exception:
-                logging.exception("Error in filling loop")
+            self._fill_tick()
+            self.scale_buffer.wait_for_next_sample(timeout=self._fsm.idle_time(self._read_interval))
 
-            time.sleep(self._read_interval)
\ No newline at end of file
+    def _fill_tick(self) -> None:
+        """Read the top-up buttons and tick the fill state machine once."""
+        try:
+            self.handle_left_button()
+            self.handle_right_button()
+            # even when I'm holding down the button, occassionally the VFD is told to stop by something.
+            self._fsm.tick()
+        except Exception:
+            logger.exception("Error in filling loop")
@@ -0,0 +1,206 @@
+# machine/cycle_record.py
+
+import csv
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+try:
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+SIDES = ("left", "right")
+
+
+class CycleRecord:
+    """
+    Production record of one tray: what was filled, with which settings,
+    the tares and settled pours of both moulds, and when each state of the
+    cycle was entered (seconds after the tray was first detected).
+    """
+
+    FIELDS = (
+        "cycle_start", "cycle_time", "flavour", "desired_volume", "mould_weight", "speed_profile",
+        "mould_tare",
+        "left_tare", "left_pour", "left_overshoot", "left_offset", "left_fill_time",
+        "right_tare", "right_pour", "right_overshoot", "right_offset", "right_fill_time",
+    )
+
+    def __init__(self, flavour: str, desired_volume: float, mould_weight: float,
+                 speed_profile: str, started: float):
+        self.started = started
+        self.ended   = None
+        self.events  = {}
+        self.values  = {
+            "flavour": flavour,
+            "desired_volume": desired_volume,
+            "mould_weight": mould_weight,
+            "speed_profile": speed_profile,
+        }
+
+    @classmethod
+    def columns(cls, events) -> tuple:
+        """CSV columns for records whose timestamps cover `events`."""
+        return cls.FIELDS + tuple(f"t_{event}" for event in events)
+
+    def mark(self, event: str, t: float) -> None:
+        """Timestamp the first occurrence of `event` (wall-clock seconds)."""
+        self.events.setdefault(event, t)
+
+    def update(self, **values) -> None:
+        self.values.update(values)
+
+    def finish(self, t: float) -> None:
+        self.ended = t
+
+    def as_row(self) -> dict:
+        """Flatten into a column -> value dict, rounding to gram resolution."""
+        row = {key: round(value, 4) if isinstance(value, float) else value
+               for key, value in self.values.items()}
+        row["cycle_start"] = datetime.fromtimestamp(self.started).isoformat(timespec="milliseconds")
+        if self.ended is not None:
+            row["cycle_time"] = round(self.ended - self.started, 3)
+        for event, t in self.events.items():
+            row[f"t_{event}"] = round(t - self.started, 3)
+        for side in SIDES:
+            # A parallel fill starts both moulds at once
+            start = self.events.get("fill_both", self.events.get(f"fill_{side}_fast"))
+            cutoff = self.events.get(f"{side}_cutoff")
+            if start is not None and cutoff is not None:
+                row[f"{side}_fill_time"] = round(cutoff - start, 3)
+        return row
+
+
+def export_parquet(csv_path: str) -> str:
+    """
+    Convert one day's CSV into a Parquet file alongside it.
+    Returns:
+        str: Path of the Parquet file, or None if pyarrow is unavailable.
+    """
+    if pyarrow is None:
+        return None
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    table = pyarrow.csv.read_csv(csv_path)
+    pyarrow.parquet.write_table(table, parquet_path)
+    return parquet_path
+
+
+class CycleWriter:
+    """
+    Appends cycle rows to one CSV per day (`<prefix>_YYYY-MM-DD.csv`) from a
+    background thread, so the filling loop only pays for a queue put. Rows
+    are written in batches and the file is flushed every `flush_interval`.
+    With `parquet`, each day's CSV is also exported to Parquet when the day
+    rotates and at shutdown.
+    """
+
+    def __init__(self, directory: str, columns, flush_interval: float = 5.0,
+                 parquet: bool = False, prefix: str = "cycles"):
+        if parquet and pyarrow is None:
+            logger.warning("pyarrow not installed; cycle records are written as CSV only")
+            parquet = False
+        self.directory      = directory
+        self.columns        = tuple(columns)
+        self.flush_interval = flush_interval
+        self.parquet        = parquet
+        self.prefix         = prefix
+        self.rows_written   = 0
+        self._queue         = queue.SimpleQueue()
+        self._start_lock    = threading.Lock()
+        self._thread        = None
+        self._file          = None
+        self._writer        = None
+        self._day           = None
+
+    def path_for(self, day: str) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{day}.csv")
+
+    def write(self, row: dict) -> None:
+        """Queue a row; the writer thread is started on first use."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put(row)
+
+    def close(self) -> None:
+        """Write out everything queued and close the current file."""
+        if self._thread is not None:
+            self._queue.put(None)                 # wake the writer to finish
+            self._thread.join(timeout=5.0)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stopping = None in batch
+            rows = [row for row in batch if row is not None]
+            try:
+                self._write_batch(rows)
+            except Exception:
+                logger.exception("Failed to write %s cycle records", len(rows))
+        self._close_day()
+
+    def _write_batch(self, rows) -> None:
+        for row in rows:
+            day = row["cycle_start"][:10]
+            if day != self._day:
+                self._open_day(day)
+            self._writer.writerow([row.get(column, "") for column in self.columns])
+            self.rows_written += 1
+        if rows and self._file is not None:
+            self._file.flush()
+
+    def _open_day(self, day: str) -> None:
+        self._close_day()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(day)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file and self._header(path) != list(self.columns):
+            # Columns changed (e.g. after an upgrade); keep the old rows apart
+            moved = self._free_path(path)
+            os.replace(path, moved)
+            logger.warning("Cycle record columns changed; moved %s to %s", path, moved)
+            new_file = True
+        self._file   = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._day    = day
+        if new_file:
+            self._writer.writerow(self.columns)
+        logger.info("Cycle records now written to %s", path)
+
+    @staticmethod
+    def _header(path: str) -> list:
+        with open(path, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f), [])
+
+    @staticmethod
+    def _free_path(path: str) -> str:
+        stem, ext = os.path.splitext(path)
+        n = 1
+        while os.path.exists(f"{stem}.{n}{ext}"):
+            n += 1
+        return f"{stem}.{n}{ext}"
+
+    def _close_day(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        path, self._file, self._writer = self.path_for(self._day), None, None
+        if self.parquet:
+            try:
+                export_parquet(path)
+            except Exception:
+                logger.exception("Parquet export of %s failed", path)
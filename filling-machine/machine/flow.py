@@ -0,0 +1,54 @@
+# machine/flow.py
+
+from machine.scale_buffer import ScaleBuffer
+
+
+def least_squares_slope(samples) -> float:
+    """
+    Ordinary least-squares slope of smoothed weight over time.
+    Args:
+        samples (list): ScaleSample tuples, at least two with distinct timestamps.
+    Returns:
+        float: Slope in kg/s, or None if it cannot be computed.
+    """
+    n = len(samples)
+    if n < 2:
+        return None
+    t0 = samples[0].t
+    mean_t = sum(s.t - t0 for s in samples) / n
+    mean_w = sum(s.kg for s in samples) / n
+    num = 0.0
+    den = 0.0
+    for s in samples:
+        dt = s.t - t0 - mean_t
+        num += dt * (s.kg - mean_w)
+        den += dt * dt
+    if den == 0.0:
+        return None
+    return num / den
+
+
+class FlowEstimator:
+    """
+    Online flow-rate estimate from the recent scale window.
+    Fits a least-squares line through the samples of the last `window`
+    seconds, which is far less noisy than differencing two readings.
+    """
+
+    def __init__(self, window: float = 0.5, min_samples: int = 4):
+        self.window      = window
+        self.min_samples = min_samples
+
+    def rate(self, buffer: ScaleBuffer, now: float = None) -> float:
+        """
+        Estimate the current flow rate into the mould.
+        Args:
+            buffer (ScaleBuffer): Source of recent scale samples.
+            now (float): Monotonic time the window ends at; defaults to now.
+        Returns:
+            float: Flow rate in kg/s, or None with too few samples.
+        """
+        samples = buffer.window(self.window, now=now)
+        if len(samples) < self.min_samples:
+            return None
+        return least_squares_slope(samples)
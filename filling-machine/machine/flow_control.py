@@ -0,0 +1,67 @@
+# machine/flow_control.py
+
+
+def flow_setpoint(remaining: float, max_flow: float, min_flow: float, approach: float) -> float:
+    """
+    Flow-rate setpoint for `remaining` kg still to pour.
+    Aims to pour the remainder in `approach` seconds, so the flow is the
+    full `max_flow` far from the target and decays towards `min_flow` as it
+    gets close.
+    Returns:
+        float: Setpoint in kg/s.
+    """
+    if approach <= 0:
+        return max_flow
+    return max(min_flow, min(max_flow, remaining / approach))
+
+
+class PIController:
+    """
+    Proportional-integral controller with a clamped output.
+    Anti-windup by back-calculation: whenever the output saturates, the
+    integral is pulled back to the value that just reaches the limit, so
+    it never accumulates error the actuator could not act on and the loop
+    recovers as soon as the error changes sign.
+    """
+
+    def __init__(self, kp: float, ki: float, out_min: float, out_max: float):
+        self.kp        = kp
+        self.ki        = ki
+        self.out_min   = out_min
+        self.out_max   = out_max
+        self._integral = None
+        self._last     = None
+
+    @property
+    def active(self) -> bool:
+        """True once the controller has been seeded with an output."""
+        return self._integral is not None
+
+    def reset(self, output: float = None) -> None:
+        """
+        Restart the controller. Seeding it with the output currently applied
+        gives a bumpless hand-over from open loop; None leaves it inactive.
+        """
+        self._integral = output
+        self._last     = None
+
+    def update(self, setpoint: float, measured: float, now: float) -> float:
+        """
+        Compute the next output.
+        Args:
+            setpoint (float): Desired value.
+            measured (float): Current measurement.
+            now (float): Monotonic time of the measurement (s).
+        Returns:
+            float: Output, clamped to [out_min, out_max].
+        """
+        if self._integral is None:
+            self._integral = self.out_min
+        dt = 0.0 if self._last is None else max(0.0, now - self._last)
+        self._last = now
+        error = setpoint - measured
+        proportional = self.kp * error
+        integral = self._integral + self.ki * error * dt
+        integral = max(self.out_min - proportional, min(self.out_max - proportional, integral))
+        self._integral = integral
+        return max(self.out_min, min(self.out_max, proportional + integral))
@@ -0,0 +1,116 @@
+# machine/flow_split.py
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+SIDES = ("left", "right")
+
+
+class FlowSplit:
+    """
+    Learned share of the pump flow each mould receives with both valves open.
+    Each valve and nozzle is treated as a fixed restriction: its flow per Hz,
+    measured while it is the only valve open, is proportional to its
+    conductance, so with both open the left mould receives kL / (kL + kR).
+    That holds while the valves rather than the pump limit the flow; for a
+    pump that delivers the same flow through either valve, configure the
+    split instead (`fixed`). Per-flavour estimates are exponentially
+    weighted and persisted as JSON so learning survives restarts.
+    """
+
+    def __init__(self, path: str, alpha: float = 0.2, fixed: dict = None):
+        self._path  = path
+        self.alpha  = alpha
+        self.fixed  = dict(fixed or {})     # flavour -> left share
+        self._lock  = threading.Lock()
+        self._dirty = False
+        self._table = self._load()
+
+    @staticmethod
+    def key(flavour: str, side: str) -> str:
+        """Table key for one flavour/side combination."""
+        return f"{flavour}/{side}"
+
+    def _load(self) -> dict:
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable flow split table %r: %s", self._path, e)
+            return {}
+        table = {}
+        for key, entry in data.items():
+            try:
+                table[key] = {"per_hz": float(entry["per_hz"]), "count": int(entry["count"])}
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Ignoring malformed flow split entry %r", key)
+        logger.info("Loaded %s flow split entries from %s", len(table), self._path)
+        return table
+
+    def update(self, flavour: str, side: str, rate: float, hz: float) -> None:
+        """
+        Fold a single-valve flow measurement into the estimate.
+        Args:
+            rate (float): Measured flow into the mould (kg/s).
+            hz (float): Pump speed the flow was measured at.
+        """
+        if rate is None or rate <= 0.0 or hz <= 0.0:
+            return
+        key = self.key(flavour, side)
+        per_hz = rate / hz
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is not None:
+                per_hz = (1 - self.alpha) * entry["per_hz"] + self.alpha * per_hz
+            count = entry["count"] + 1 if entry else 1
+            self._table[key] = {"per_hz": per_hz, "count": count}
+            self._dirty = True
+        logger.debug("Flow split %s: %.4f kg/s/Hz n=%s", key, per_hz, count)
+
+    def samples(self, flavour: str) -> float:
+        """Measurements behind the less-known side of `flavour` (fixed splits count as known)."""
+        if flavour in self.fixed:
+            return float("inf")
+        with self._lock:
+            return min(self._table.get(self.key(flavour, side), {"count": 0})["count"] for side in SIDES)
+
+    def share(self, flavour: str, side: str) -> float:
+        """Fraction of the flow going to `side` with both valves open; 0.5 until known."""
+        if flavour in self.fixed:
+            left = float(self.fixed[flavour])
+        else:
+            with self._lock:
+                entries = [self._table.get(self.key(flavour, s)) for s in SIDES]
+            if None in entries:
+                left = 0.5
+            else:
+                left = entries[0]["per_hz"] / (entries[0]["per_hz"] + entries[1]["per_hz"])
+        return left if side == "left" else 1.0 - left
+
+    def snapshot(self) -> dict:
+        """Copy of the current table, in the form `save()` writes."""
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._table.items()}
+
+    def save(self) -> None:
+        """Write the table to disk if it changed; the file is replaced atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._table)
+            self._dirty = False
+        tmp = self._path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.error("Failed to save flow split table %r: %s", self._path, e)
+            with self._lock:
+                self._dirty = True
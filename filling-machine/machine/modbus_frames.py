@@ -0,0 +1,81 @@
+# machine/modbus_frames.py
+
+"""
+Modbus serial framing helpers (RTU and ASCII), shared by the virtual slave
+devices and anything else that has to build or parse raw frames.
+"""
+
+
+class FrameError(ValueError):
+    """Raised when a frame is truncated or fails its CRC/LRC check."""
+
+
+def crc16(data: bytes) -> int:
+    """Modbus RTU CRC-16 (polynomial 0xA001, initial value 0xFFFF)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def lrc(data: bytes) -> int:
+    """Modbus ASCII longitudinal redundancy check."""
+    return (-sum(data)) & 0xFF
+
+
+def encode_rtu(address: int, pdu: bytes) -> bytes:
+    """Build an RTU frame: address + PDU + CRC (low byte first)."""
+    body = bytes([address]) + pdu
+    crc = crc16(body)
+    return body + bytes([crc & 0xFF, crc >> 8])
+
+
+def decode_rtu(frame: bytes) -> tuple:
+    """
+    Split an RTU frame into (address, pdu).
+    Raises:
+        FrameError: if the frame is too short or the CRC does not match.
+    """
+    if len(frame) < 4:
+        raise FrameError(f"RTU frame too short: {frame.hex()}")
+    body, received = frame[:-2], frame[-2] | (frame[-1] << 8)
+    if crc16(body) != received:
+        raise FrameError(f"RTU CRC mismatch: {frame.hex()}")
+    return body[0], body[1:]
+
+
+def encode_ascii(address: int, pdu: bytes) -> bytes:
+    """Build an ASCII frame: ':' + hex(address + PDU + LRC) + CR LF."""
+    body = bytes([address]) + pdu
+    return b":" + (body + bytes([lrc(body)])).hex().upper().encode("ascii") + b"\r\n"
+
+
+def decode_ascii(frame: bytes) -> tuple:
+    """
+    Split an ASCII frame into (address, pdu).
+    Raises:
+        FrameError: if the frame is malformed or the LRC does not match.
+    """
+    frame = frame.strip()
+    if not frame.startswith(b":") or len(frame) < 7:
+        raise FrameError(f"Malformed ASCII frame: {frame!r}")
+    try:
+        raw = bytes.fromhex(frame[1:].decode("ascii"))
+    except ValueError:
+        raise FrameError(f"Invalid hex in ASCII frame: {frame!r}")
+    body, received = raw[:-1], raw[-1]
+    if lrc(body) != received:
+        raise FrameError(f"ASCII LRC mismatch: {frame!r}")
+    return body[0], body[1:]
+
+
+def frame_length(pdu_length: int, ascii_mode: bool = False) -> int:
+    """Number of characters on the wire for a PDU of `pdu_length` bytes."""
+    if ascii_mode:
+        return 1 + 2 * (1 + pdu_length + 1) + 2
+    return 1 + pdu_length + 2
@@ -1,240 +1,590 @@
 import minimalmodbus
 import serial
 import logging
-import time
 import threading
 from collections import deque
 import glob
 import os
 
-class ModbusInterface:
+from machine.bus_stats import BusStats, classify_error
+from machine.clock import RealClock
+from machine.bus_scheduler import (BusScheduler, TransactionDropped, PRIORITY_CRITICAL,
+                                   PRIORITY_COMMAND, PRIORITY_REFRESH)
+
+logger = logging.getLogger(__name__)
+
+def port_settings(config) -> dict:
+    """
+    Serial port, baud rate and response timeout of each device.
+    `vfd_port`, `scale_port` and `valve_port` in the config override the
+    CH9344 defaults (e.g. to point at virtual devices), as do the matching
+    `*_baudrate` keys for the line speed and `*_timeout` keys for the
+    response timeout.
+    Returns:
+        dict: {'vfd'|'scale'|'valves': (port, baudrate, timeout)}
+    """
+    # Static port selection for CH9344 USB adapter
+    if os.path.exists("/dev/ttyCH9344USB0"):
+        valve_port = "/dev/ttyCH9344USB0"
+        scale_port = "/dev/ttyCH9344USB1"
+        vfd_port   = "/dev/ttyCH9344USB2"
+        logger.info("Detected CH9344 USB ports at /dev/ttyCH9344USB0..2")
+    else:
+        valve_port = "/dev/ttyCH9344USB8"
+        scale_port = "/dev/ttyCH9344USB9"
+        vfd_port   = "/dev/ttyCH9344USB10"
+        logger.info("Using fallback CH9344 USB ports at /dev/ttyCH9344USB8..10")
+    return {
+        "vfd":    (config.get("vfd_port") or vfd_port, config.get("vfd_baudrate", 19200),
+                   config.get("vfd_timeout", 0.05)),
+        "scale":  (config.get("scale_port") or scale_port, config.get("scale_baudrate", 9600),
+                   config.get("scale_timeout", 0.05)),
+        "valves": (config.get("valve_port") or valve_port, config.get("valve_baudrate", 9600),
+                   config.get("valve_timeout", 0.05)),
+    }
+
+
+class CommandShadow:
+    """
+    Last acknowledged value per register/coil, so that unchanged commands
+    are not rewritten on every loop iteration. An unchanged value is still
+    refreshed once per `keepalive_interval` (None disables the refresh).
+    Mixed into the bus interfaces, which provide `clock`.
+    """
+
+    def _init_shadow(self, keepalive_interval: float) -> None:
+        self.keepalive_interval = keepalive_interval
+        self._shadow = {}
+        self._shadow_lock = threading.Lock()
+        self._written_count = 0
+        self._skipped_count = 0
+
+    def _shadow_is_current(self, key, value) -> bool:
+        """
+        Check whether `value` was already acknowledged for `key` recently
+        enough that writing it again is unnecessary. Counts the skip.
+        Args:
+            key (tuple): (device, address) identifying a register or coil.
+            value: The value about to be written.
+        Returns:
+            bool: True if the write can be skipped.
+        """
+        with self._shadow_lock:
+            entry = self._shadow.get(key)
+            if entry is None or entry[0] != value:
+                return False
+            if self.keepalive_interval is not None and self.clock() - entry[1] >= self.keepalive_interval:
+                return False
+            self._skipped_count += 1
+            return True
+
+    def _shadow_store(self, key, value):
+        """Record `value` as acknowledged by the device for `key`."""
+        with self._shadow_lock:
+            self._shadow[key] = (value, self.clock())
+            self._written_count += 1
+
+    def _shadow_confirm(self, key, value):
+        """Record `value` as read back from the device for `key`, restarting its keep-alive."""
+        with self._shadow_lock:
+            self._shadow[key] = (value, self.clock())
+
+    def invalidate_shadow(self, device: str = None):
+        """
+        Forget acknowledged values so the next command is always written.
+        Args:
+            device (str): 'vfd' or 'valves' to limit the reset, or None for all.
+        """
+        with self._shadow_lock:
+            if device is None:
+                self._shadow.clear()
+            else:
+                for key in [k for k in self._shadow if k[0] == device]:
+                    del self._shadow[key]
+        logger.debug("Command shadow invalidated for %s.", device or 'all devices')
+
+    def shadow_stats(self) -> dict:
+        """
+        Report how many commands were written and how many were skipped
+        because the device already held the requested value.
+        Returns:
+            dict: {'written': int, 'skipped': int}
+        """
+        with self._shadow_lock:
+            return {"written": self._written_count, "skipped": self._skipped_count}
+
+    def _refresh_only(self, key, value) -> bool:
+        """True if `value` is already acknowledged for `key`, so writing it is only a keep-alive."""
+        with self._shadow_lock:
+            entry = self._shadow.get(key)
+            return entry is not None and entry[0] == value
+
+
+class ModbusInterface(CommandShadow):
     """
     Wraps three Modbus devices on the same serial bus:
       - VFD (address 2, ASCII mode, 19200 baud, /dev/ttySC1)
       - Load cell (address 1, RTU mode, 9600 baud, /dev/ttySC0)
       - Valve controller (address 3, RTU mode, 9600 baud, /dev/ttySC0)
-    Provides thread-safe access and polling mechanisms with rate limiting.
+    Every transaction goes through a BusScheduler for its serial port, which
+    sends the most urgent first and keeps each device's poll interval.
     """
 
-    def __init__(self, config):
-        logging.info("Initializing ModbusInterface with provided configuration.")
+    # Waveshare 8-ch relay board: bit n of a valve mask drives relay n+1
+    RELAY_CHANNELS = 8
+    VALVE_LEFT     = 0x01
+    VALVE_RIGHT    = 0x02
 
-        # Static port selection for CH9344 USB adapter
-        if os.path.exists("/dev/ttyCH9344USB0"):
-            valve_port = "/dev/ttyCH9344USB0"
-            scale_port = "/dev/ttyCH9344USB1"
-            vfd_port   = "/dev/ttyCH9344USB2"
-            logging.info("Detected CH9344 USB ports at /dev/ttyCH9344USB0..2")
+    def __init__(self, config, instruments: dict = None, clock: RealClock = None):
+        """
+        Args:
+            config: Config (or dict-like) providing poll intervals.
+            instruments (dict): Optional prebuilt 'vfd', 'scale' and 'valves'
+                instruments, e.g. simulated ones; skips serial port setup.
+            clock (RealClock): Time source and waits of the bus schedulers;
+                a SimClock runs simulated instruments faster than real time.
+        """
+        logger.info("Initializing ModbusInterface with provided configuration.")
+        self.clock = clock or RealClock()
+
+        if instruments is not None:
+            self.vfd    = instruments["vfd"]
+            self.scale  = instruments["scale"]
+            self.valves = instruments["valves"]
+            logger.info("Using injected Modbus instruments.")
         else:
-            valve_port = "/dev/ttyCH9344USB8"
-            scale_port = "/dev/ttyCH9344USB9"
-            vfd_port   = "/dev/ttyCH9344USB10"
-            logging.info("Using fallback CH9344 USB ports at /dev/ttyCH9344USB8..10")
+            self._open_instruments(config)
+
+        # Poll intervals (seconds) for each device, fetched from config dict
+        self.vfd_interval   = config.get("vfd_poll_interval")
+        self.scale_interval = config.get("scale_poll_interval")
+        self.valve_interval = config.get("valve_poll_interval")
+        logger.info("Polling intervals set - VFD: %ss, Scale: %ss, Valve: %ss", self.vfd_interval, self.scale_interval, self.valve_interval)
+
+        # Track last transaction times, reported by poll()
+        self._last_vfd_time   = self.clock()
+        self._last_scale_time = self.clock()
+        self._last_valve_time = self.clock()
+
+        # One transaction scheduler per serial port; the poll intervals
+        # become the minimum spacing between one device's transactions
+        self.vfd_stop_command = config.get("vfd_stop_command")
+        self._schedulers = {}
+        self._scheduler_for = {}
+        intervals = {"vfd": self.vfd_interval, "scale": self.scale_interval, "valves": self.valve_interval}
+        for device in ("vfd", "scale", "valves"):
+            port = getattr(getattr(self, device).serial, "port", None) or device
+            if port not in self._schedulers:
+                self._schedulers[port] = BusScheduler(port, intervals, clock=self.clock)
+            self._scheduler_for[device] = self._schedulers[port]
+        logger.debug("Bus schedulers started for ports: %s", ", ".join(self._schedulers))
+
+        # History of recent load-cell readings for smoothing, maxlen=5
+        self._scale_history = deque(maxlen=5)
+        logger.debug("Initialized load cell reading history buffer.")
+
+        # Serialises merging single-valve commands into the relay mask;
+        # bus access itself is serialised by the port schedulers
+        self._valve_lock = self.clock.rlock()
+
+        # Track commanded relay states so single-valve commands can be merged
+        # into one combined coil write
+        self._coil_mask = 0
+        logger.debug("Valve states initialized to closed (0).")
+
+        # Latency histograms and failure counters per device/operation;
+        # timeouts and checksum errors are retried up to `modbus_retries` times
+        self.stats   = BusStats()
+        self.retries = config.get("modbus_retries", 0)
+
+        # Command shadow of acknowledged register/coil values, refreshed
+        # once per keep-alive interval (None disables the refresh entirely)
+        self._init_shadow(config.get("command_keepalive_interval", 1.0))
+        logger.debug("Command shadow initialized with keep-alive %ss.", self.keepalive_interval)
+
+    def _open_instruments(self, config):
+        """
+        Open the VFD, load cell and valve controller on the serial ports
+        given by `port_settings(config)`.
+        """
+        settings = port_settings(config)
+        vfd_port, vfd_baud, vfd_timeout       = settings["vfd"]
+        scale_port, scale_baud, scale_timeout = settings["scale"]
+        valve_port, valve_baud, valve_timeout = settings["valves"]
 
         # Initialize VFD instrument (ASCII mode)
         self.vfd = minimalmodbus.Instrument(vfd_port, 2, minimalmodbus.MODE_ASCII)
-        self.vfd.serial.baudrate = 19200
-        self.vfd.serial.timeout  = 0.05
+        self.vfd.serial.baudrate = vfd_baud
+        self.vfd.serial.timeout  = vfd_timeout
         self.vfd.serial.parity   = minimalmodbus.serial.PARITY_NONE
         self.vfd.serial.bytesize = 8
         self.vfd.serial.stopbits = 1
         self.vfd.clear_buffers_before_each_transaction = True
         self.vfd.close_port_after_each_call            = False
-        logging.debug(f"Configured VFD on port {vfd_port} with ASCII mode, 19200 baud.")
+        logger.debug("Configured VFD on port %s with ASCII mode, %s baud.", vfd_port, vfd_baud)
 
         # Initialize Load cell instrument (RTU mode)
         self.scale = minimalmodbus.Instrument(scale_port, 1)
         self.scale.mode    = minimalmodbus.MODE_RTU
-        self.scale.serial.baudrate = 9600
-        self.scale.serial.timeout  = 0.05
+        self.scale.serial.baudrate = scale_baud
+        self.scale.serial.timeout  = scale_timeout
         self.scale.serial.parity   = minimalmodbus.serial.PARITY_NONE
         self.scale.serial.bytesize = 8
         self.scale.serial.stopbits = 1
         self.scale.clear_buffers_before_each_transaction = True
         self.scale.close_port_after_each_call            = False
-        logging.debug(f"Configured Load cell on port {scale_port} with RTU mode, 9600 baud.")
+        logger.debug("Configured Load cell on port %s with RTU mode, %s baud.", scale_port, scale_baud)
 
         # Initialize Valve controller instrument (RTU mode)
         self.valves = minimalmodbus.Instrument(valve_port, 1)
         self.valves.mode    = minimalmodbus.MODE_RTU
-        self.valves.serial.baudrate = 9600
-        self.valves.serial.timeout  = 0.05
+        self.valves.serial.baudrate = valve_baud
+        self.valves.serial.timeout  = valve_timeout
         self.valves.serial.parity   = minimalmodbus.serial.PARITY_NONE
         self.valves.serial.bytesize = 8
         self.valves.serial.stopbits = 1
         self.valves.clear_buffers_before_each_transaction = True
         self.valves.close_port_after_each_call            = False
-        logging.debug(f"Configured Valve controller on port {valve_port} with RTU mode, 9600 baud.")
+        logger.debug("Configured Valve controller on port %s with RTU mode, %s baud.", valve_port, valve_baud)
 
-        # Poll intervals (seconds) for each device, fetched from config dict
-        self.vfd_interval   = config.get("vfd_poll_interval")
-        self.scale_interval = config.get("scale_poll_interval")
-        self.valve_interval = config.get("valve_poll_interval")
-        logging.info(f"Polling intervals set - VFD: {self.vfd_interval}s, Scale: {self.scale_interval}s, Valve: {self.valve_interval}s")
+    def _submit_write(self, device: str, key, value, func, urgent: bool):
+        """
+        Queue a register/coil write on the device's port.
+        Keep-alive rewrites of an acknowledged value go at refresh priority
+        and are abandoned if the bus is too busy to send them in time.
+        Returns:
+            Transaction: To be passed to `_wait_write`.
+        """
+        if urgent:
+            priority = PRIORITY_CRITICAL
+        elif self._refresh_only(key, value):
+            priority = PRIORITY_REFRESH
+        else:
+            priority = PRIORITY_COMMAND
+        return self._scheduler_for[device].submit(func, device, priority, key=key,
+                                                  drop_late=priority == PRIORITY_REFRESH)
 
-        # Track last poll times to enforce minimum polling intervals
-        self._last_vfd_time   = time.time()
-        self._last_scale_time = time.time()
-        self._last_valve_time = time.time()
+    @staticmethod
+    def _wait_write(txn) -> bool:
+        """
+        Wait for a queued write.
+        Returns:
+            bool: True if written, False if superseded or abandoned.
+        """
+        try:
+            txn.result()
+        except TransactionDropped as e:
+            logger.debug("%s", e)
+            return False
+        return True
 
-        # History of recent load-cell readings for smoothing, maxlen=5
-        self._scale_history = deque(maxlen=5)
-        logging.debug("Initialized load cell reading history buffer.")
+    def _transact(self, device: str, op: str, func):
+        """
+        Run one instrument call on the bus worker, timing it into `stats`
+        and retrying timeouts and checksum errors up to `retries` times.
+        """
+        start   = self.clock()
+        attempt = 0
+        while True:
+            try:
+                result = func()
+            except Exception as e:
+                kind = classify_error(e)
+                self.stats.count(device, op, kind)
+                if kind == "error" or attempt >= self.retries:
+                    self.stats.record(device, op, self.clock() - start, ok=False)
+                    raise
+                attempt += 1
+                self.stats.count(device, op, "retry")
+                logger.debug("Retrying %s %s after %s (attempt %s)", device, op, kind, attempt)
+                continue
+            self.stats.record(device, op, self.clock() - start)
+            return result
+
+    def transaction_stats(self) -> dict:
+        """
+        Transaction latency percentiles and failure counters since startup.
+        Returns:
+            dict: {'device/op': {...}}, see BusStats.snapshot().
+        """
+        return self.stats.snapshot()
+
+    def scheduler_stats(self) -> dict:
+        """
+        Queueing latency per priority class for every serial port.
+        Returns:
+            dict: {port: BusScheduler.stats()}
+        """
+        return {port: scheduler.stats() for port, scheduler in self._schedulers.items()}
 
-        # Locks to prevent concurrent access to shared resources
-        self._vfd_lock = threading.Lock()
-        self._valve_lock = threading.Lock()
-        self._scale_lock = threading.Lock()
-        logging.debug("Threading locks initialized for VFD, valves, and scale.")
+    def timing(self, device: str) -> tuple:
+        """Current (minimum transaction spacing, response timeout) of `device` in seconds."""
+        return (self._scheduler_for[device].intervals.get(device, 0.0),
+                getattr(self, device).serial.timeout)
 
-        # Track current valve states for combined register writes if needed
-        self._valve1_state = 0
-        self._valve2_state = 0
-        logging.debug("Valve states initialized to closed (0).")
+    def set_timing(self, device: str, interval: float = None, timeout: float = None) -> None:
+        """
+        Change a device's minimum transaction spacing and/or response timeout
+        at runtime, e.g. while calibrating the bus.
+        Args:
+            device (str): 'vfd', 'scale' or 'valves'.
+            interval (float): Seconds between transactions, None to keep.
+            timeout (float): Serial response timeout in seconds, None to keep.
+        """
+        if interval is not None:
+            self._scheduler_for[device].intervals[device] = interval
+            setattr(self, {"vfd": "vfd_interval", "scale": "scale_interval", "valves": "valve_interval"}[device], interval)
+        if timeout is not None:
+            getattr(self, device).serial.timeout = timeout
+        logger.debug("Timing for %s: interval=%s timeout=%s", device, interval, timeout)
+
+    def probe(self, device: str):
+        """
+        One read-only transaction with `device` (scale weight, VFD status word
+        or relay states), timed into `stats` as '<device>/probe'. Used to
+        measure the bus without commanding anything.
+        """
+        reads = {
+            "vfd":    lambda: self.vfd.read_register(0x2002, 0, functioncode=3),
+            "scale":  lambda: self.scale.read_long(0x0000, 3, False, 0),
+            "valves": lambda: self.valves.read_bits(0x0000, self.RELAY_CHANNELS, functioncode=1),
+        }
+        read = reads[device]
+        return self._scheduler_for[device].call(lambda: self._transact(device, "probe", read),
+                                                device, PRIORITY_COMMAND)
+
+    def close(self) -> None:
+        """Stop the bus schedulers once queued transactions have been sent."""
+        for scheduler in self._schedulers.values():
+            scheduler.close()
+        logger.info("Modbus transaction statistics:\n%s", self.stats.format())
+        logger.info("ModbusInterface closed.")
 
     def read_load_cell(self) -> float:
         """
         Read the current load-cell value, smoothed over recent readings.
-        Enforces minimum interval between reads to avoid bus flooding.
         Returns:
             float: Smoothed load-cell weight in kilograms.
         """
-        now     = time.time()
-        elapsed = now - self._last_scale_time
-        logging.debug(f"Attempting to read load cell; {elapsed:.3f}s since last read.")
-        if elapsed < self.scale_interval:
-            sleep_time = self.scale_interval - elapsed
-            logging.debug(f"Sleeping for {sleep_time:.3f}s to enforce scale poll interval.")
-            time.sleep(sleep_time)
+        return self.read_load_cell_sample()[1]
 
-        with self._scale_lock:
+    def read_load_cell_sample(self) -> tuple:
+        """
+        Read the load cell and return both the raw and the smoothed weight.
+        The read is queued at critical priority; the scheduler keeps the
+        scale poll interval between reads.
+        Returns:
+            tuple: (raw weight, smoothed weight) in kilograms.
+        """
+        def read():
             try:
-                raw = self.scale.read_long(0x0000, 3, False, 0)
-                logging.debug(f"Raw load cell reading: {raw}")
+                raw = self._transact("scale", "read", lambda: self.scale.read_long(0x0000, 3, False, 0))
+                logger.debug("Raw load cell reading: %s", raw)
             except Exception as e:
-                logging.error(f"Exception during load cell read: {e}", exc_info=True)
+                logger.error("Exception during load cell read: %s", e, exc_info=True)
                 raise
+            self._last_scale_time = self.clock()
+            return raw
+
+        raw = self._scheduler_for["scale"].call(read, "scale", PRIORITY_CRITICAL)
 
         # Convert 32-bit signed integer from unsigned if necessary
         if raw > 0x7FFFFFFF:
             raw -= 0x100000000
-            logging.debug(f"Converted raw load cell value to signed: {raw}")
+            logger.debug("Converted raw load cell value to signed: %s", raw)
 
         # Convert raw value to kilograms (assuming scale factor 1000)
         weight = raw / 1000.0
-        logging.debug(f"Converted load cell reading to kg: {weight:.3f}")
+        logger.debug("Converted load cell reading to kg: %.3f", weight)
 
         # Add to history for smoothing
         self._scale_history.append(weight)
         avg_weight = sum(self._scale_history) / len(self._scale_history)
-        logging.debug(f"Smoothed load cell weight over last {len(self._scale_history)} readings: {avg_weight:.3f} kg")
+        logger.debug("Smoothed load cell weight over last %s readings: %.3f kg", len(self._scale_history), avg_weight)
 
-        # Update timestamp after successful read
-        self._last_scale_time = time.time()
-        logging.info(f"Load cell reading updated at {self._last_scale_time}")
-        return avg_weight
+        logger.info("Load cell reading updated at %s", self._last_scale_time)
+        return weight, avg_weight
 
     def set_vfd_state(self, state: int):
         """
         Write to the VFD state register to control operation (e.g., 0=stop, 6=start).
-        Enforces minimum interval between writes to prevent bus flooding.
+        The stop command is queued at critical priority.
+        Skipped when the drive already acknowledged the same state.
         Args:
             state (int): Desired VFD state code.
+        Returns:
+            bool: True if the register was written, False if skipped.
         """
-        now = time.time()
-        elapsed = now - self._last_vfd_time
-        logging.debug(f"Setting VFD state to {state}; {elapsed:.3f}s since last VFD command.")
-        if elapsed < self.vfd_interval:
-            sleep_time = self.vfd_interval - elapsed
-            logging.debug(f"Sleeping for {sleep_time:.3f}s to enforce VFD poll interval.")
-            time.sleep(sleep_time)
+        if self._shadow_is_current(("vfd", 0x2000), state):
+            return False
 
-        with self._vfd_lock:
+        def write():
             try:
-                logging.info(f"Sending VFD control command {state} to register 0x2000")
-                self.vfd.write_register(0x2000, state, 0, functioncode=6)
-                self._last_vfd_time = time.time()
-                logging.info(f"VFD state set successfully at {self._last_vfd_time}")
+                logger.info("Sending VFD control command %s to register 0x2000", state)
+                self._transact("vfd", "write_state", lambda: self.vfd.write_register(0x2000, state, 0, functioncode=6))
+                self._last_vfd_time = self.clock()
+                self._shadow_store(("vfd", 0x2000), state)
+                logger.info("VFD state set successfully at %s", self._last_vfd_time)
             except Exception as e:
-                logging.error(f"Failed to set VFD state {state}: {e}", exc_info=True)
+                self.invalidate_shadow("vfd")
+                logger.error("Failed to set VFD state %s: %s", state, e, exc_info=True)
                 raise
 
+        return self._wait_write(self._submit_write("vfd", ("vfd", 0x2000), state, write,
+                                                   urgent=state == self.vfd_stop_command))
+
     def set_vfd_speed(self, speed: int):
         """
         Write to the VFD speed register.
         `speed` should already be scaled appropriately (e.g., Hz × 100).
-        Enforces minimum interval between writes.
+        A zero speed is queued at critical priority.
+        Skipped when the drive already acknowledged the same speed.
         Args:
             speed (int): Speed reference value.
+        Returns:
+            bool: True if the register was written, False if skipped.
         """
-        now = time.time()
-        elapsed = now - self._last_vfd_time
-        logging.debug(f"Setting VFD speed to {speed}; {elapsed:.3f}s since last VFD command.")
-        if elapsed < self.vfd_interval:
-            sleep_time = self.vfd_interval - elapsed
-            logging.debug(f"Sleeping for {sleep_time:.3f}s to enforce VFD poll interval.")
-            time.sleep(sleep_time)
+        if self._shadow_is_current(("vfd", 0x2001), speed):
+            return False
 
-        with self._vfd_lock:
+        def write():
             try:
-                logging.info(f"Setting VFD speed reference to {speed} (×100) at register 0x2001")
-                self.vfd.write_register(0x2001, speed, 0, functioncode=6)
-                self._last_vfd_time = time.time()
-                logging.info(f"VFD speed set successfully at {self._last_vfd_time}")
+                logger.info("Setting VFD speed reference to %s (×100) at register 0x2001", speed)
+                self._transact("vfd", "write_speed", lambda: self.vfd.write_register(0x2001, speed, 0, functioncode=6))
+                self._last_vfd_time = self.clock()
+                self._shadow_store(("vfd", 0x2001), speed)
+                logger.info("VFD speed set successfully at %s", self._last_vfd_time)
             except Exception as e:
-                logging.error(f"Failed to set VFD speed {speed}: {e}", exc_info=True)
+                self.invalidate_shadow("vfd")
+                logger.error("Failed to set VFD speed %s: %s", speed, e, exc_info=True)
                 raise
 
+        return self._wait_write(self._submit_write("vfd", ("vfd", 0x2001), speed, write, urgent=speed == 0))
+
+    def read_vfd_block(self) -> tuple:
+        """
+        Read the VFD control word, speed reference and status word in one
+        Read Holding Registers (function code 3) transaction.
+        Returns:
+            tuple: (control, speed reference ×100, status) as read back from the drive.
+        """
+        def read():
+            try:
+                values = self._transact("vfd", "read_block",
+                                        lambda: self.vfd.read_registers(0x2000, 3, functioncode=3))
+            except Exception as e:
+                logger.error("Failed to read VFD register block: %s", e, exc_info=True)
+                raise
+            self._last_vfd_time = self.clock()
+            return values
+
+        control, speed, status = self._scheduler_for["vfd"].call(read, "vfd", PRIORITY_REFRESH)
+        logger.debug("VFD reports control=%s speed=%s status=%s", control, speed, status)
+        return control, speed, status
+
+    def verify_vfd(self, state: int, speed: int) -> dict:
+        """
+        Read-modify-verify: read back what the drive holds and rewrite only
+        the registers that differ from `state` and `speed`. Registers that
+        match are confirmed in the command shadow, so no keep-alive rewrite
+        is sent for them.
+        Returns:
+            dict: {'state', 'speed', 'status'} as read from the drive and
+                  'written', the registers that had to be rewritten.
+        """
+        control, reported_speed, status = self.read_vfd_block()
+        written = []
+        for key, target, reported, write in ((("vfd", 0x2000), state, control, self.set_vfd_state),
+                                             (("vfd", 0x2001), speed, reported_speed, self.set_vfd_speed)):
+            if reported == target:
+                self._shadow_confirm(key, target)
+                continue
+            logger.warning("VFD register %#06x reads %s, expected %s; rewriting", key[1], reported, target)
+            with self._shadow_lock:
+                self._shadow.pop(key, None)
+            write(target)
+            written.append(key[1])
+        return {"state": control, "speed": reported_speed, "status": status, "written": written}
+
+    def set_valves(self, mask: int):
+        """
+        Set every relay channel on the valve board in a single Write Multiple
+        Coils (function code 15) transaction, so both valves switch together.
+        A mask that closes any open relay is queued at critical priority.
+        Skipped when the board already acknowledged the same mask.
+        Args:
+            mask (int): Bit n drives relay n+1 (see VALVE_LEFT / VALVE_RIGHT).
+        Returns:
+            bool: True if the coils were written, False if skipped.
+        Raises:
+            ValueError: if mask does not fit the relay board.
+        """
+        if not 0 <= mask < (1 << self.RELAY_CHANNELS):
+            logger.error("Valve mask out of range: %s", mask)
+            raise ValueError(f"Valve mask out of range: {mask}")
+
+        def write():
+            bits = [(mask >> channel) & 1 for channel in range(self.RELAY_CHANNELS)]
+            try:
+                logger.info("Writing coils 0-%s to %s (function code 15)", self.RELAY_CHANNELS - 1, bits)
+                self._transact("valves", "write_mask", lambda: self.valves.write_bits(0x0000, bits))
+                self._shadow_store(("valves", "mask"), mask)
+            except Exception as e:
+                self.invalidate_shadow("valves")
+                logger.error("Valves MODBUS error writing mask %#04x: %s", mask, e, exc_info=True)
+                raise
+            finally:
+                self._last_valve_time = self.clock()
+            logger.info("Valve command completed at %s", self._last_valve_time)
+
+        # Queue under the lock so masks reach the bus in the order they were merged
+        with self._valve_lock:
+            closing = bool(self._coil_mask & ~mask)
+            self._coil_mask = mask
+            if self._shadow_is_current(("valves", "mask"), mask):
+                return False
+            txn = self._submit_write("valves", ("valves", "mask"), mask, write, urgent=closing)
+        return self._wait_write(txn)
+
     def set_valve(self, valve: str, action: str):
         """
-        Open or close specified valve(s).
-        Enforces minimum interval between writes and serializes access.
+        Open or close specified valve(s), leaving the other relays untouched.
+        The change is merged into the commanded relay mask and written with
+        `set_valves`, so 'both' switches atomically.
         Args:
             valve (str): 'left', 'right', or 'both'
             action (str): 'open' or 'close'
+        Returns:
+            bool: True if the coils were written, False if skipped or failed.
         Raises:
             ValueError: if valve or action is unknown.
         """
-        now     = time.time()
-        elapsed = now - self._last_valve_time
-        logging.debug(f"Setting valve(s) '{valve}' to '{action}'; {elapsed:.3f}s since last valve command.")
-        if elapsed < self.valve_interval:
-            sleep_time = self.valve_interval - elapsed
-            logging.debug(f"Sleeping for {sleep_time:.3f}s to enforce valve poll interval.")
-            time.sleep(sleep_time)
+        mapping = {"left": self.VALVE_LEFT, "right": self.VALVE_RIGHT}
+        if valve == "both":
+            bits = self.VALVE_LEFT | self.VALVE_RIGHT
+            logger.debug("Targeting both valves.")
+        elif valve in mapping:
+            bits = mapping[valve]
+            logger.debug("Targeting valve '%s' with mask %#04x.", valve, bits)
+        else:
+            logger.error("Unknown valve specified: %s", valve)
+            raise ValueError(f"Unknown valve: {valve}")
 
-        with self._valve_lock:
-            mapping = {"left": 0, "right": 1}
-            if valve == "both":
-                coils = list(mapping.values())
-                logging.debug("Targeting both valves.")
-            elif valve in mapping:
-                coils = [mapping[valve]]
-                logging.debug(f"Targeting valve '{valve}' at coil {coils[0]}.")
-            else:
-                logging.error(f"Unknown valve specified: {valve}")
-                raise ValueError(f"Unknown valve: {valve}")
+        if action not in ("open", "close"):
+            logger.error("Unknown action specified: %s", action)
+            raise ValueError(f"Unknown action: {action}")
+        logger.debug("Action is to %s valve(s).", action)
 
+        with self._valve_lock:
             if action == "open":
-                bit = True
-                logging.debug("Action is to open valve(s).")
-            elif action == "close":
-                bit = False
-                logging.debug("Action is to close valve(s).")
+                mask = self._coil_mask | bits
             else:
-                logging.error(f"Unknown action specified: {action}")
-                raise ValueError(f"Unknown action: {action}")
-
-            for coil in coils:
-                try:
-                    logging.info(f"Writing coil {coil} to {'ON' if bit else 'OFF'} (function code 5)")
-                    self.valves.write_bit(coil, bit)
-                    logging.info(f"Valve coil {coil} set successfully.")
-                except Exception as e:
-                    logging.error(f"Valves MODBUS error on coil {coil} action {action}: {e}", exc_info=True)
-
-        self._last_valve_time = time.time()
-        logging.info(f"Valve command completed at {self._last_valve_time}")
+                mask = self._coil_mask & ~bits
+            try:
+                return self.set_valves(mask)
+            except Exception as e:
+                logger.error("Valves MODBUS error on valve %s action %s: %s", valve, action, e)
+                return False
 
     def poll(self):
         """
@@ -246,42 +596,48 @@ class ModbusInterface:
         Returns:
             dict: Polled data from devices.
         """
-        now = time.time()
+        now = self.clock()
         result = {}
 
         # Poll scale if interval elapsed
         if now - self._last_scale_time >= self.scale_interval:
-            logging.debug("Polling load cell due to interval elapsed.")
+            logger.debug("Polling load cell due to interval elapsed.")
             try:
                 result['scale'] = self.read_load_cell()
                 self._last_scale_time = now
-                logging.info(f"Load cell polled successfully: {result['scale']:.3f} kg")
+                logger.info("Load cell polled successfully: %.3f kg", result['scale'])
             except Exception:
-                logging.exception("Error polling scale")
+                logger.exception("Error polling scale")
 
         # Poll VFD status register (0x2002) if interval elapsed
         if now - self._last_vfd_time >= self.vfd_interval:
-            logging.debug("Polling VFD status due to interval elapsed.")
+            logger.debug("Polling VFD status due to interval elapsed.")
             try:
-                vfd_status = self.vfd.read_register(0x2002, 0, functioncode=3)
+                vfd_status = self._scheduler_for["vfd"].call(
+                    lambda: self._transact("vfd", "read_status", lambda: self.vfd.read_register(0x2002, 0, functioncode=3)),
+                    "vfd", PRIORITY_REFRESH)
                 result['vfd'] = vfd_status
                 self._last_vfd_time = now
-                logging.info(f"VFD status polled successfully: {vfd_status}")
+                logger.info("VFD status polled successfully: %s", vfd_status)
             except Exception:
-                logging.exception("Error polling VFD")
+                logger.exception("Error polling VFD")
 
         # Poll valve coils if interval elapsed
         if now - self._last_valve_time >= self.valve_interval:
-            logging.debug("Polling valves due to interval elapsed.")
+            logger.debug("Polling valves due to interval elapsed.")
             try:
+                bits = self._scheduler_for["valves"].call(
+                    lambda: self._transact("valves", "read_mask",
+                                           lambda: self.valves.read_bits(0x0000, self.RELAY_CHANNELS, functioncode=1)),
+                    "valves", PRIORITY_REFRESH)
                 valves_state = {
-                    'left':  self.valves.read_bit(0, functioncode=1),
-                    'right': self.valves.read_bit(1, functioncode=1)
+                    'left':  bits[0],
+                    'right': bits[1]
                 }
                 result['valves'] = valves_state
                 self._last_valve_time = now
-                logging.info(f"Valve states polled successfully: {valves_state}")
+                logger.info("Valve states polled successfully: %s", valves_state)
             except Exception:
-                logging.exception("Error polling valves")
+                logger.exception("Error polling valves")
 
         return result
\ No newline at end of file
@@ -0,0 +1,235 @@
+# machine/modbus_slave.py
+
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from machine.modbus_frames import (FrameError, decode_ascii, decode_rtu,
+                                   encode_ascii, encode_rtu)
+
+logger = logging.getLogger(__name__)
+
+# Modbus exception codes
+ILLEGAL_FUNCTION     = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE   = 0x03
+
+
+class ModbusSlave:
+    """
+    Minimal Modbus slave device: a register map and a coil map answering
+    function codes 1, 2, 3, 4, 5, 6, 15 and 16. Addresses outside the maps
+    are rejected with ILLEGAL_DATA_ADDRESS, like a real device would.
+    """
+
+    def __init__(self, address: int, registers: dict = None, coils: dict = None):
+        self.address   = address
+        self.registers = dict(registers or {})
+        self.coils     = dict(coils or {})
+        self.requests  = 0
+        self._lock     = threading.Lock()
+
+    # Hooks for devices whose values come from somewhere else
+    def read_register(self, address: int) -> int:
+        return self.registers[address]
+
+    def write_register(self, address: int, value: int) -> None:
+        if address not in self.registers:
+            raise KeyError(address)
+        self.registers[address] = value
+
+    def handle(self, pdu: bytes) -> bytes:
+        """Execute one request PDU and return the response PDU."""
+        self.requests += 1
+        function = pdu[0]
+        try:
+            with self._lock:
+                if function in (1, 2):
+                    start, count = struct.unpack(">HH", pdu[1:5])
+                    bits = [self.coils[start + n] for n in range(count)]
+                    packed = bytearray((count + 7) // 8)
+                    for n, bit in enumerate(bits):
+                        if bit:
+                            packed[n // 8] |= 1 << (n % 8)
+                    return bytes([function, len(packed)]) + bytes(packed)
+                if function in (3, 4):
+                    start, count = struct.unpack(">HH", pdu[1:5])
+                    values = [self.read_register(start + n) & 0xFFFF for n in range(count)]
+                    return bytes([function, 2 * count]) + struct.pack(f">{count}H", *values)
+                if function == 5:
+                    coil, value = struct.unpack(">HH", pdu[1:5])
+                    if value not in (0x0000, 0xFF00):
+                        return bytes([function | 0x80, ILLEGAL_DATA_VALUE])
+                    if coil not in self.coils:
+                        raise KeyError(coil)
+                    self.coils[coil] = value == 0xFF00
+                    return pdu[:5]
+                if function == 6:
+                    register, value = struct.unpack(">HH", pdu[1:5])
+                    self.write_register(register, value)
+                    return pdu[:5]
+                if function == 15:
+                    start, count, nbytes = struct.unpack(">HHB", pdu[1:6])
+                    data = pdu[6:6 + nbytes]
+                    for n in range(count):
+                        if start + n not in self.coils:
+                            raise KeyError(start + n)
+                    for n in range(count):
+                        self.coils[start + n] = bool(data[n // 8] & (1 << (n % 8)))
+                    return pdu[:5]
+                if function == 16:
+                    start, count, nbytes = struct.unpack(">HHB", pdu[1:6])
+                    values = struct.unpack(f">{count}H", pdu[6:6 + 2 * count])
+                    for n, value in enumerate(values):
+                        self.write_register(start + n, value)
+                    return pdu[:5]
+        except KeyError:
+            return bytes([function | 0x80, ILLEGAL_DATA_ADDRESS])
+        except struct.error:
+            return bytes([function | 0x80, ILLEGAL_DATA_VALUE])
+        return bytes([function | 0x80, ILLEGAL_FUNCTION])
+
+
+class VfdSlave(ModbusSlave):
+    """VFD: control word 0x2000, speed reference 0x2001 (Hz × 100), status 0x2002."""
+
+    def __init__(self, address: int = 2, run_command: int = 2):
+        super().__init__(address, registers={0x2000: 0, 0x2001: 0, 0x2002: 0})
+        self.run_command = run_command
+
+    def write_register(self, address: int, value: int) -> None:
+        if address == 0x2002:
+            raise KeyError(address)              # status is read-only
+        super().write_register(address, value)
+        self.registers[0x2002] = 1 if self.registers[0x2000] == self.run_command else 0
+
+
+class LoadCellSlave(ModbusSlave):
+    """
+    Load-cell indicator: signed 32-bit weight in grams at 0x0000/0x0001
+    (high word first). `source` may supply the raw register value, e.g.
+    SimulatedPlant.read_grams; otherwise the `weight` attribute (kg) is used.
+    """
+
+    def __init__(self, address: int = 1, source=None):
+        super().__init__(address, registers={0x0000: 0, 0x0001: 0})
+        self.source = source
+        self.weight = 0.0
+
+    def read_register(self, address: int) -> int:
+        if address not in self.registers:
+            raise KeyError(address)
+        if self.source is not None:
+            raw = self.source() & 0xFFFFFFFF
+        else:
+            raw = int(round(self.weight * 1000.0)) & 0xFFFFFFFF
+        return raw >> 16 if address == 0x0000 else raw & 0xFFFF
+
+
+class RelayBoardSlave(ModbusSlave):
+    """Waveshare Modbus RTU 8-channel relay board: coils 0x0000-0x0007."""
+
+    def __init__(self, address: int = 1, channels: int = 8):
+        super().__init__(address, coils={n: False for n in range(channels)})
+
+    @property
+    def mask(self) -> int:
+        """Relay states as a bit mask, bit n = relay n+1."""
+        return sum(1 << n for n, on in self.coils.items() if on)
+
+
+class VirtualSerialPort:
+    """
+    Serves Modbus slaves on one end of a pseudo-terminal pair. Clients open
+    `port` like a real serial device. Frames are detected the way the wire
+    protocol defines them (3.5 character silence for RTU, ':' ... CR LF for
+    ASCII) and responses are delayed by the time the request and response
+    would take on the wire at `baudrate`, plus the device `turnaround`.
+    """
+
+    def __init__(self, slaves, baudrate: int = 9600, ascii_mode: bool = False,
+                 turnaround: float = 0.002, bits_per_char: int = 10):
+        self.slaves      = {slave.address: slave for slave in slaves}
+        self.baudrate    = baudrate
+        self.ascii_mode  = ascii_mode
+        self.turnaround  = turnaround
+        self.char_time   = bits_per_char / baudrate
+        self.frame_errors = 0
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._master_fd)
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self) -> "VirtualSerialPort":
+        self._thread.start()
+        logger.info("Virtual Modbus %s port %s at %s baud", 'ASCII' if self.ascii_mode else 'RTU', self.port, self.baudrate)
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        for fd in (self._master_fd, self._slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self) -> None:
+        silence = max(3.5 * self.char_time, 0.00175)   # RTU inter-frame gap, fixed 1.75 ms above 19200 baud
+        buffer = b""
+        while not self._stop.is_set():
+            timeout = silence if buffer and not self.ascii_mode else 0.05
+            try:
+                ready, _, _ = select.select([self._master_fd], [], [], timeout)
+            except (OSError, ValueError):
+                return
+            if ready:
+                try:
+                    buffer += os.read(self._master_fd, 512)
+                except OSError:
+                    return
+                if self.ascii_mode:
+                    while b"\r\n" in buffer:
+                        frame, buffer = buffer.split(b"\r\n", 1)
+                        start = frame.rfind(b":")
+                        if start >= 0:
+                            self._respond(frame[start:] + b"\r\n")
+                continue
+            if buffer and not self.ascii_mode:
+                self._respond(buffer)
+                buffer = b""
+
+    def _respond(self, frame: bytes) -> None:
+        try:
+            if self.ascii_mode:
+                address, pdu = decode_ascii(frame)
+            else:
+                address, pdu = decode_rtu(frame)
+        except FrameError as e:
+            self.frame_errors += 1
+            logger.debug("Virtual port %s dropped frame: %s", self.port, e)
+            return
+        slave = self.slaves.get(address)
+        if slave is None or not pdu:
+            return
+        reply = slave.handle(pdu)
+        encoded = encode_ascii(address, reply) if self.ascii_mode else encode_rtu(address, reply)
+        # The request reached us instantly through the pty; charge its wire
+        # time now, then the device turnaround and the response's wire time
+        time.sleep(len(frame) * self.char_time + self.turnaround + len(encoded) * self.char_time)
+        try:
+            os.write(self._master_fd, encoded)
+        except OSError:
+            pass
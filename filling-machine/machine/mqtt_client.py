@@ -2,36 +2,159 @@
 
 import paho.mqtt.client as mqtt
 import logging
+import threading
+
+from machine.mqtt_spool import MessageSpool
+
+logger = logging.getLogger(__name__)
 
 class MqttClient:
     """
     Wraps Paho MQTT for simple, safe publishing.
+    Messages that cannot be handed to the broker (not connected, or the
+    publish fails) are kept in a bounded MessageSpool and drained in order,
+    at a limited rate, by a background thread once the connection is back.
+    A drained message stays in the spool until paho reports it published
+    (PUBACK/PUBCOMP for QoS >= 1, written to the socket for QoS 0), and is
+    sent again if the connection drops first, so spooled QoS >= 1 messages
+    are delivered at least once. QoS >= 1 messages always go through the
+    spool; QoS 0 messages published while connected go straight to paho.
+    Paho's network loop reconnects with exponential backoff.
     """
 
-    def __init__(self, broker: str, client_id: str = "Filling_Machine", keepalive: int = 60):
-        self._client = mqtt.Client(client_id)
+    def __init__(self, broker: str, client_id: str = "Filling_Machine", keepalive: int = 60,
+                 spool_path: str = ":memory:", max_spooled: int = 50000, drain_rate: float = 50.0,
+                 reconnect_min: float = 1.0, reconnect_max: float = 60.0):
+        """
+        Args:
+            broker (str): Broker host name or address.
+            spool_path (str): SQLite file for the offline spool (':memory:' for RAM only).
+            max_spooled (int): Spool capacity; the oldest messages are dropped beyond it.
+            drain_rate (float): Messages per second replayed after a reconnect (0 = unlimited).
+            reconnect_min, reconnect_max (float): Reconnect backoff bounds in seconds.
+        """
+        self._client     = mqtt.Client(client_id)
+        self.spool       = MessageSpool(spool_path, max_spooled)
+        self.drain_rate  = drain_rate
+        self._connected  = threading.Event()
+        self._sessions   = 0             # successful connections so far
+        self._stop       = threading.Event()
+        self._drain_wake = threading.Event()
+
+        self._client.on_connect    = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_publish    = self._on_publish
+        self._client.reconnect_delay_set(min_delay=reconnect_min, max_delay=reconnect_max)
         try:
-            # Connect and start the network loop in its own thread
+            # Connect and start the network loop in its own thread; publishing
+            # starts once the broker's CONNACK arrives (`_on_connect`)
             self._client.connect(broker, keepalive=keepalive)
-            self._client.loop_start()
         except Exception as e:
-            logging.exception(f"MQTT connect failed ({broker}): {e}")
+            logger.exception("MQTT connect failed (%s): %s", broker, e)
+            logger.warning("MQTT messages will be spooled until %s is reachable", broker)
+        # The loop thread retries a failed first connection with backoff too
+        self._client.loop_start()
+
+        self._drain_thread = threading.Thread(target=self._drain_loop, daemon=True)
+        self._drain_thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logger.info("MQTT connected; %s spooled messages to send", len(self.spool))
+            self._sessions += 1
+            self._connected.set()
+            self._drain_wake.set()
+        else:
+            logger.warning("MQTT connection refused: rc=%s", rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        if rc != 0:
+            logger.warning("MQTT connection lost (rc=%s); spooling messages", rc)
+
+    def _on_publish(self, client, userdata, mid):
+        # Let the drain loop drop acknowledged messages from the spool
+        self._drain_wake.set()
+
+    def _try_publish(self, topic: str, payload, qos: int, retain: bool):
+        """Hand a message to paho; returns its MQTTMessageInfo, or None if rejected."""
+        info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        return info if info.rc == mqtt.MQTT_ERR_SUCCESS else None
 
     def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
         """
         Publish a message to a topic, swallowing errors but logging them.
+        While disconnected, or while older messages are still spooled, the
+        message is spooled instead so ordering is preserved. QoS >= 1
+        messages are always spooled until the broker acknowledges them.
         """
+        if qos > 0 or not self._connected.is_set() or len(self.spool):
+            self.spool.put(topic, payload, qos, retain)
+            self._drain_wake.set()
+            return
         try:
-            self._client.publish(topic, payload, qos=qos, retain=retain)
+            if self._try_publish(topic, payload, qos, retain) is not None:
+                return
+            logger.warning("MQTT publish rejected (%s); spooling", topic)
         except Exception as e:
-            logging.exception(f"MQTT publish error ({topic}): {e}")
+            logger.exception("MQTT publish error (%s): %s", topic, e)
+        self.spool.put(topic, payload, qos, retain)
+        self._drain_wake.set()
+
+    def _drain_loop(self) -> None:
+        """
+        Replay spooled messages in order, at most `drain_rate` per second,
+        removing each from the spool once paho reports it published.
+        """
+        interval = 1.0 / self.drain_rate if self.drain_rate else 0.0
+        inflight = {}            # spool row id -> MQTTMessageInfo awaiting its acknowledgement
+        session  = self._sessions
+        while not self._stop.is_set():
+            published = [id_ for id_, info in inflight.items() if info.is_published()]
+            if published:
+                self.spool.remove(published)
+                for id_ in published:
+                    del inflight[id_]
+            if session != self._sessions:
+                # Reconnected: send what the old session left unacknowledged again
+                inflight.clear()
+                session = self._sessions
+            rows = [row for row in self.spool.peek(100 + len(inflight)) if row[0] not in inflight]
+            if not rows or not self._connected.is_set():
+                self._drain_wake.wait(timeout=1.0)
+                self._drain_wake.clear()
+                continue
+            for id_, topic, payload, qos, retain in rows:
+                if self._stop.is_set() or not self._connected.is_set():
+                    break
+                try:
+                    info = self._try_publish(topic, payload, qos, retain)
+                except Exception as e:
+                    logger.debug("MQTT drain publish failed (%s): %s", topic, e)
+                    info = None
+                if info is None:
+                    # Back off until the connection state changes
+                    self._stop.wait(1.0)
+                    break
+                inflight[id_] = info
+                if interval:
+                    self._stop.wait(interval)
 
     def disconnect(self):
         """
-        Stop the network loop and disconnect cleanly.
+        Stop the network loop and disconnect cleanly. Unsent and
+        unacknowledged messages stay in the spool file for the next run.
         """
+        self._stop.set()
+        self._drain_wake.set()
+        self._drain_thread.join(timeout=2.0)
         try:
             self._client.loop_stop()
             self._client.disconnect()
         except Exception as e:
-            logging.exception(f"MQTT disconnect error: {e}")
\ No newline at end of file
+            logger.exception("MQTT disconnect error: %s", e)
+        self.spool.close()
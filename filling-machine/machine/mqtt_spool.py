@@ -0,0 +1,80 @@
+# machine/mqtt_spool.py
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSpool:
+    """
+    Bounded FIFO of outgoing MQTT messages in SQLite (WAL mode), holding
+    whatever could not be handed to the broker until it can be drained.
+    When full, the oldest messages are dropped so the newest state wins.
+    Payloads are stored as-is (str, bytes, int, float or None).
+    """
+
+    def __init__(self, path: str = ":memory:", max_messages: int = 50000):
+        """
+        Args:
+            path (str): SQLite database file; ':memory:' keeps it in RAM.
+            max_messages (int): Capacity; older messages are dropped beyond it.
+        """
+        self.max_messages = max_messages
+        self.dropped      = 0
+        self._lock        = threading.Lock()
+        self._db          = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload, "
+            "qos INTEGER NOT NULL, retain INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self._count = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if self._count:
+            logger.info("MQTT spool %s holds %s messages from a previous run", path, self._count)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def put(self, topic: str, payload, qos: int = 0, retain: bool = False) -> None:
+        """Append a message, dropping the oldest if the spool is full."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (topic, payload, qos, retain, created) VALUES (?, ?, ?, ?, ?)",
+                (topic, payload, qos, int(retain), time.time()),
+            )
+            self._count += 1
+            excess = self._count - self.max_messages
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)", (excess,)
+                )
+                self._count -= excess
+                self.dropped += excess
+                if self.dropped == excess or self.dropped % 1000 < excess:
+                    logger.warning("MQTT spool full; %s oldest messages dropped so far", self.dropped)
+
+    def peek(self, limit: int = 100) -> list:
+        """Oldest messages as (id, topic, payload, qos, retain) tuples."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, topic, payload, qos, retain FROM messages ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(id_, topic, payload, qos, bool(retain)) for id_, topic, payload, qos, retain in rows]
+
+    def remove(self, ids) -> None:
+        """Delete messages once they have been handed to the broker."""
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            cursor = self._db.executemany("DELETE FROM messages WHERE id = ?", [(id_,) for id_ in ids])
+            self._count -= cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
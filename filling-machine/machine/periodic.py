@@ -0,0 +1,112 @@
+# machine/periodic.py
+
+import threading
+
+from machine.bus_stats import LatencyHistogram
+from machine.clock import RealClock
+
+
+class PeriodicSchedule:
+    """
+    Drift-free schedule of one periodic loop. Deadlines lie on a fixed grid
+    of whole periods on the monotonic nanosecond clock, so the loop's own
+    work does not stretch its period and wall-clock steps cannot move it.
+    A run that starts after the following deadline has also passed skips
+    the deadlines it missed rather than bursting to catch up, and counts
+    them as missed. How late each run starts after its deadline is kept as
+    the loop's jitter.
+    """
+
+    def __init__(self, name: str, period: float, clock: RealClock = None):
+        self.name       = name
+        self.period     = period
+        self._clock     = clock or RealClock()
+        self._period_ns = max(1, round(period * 1e9))
+        self._next_ns   = self._clock.monotonic_ns() + self._period_ns
+        self._lock      = threading.Lock()
+        self._jitter    = LatencyHistogram()
+        self.runs       = 0
+        self.missed     = 0
+
+    def remaining(self) -> float:
+        """Seconds until the next deadline; 0 once it has passed."""
+        return max(0, self._next_ns - self._clock.monotonic_ns()) / 1e9
+
+    def poll(self) -> bool:
+        """
+        If the next deadline has passed, count this run against it and
+        move to the next one.
+        Returns:
+            bool: True if a run was due.
+        """
+        late = self._clock.monotonic_ns() - self._next_ns
+        if late < 0:
+            return False
+        skipped = late // self._period_ns
+        with self._lock:
+            self.runs   += 1
+            self.missed += skipped
+            self._jitter.record(late / 1e9)
+        self._next_ns += (skipped + 1) * self._period_ns
+        return True
+
+    def wait(self, stop=None) -> bool:
+        """
+        Block until the next deadline and count the run.
+        Args:
+            stop: Event that ends the wait early, e.g. the controller's kill switch.
+        Returns:
+            bool: True when due, False if `stop` was set first.
+        """
+        while not self.poll():
+            if stop is None:
+                self._clock.sleep(self.remaining())
+            elif stop.wait(self.remaining()):
+                return False
+        return True
+
+    def stats(self) -> dict:
+        """{'period', 'runs', 'missed', 'jitter_mean', 'jitter_p99', 'jitter_max'} in seconds."""
+        with self._lock:
+            jitter = self._jitter.summary()
+            return {
+                "period":      self.period,
+                "runs":        self.runs,
+                "missed":      self.missed,
+                "jitter_mean": jitter["mean"],
+                "jitter_p99":  jitter["p99"],
+                "jitter_max":  jitter["max"],
+            }
+
+
+class PeriodicScheduler:
+    """
+    Hands out the PeriodicSchedules of a set of loops on one clock and
+    reports on all of them together.
+    """
+
+    def __init__(self, clock: RealClock = None):
+        self._clock     = clock or RealClock()
+        self._lock      = threading.Lock()
+        self._schedules = {}
+
+    def schedule(self, name: str, period: float) -> PeriodicSchedule:
+        """Start a new schedule for loop `name`, its first deadline one period from now."""
+        schedule = PeriodicSchedule(name, period, self._clock)
+        with self._lock:
+            self._schedules[name] = schedule
+        return schedule
+
+    def stats(self) -> dict:
+        """{loop name: PeriodicSchedule.stats()}"""
+        with self._lock:
+            schedules = dict(self._schedules)
+        return {name: schedule.stats() for name, schedule in sorted(schedules.items())}
+
+    def format(self) -> str:
+        """One line per loop, times in milliseconds."""
+        lines = []
+        for name, s in self.stats().items():
+            lines.append(f"{name:<8} period={s['period'] * 1000:.1f}ms runs={s['runs']} missed={s['missed']} "
+                         f"jitter p99={s['jitter_p99'] * 1000:.1f}ms max={s['jitter_max'] * 1000:.1f}ms")
+        return "\n".join(lines)
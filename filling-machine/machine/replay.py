@@ -0,0 +1,156 @@
+# machine/replay.py
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from config import Config
+from machine.clock import RealClock
+from machine.controller import MachineController
+from machine.simulation import NullMqtt
+from machine.trace import KIND_SAMPLE, KIND_STATE, read_trace
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock(RealClock):
+    """Monotonic clock that only moves when the replay moves it."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _replay_config(header: dict, directory: str, overrides: dict = None) -> Config:
+    """
+    Rebuild the recorded configuration, with `overrides`, in `directory`,
+    together with the compensation and flow split tables the trace started
+    from, so the replay learns into scratch copies and records nothing.
+    """
+    data = dict(header["config"])
+    data.update(overrides or {})
+    data["trace_dir"] = None
+    data["cycle_record_dir"] = "records"
+    tables = {data.get("compensation_file", "compensation.json"): header.get("compensation", {}),
+              data.get("flow_split_file", "flow_split.json"): header.get("flow_split", {})}
+    for name, table in tables.items():
+        with open(os.path.join(directory, os.path.basename(name)), "w", encoding="utf-8") as f:
+            json.dump(table, f)
+    data["compensation_file"] = os.path.basename(data.get("compensation_file", "compensation.json"))
+    data["flow_split_file"] = os.path.basename(data.get("flow_split_file", "flow_split.json"))
+    path = os.path.join(directory, "config.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return Config(path)
+
+
+def _same_cycle(recorded: list, replayed: list, tolerance: float) -> bool:
+    if [state for _, state in recorded] != [state for _, state in replayed]:
+        return False
+    return all(abs(a - b) <= tolerance for (a, _), (b, _) in zip(recorded, replayed))
+
+
+def replay_trace(path: str, overrides: dict = None, tolerance: float = 0.1) -> dict:
+    """
+    Feed a recorded trace through a fresh MachineController on a virtual
+    clock, as fast as it can tick, and compare the state transitions it
+    makes with the recorded ones.
+    The replay is open loop: the controller sees the recorded scale
+    samples whatever it commands, so a cycle is compared up to the
+    recorded return to waiting-for-mould, where the replay is re-synced to
+    the recorded baseline and tare. Replay starts at the first such point
+    unless the trace itself starts there.
+    Args:
+        path (str): Trace file written by TraceRecorder.
+        overrides (dict): Config values to change, e.g. to test a new setting.
+        tolerance (float): Largest transition time difference (s) still counted as the same.
+    Returns:
+        dict: {'cycles': int, 'matched': int, 'diverged': [{'cycle', 'recorded',
+               'replayed'}], 'samples': int}, transitions as (seconds into the cycle, state).
+    """
+    header, records = read_trace(path)
+    states = header["states"]
+    scratch = tempfile.mkdtemp(prefix="filler-replay-")
+    try:
+        clock = VirtualClock(records[0][0] if records else 0.0)
+        ctrl = MachineController(_replay_config(header, scratch, overrides), None, NullMqtt(), clock=clock)
+        ctrl.kill_all.set()                        # no threads in a replay; ends the watchdog
+        ctrl.select_flavour(header["flavour"])
+        ctrl.desired_volume = header["desired_volume"]
+        ctrl.mould_weight   = header["mould_weight"]
+        ctrl._initial_tare_done = True
+        waiting = ctrl.STATE_WAITING_FOR_MOULD
+
+        replayed, recorded = [], []
+        ctrl._fsm.add_listener(lambda old, new: replayed.append((clock.now, new)))
+        report = {"cycles": 0, "matched": 0, "diverged": [], "samples": 0}
+        cycle_start = None
+
+        def sync(t: float, baseline: float, tare: float) -> None:
+            ctrl._fsm.reset(waiting)
+            ctrl._settle         = None
+            ctrl._empty_since    = None
+            ctrl._baseline_empty = baseline
+            ctrl._tare_weight    = tare
+            replayed.clear()
+            recorded.clear()
+
+        last_tick = [clock.now]
+
+        def tick(t: float) -> None:
+            clock.now = t
+            ctrl._fsm.tick(t)
+            last_tick[0] = t
+
+        def advance(t: float) -> None:
+            # The real loop also ticks when a timer falls due or no sample
+            # arrived for `_read_interval`
+            while True:
+                due = last_tick[0] + ctrl._fsm.idle_time(ctrl._read_interval, last_tick[0])
+                if due >= t:
+                    break
+                tick(due)
+            clock.now = t
+
+        synced = header.get("state") == waiting
+        if synced:
+            sync(clock.now, header["baseline_empty"], header["tare_weight"])
+            cycle_start = clock.now
+
+        for t, kind, code, a, b in records:
+            if synced:
+                advance(t)
+            else:
+                clock.now = t
+            if kind == KIND_SAMPLE:
+                ctrl.scale_buffer.append(a, b, t)
+                ctrl.actual_weight = b
+                report["samples"] += 1
+                if synced:
+                    tick(t)
+            elif kind == KIND_STATE:
+                state = states[code]
+                if synced:
+                    recorded.append((t, state))
+                if state != waiting:
+                    continue
+                if synced:
+                    report["cycles"] += 1
+                    if _same_cycle(recorded, replayed, tolerance):
+                        report["matched"] += 1
+                    else:
+                        report["diverged"].append({
+                            "cycle":    report["cycles"],
+                            "recorded": [(round(t - cycle_start, 3), s) for t, s in recorded],
+                            "replayed": [(round(t - cycle_start, 3), s) for t, s in replayed],
+                        })
+                sync(t, a, b)
+                synced, cycle_start, last_tick[0] = True, t, t
+        ctrl.cycle_writer.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return report
@@ -0,0 +1,162 @@
+# machine/scale_buffer.py
+
+from array import array
+from collections import namedtuple
+
+from machine.clock import RealClock
+
+# One load-cell reading: monotonic timestamp (s), raw weight (kg), smoothed weight (kg)
+ScaleSample = namedtuple("ScaleSample", ["t", "raw", "kg"])
+
+
+class ScaleBuffer:
+    """
+    Fixed-size ring buffer of timestamped load-cell samples.
+    Storage is preallocated as three parallel double arrays, so appending a
+    sample never allocates. Every sample gets a sequence number, which lets
+    consumers wait for and average new samples without seeing any twice.
+    `clock` is the time base of the samples and of waits for new ones.
+    """
+
+    def __init__(self, capacity: int = 512, clock: RealClock = None):
+        if capacity < 1:
+            raise ValueError(f"ScaleBuffer capacity must be positive: {capacity}")
+        self._capacity = capacity
+        self._t   = array("d", bytes(8 * capacity))
+        self._raw = array("d", bytes(8 * capacity))
+        self._kg  = array("d", bytes(8 * capacity))
+        self._count = 0   # samples appended so far; sequence number of the next sample
+        self.clock = clock or RealClock()
+        self._cond = self.clock.condition()
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of samples retained."""
+        return self._capacity
+
+    @property
+    def sequence(self) -> int:
+        """Total number of samples appended so far."""
+        return self._count
+
+    def append(self, raw: float, kg: float, t: float = None) -> int:
+        """
+        Store a new sample and wake any waiting consumers.
+        Args:
+            raw (float): Unsmoothed weight in kg.
+            kg (float): Smoothed weight in kg.
+            t (float): Monotonic timestamp; defaults to now.
+        Returns:
+            int: Sequence number of the stored sample.
+        """
+        if t is None:
+            t = self.clock()
+        with self._cond:
+            i = self._count % self._capacity
+            self._t[i] = t
+            self._raw[i] = raw
+            self._kg[i] = kg
+            seq = self._count
+            self._count += 1
+            self._cond.notify_all()
+        return seq
+
+    def _sample(self, seq: int) -> ScaleSample:
+        i = seq % self._capacity
+        return ScaleSample(self._t[i], self._raw[i], self._kg[i])
+
+    def _oldest(self) -> int:
+        return max(0, self._count - self._capacity)
+
+    def latest(self) -> ScaleSample:
+        """Return the most recent sample, or None if nothing was recorded yet."""
+        with self._cond:
+            if self._count == 0:
+                return None
+            return self._sample(self._count - 1)
+
+    def since(self, seq: int) -> list:
+        """
+        Return all retained samples with sequence number >= `seq`, oldest first.
+        """
+        with self._cond:
+            start = max(seq, self._oldest())
+            return [self._sample(n) for n in range(start, self._count)]
+
+    def window(self, seconds: float, now: float = None) -> list:
+        """
+        Return the samples taken within the last `seconds`, oldest first.
+        """
+        if now is None:
+            now = self.clock()
+        return self.samples_after(now - seconds)
+
+    def samples_after(self, t: float) -> list:
+        """Return the retained samples with timestamp >= `t`, oldest first."""
+        with self._cond:
+            result = []
+            for n in range(self._count - 1, self._oldest() - 1, -1):
+                sample = self._sample(n)
+                if sample.t < t:
+                    break
+                result.append(sample)
+        result.reverse()
+        return result
+
+    def mean_since(self, t: float, raw: bool = False) -> float:
+        """
+        Average the samples taken at or after monotonic time `t`.
+        Args:
+            t (float): Monotonic start time.
+            raw (bool): Average raw instead of smoothed weights.
+        Returns:
+            float: Mean weight in kg, or None if no sample qualifies.
+        """
+        samples = self.samples_after(t)
+        if not samples:
+            return None
+        values = [s.raw if raw else s.kg for s in samples]
+        return sum(values) / len(values)
+
+    def wait_for_next_sample(self, after: int = None, timeout: float = None) -> ScaleSample:
+        """
+        Block until a sample newer than sequence number `after` exists.
+        Args:
+            after (int): Last sequence number already seen; defaults to the
+                newest sample, i.e. wait for the next read.
+            timeout (float): Maximum seconds to wait, or None to wait forever.
+        Returns:
+            ScaleSample: The first sample after `after`, or None on timeout.
+        """
+        if after is None:
+            after = self._count - 1
+        seq, sample = self._wait_after(after, timeout)
+        return sample
+
+    def _wait_after(self, after: int, timeout: float) -> tuple:
+        """Wait for a sample newer than `after`; return (sequence, sample) or (None, None)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._count > after + 1, timeout=timeout):
+                return None, None
+            seq = max(after + 1, self._oldest())
+            return seq, self._sample(seq)
+
+    def wait_for_samples(self, count: int, timeout: float = None) -> list:
+        """
+        Collect the next `count` samples, each exactly once.
+        Args:
+            count (int): Number of new samples to collect.
+            timeout (float): Maximum seconds to wait for each sample.
+        Returns:
+            list: The collected samples; shorter than `count` if the scale
+            stopped delivering samples within `timeout`.
+        """
+        samples = []
+        after = self._count - 1
+        while len(samples) < count:
+            seq, sample = self._wait_after(after, timeout)
+            if sample is None:
+                break
+            samples.append(sample)
+            after = seq
+        return samples
@@ -0,0 +1,282 @@
+# machine/simulation.py
+
+import random
+import threading
+import time
+
+
+class SimulatedPlant:
+    """
+    Physical model of the filler for off-machine testing.
+      - Pump: flow proportional to the VFD speed reference while the drive
+        runs and at least one valve is open, following the command with a
+        first-order lag (spin-up, and product still in the line after stop).
+      - Valves: gate the flow into the left/right mould; with both open the
+        flow is split by `split_left`.
+      - Load cell: sees tray + product through a first-order filter lag plus
+        Gaussian noise, reported in grams like the real indicator.
+      - Product: `flow_drift` changes the flow per Hz by that fraction per
+        minute, as the product thickens or thins during a batch.
+    """
+
+    def __init__(self,
+                 run_command: int = 2,
+                 flow_per_hz: float = 0.02,
+                 pump_tau: float = 0.15,
+                 filter_tau: float = 0.1,
+                 noise: float = 0.001,
+                 split_left: float = 0.5,
+                 flow_drift: float = 0.0,
+                 seed: int = None,
+                 clock=time.monotonic):
+        self.run_command = run_command
+        self.flow_per_hz = flow_per_hz      # kg/s per Hz
+        self.pump_tau    = pump_tau         # s
+        self.filter_tau  = filter_tau       # s
+        self.noise       = noise            # kg standard deviation
+        self.split_left  = split_left       # fraction of flow to left when both open
+        self.flow_drift  = flow_drift       # fractional change of flow per Hz per minute
+        self._clock      = clock
+        self._rng        = random.Random(seed)
+        self._lock       = threading.Lock()
+
+        # Actuator inputs (as written over Modbus)
+        self.vfd_state  = 0
+        self.vfd_speed  = 0                 # Hz × 100
+        self.coil_mask  = 0
+
+        # Physical state
+        self.flow        = 0.0              # current pump flow, kg/s
+        self.tray_weight = None             # None when no tray is on the scale
+        self.mould_mass  = {"left": 0.0, "right": 0.0}
+        self.spilled     = 0.0
+        self._filtered   = 0.0
+        self._last_time  = clock()
+        self._started    = self._last_time
+
+    def _target_flow(self) -> float:
+        if self.vfd_state != self.run_command or not self.coil_mask & 0x03:
+            return 0.0
+        drift = 1.0 + self.flow_drift * (self._last_time - self._started) / 60.0
+        return max(0.0, self.flow_per_hz * drift) * self.vfd_speed / 100.0
+
+    def _true_weight(self) -> float:
+        if self.tray_weight is None:
+            return 0.0
+        return self.tray_weight + self.mould_mass["left"] + self.mould_mass["right"]
+
+    def advance(self, now: float = None) -> None:
+        """Integrate the model up to `now` in small fixed steps."""
+        if now is None:
+            now = self._clock()
+        with self._lock:
+            remaining = now - self._last_time
+            while remaining > 0:
+                dt = min(remaining, 0.005)
+                target = self._target_flow()
+                self.flow += (target - self.flow) * min(1.0, dt / self.pump_tau)
+                mass = self.flow * dt
+                left  = bool(self.coil_mask & 0x01)
+                right = bool(self.coil_mask & 0x02)
+                if left and right:
+                    share = {"left": self.split_left, "right": 1.0 - self.split_left}
+                elif left:
+                    share = {"left": 1.0, "right": 0.0}
+                elif right:
+                    share = {"left": 0.0, "right": 1.0}
+                else:
+                    share = None
+                if share is None:
+                    pass                     # pump dead-headed against closed valves
+                elif self.tray_weight is None:
+                    self.spilled += mass
+                else:
+                    for side, fraction in share.items():
+                        self.mould_mass[side] += mass * fraction
+                self._filtered += (self._true_weight() - self._filtered) * min(1.0, dt / self.filter_tau)
+                remaining -= dt
+            self._last_time = now
+
+    def place_tray(self, tray_weight: float) -> None:
+        """Put an empty tray of moulds on the scale."""
+        self.advance()
+        with self._lock:
+            self.tray_weight = tray_weight
+            self.mould_mass = {"left": 0.0, "right": 0.0}
+
+    def remove_tray(self) -> dict:
+        """Take the tray off the scale and return the true product mass per mould."""
+        self.advance()
+        with self._lock:
+            poured = dict(self.mould_mass)
+            self.tray_weight = None
+            self.mould_mass = {"left": 0.0, "right": 0.0}
+        return poured
+
+    def read_grams(self) -> int:
+        """Current load-cell reading as the indicator's 32-bit unsigned register value."""
+        self.advance()
+        with self._lock:
+            kg = self._filtered + self._rng.gauss(0.0, self.noise) if self.noise else self._filtered
+        grams = int(round(kg * 1000.0))
+        return grams & 0xFFFFFFFF
+
+    def instruments(self, meter: "BusMeter" = None, baudrates: dict = None, latency: float = 0.005,
+                    sleep=time.sleep) -> dict:
+        """
+        Build simulated instruments for `ModbusInterface(config, instruments=...)`.
+        Args:
+            meter (BusMeter): Accumulates bus time; a new one if omitted.
+            baudrates (dict): Per-device baud rate override.
+            latency (float): Device turnaround time per transaction in seconds.
+            sleep (callable): Spends a transaction's time on the line.
+        """
+        meter = meter or BusMeter()
+        bauds = {"vfd": 19200, "scale": 9600, "valves": 9600}
+        bauds.update(baudrates or {})
+        return {
+            "vfd":    SimulatedInstrument(self, "vfd", meter, bauds["vfd"], latency, ascii_mode=True, sleep=sleep),
+            "scale":  SimulatedInstrument(self, "scale", meter, bauds["scale"], latency, sleep=sleep),
+            "valves": SimulatedInstrument(self, "valves", meter, bauds["valves"], latency, sleep=sleep),
+        }
+
+
+class BusMeter:
+    """
+    Accumulates simulated bus occupancy per device so utilisation can be reported.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock  = clock
+        self._lock   = threading.Lock()
+        self.started = clock()
+        self.busy    = {}
+        self.count   = {}
+
+    def record(self, device: str, seconds: float) -> None:
+        with self._lock:
+            self.busy[device]  = self.busy.get(device, 0.0) + seconds
+            self.count[device] = self.count.get(device, 0) + 1
+
+    def utilisation(self) -> dict:
+        """Fraction of elapsed time each device's port was busy."""
+        elapsed = max(self._clock() - self.started, 1e-9)
+        with self._lock:
+            return {device: busy / elapsed for device, busy in self.busy.items()}
+
+
+class SimulatedInstrument:
+    """
+    Stand-in for minimalmodbus.Instrument backed by a SimulatedPlant.
+    Implements the calls ModbusInterface makes and spends the time a real
+    transaction of that size would occupy the serial line.
+    """
+
+    # RTU request/response sizes in bytes, including address and CRC
+    _FRAMES = {
+        "read_long":       (8, 9),
+        "read_register":   (8, 7),
+        "read_registers":  (8, 5),     # + 2 bytes per register in the response
+        "write_register":  (8, 8),
+        "write_bit":       (8, 8),
+        "write_bits":      (10, 8),
+        "read_bits":       (8, 6),
+    }
+
+    def __init__(self, plant: SimulatedPlant, device: str, meter: BusMeter,
+                 baudrate: int, latency: float, ascii_mode: bool = False, sleep=time.sleep):
+        self.plant      = plant
+        self.device     = device
+        self.meter      = meter
+        self.latency    = latency
+        self.ascii_mode = ascii_mode
+        self._sleep     = sleep
+        self._registers = {}
+        self._lock      = threading.Lock()
+
+        class SerialStub:
+            pass
+        self.serial = SerialStub()
+        self.serial.baudrate = baudrate
+        self.serial.timeout  = 0.05
+
+    def _transaction(self, op: str, extra_response: int = 0) -> None:
+        request, response = self._FRAMES[op]
+        response += extra_response
+        if self.ascii_mode:
+            # ':' + two hex chars per byte (LRC replaces the 2-byte CRC) + CR LF
+            request  = 2 * (request - 1) + 3
+            response = 2 * (response - 1) + 3
+        seconds = (request + response) * 10.0 / self.serial.baudrate + self.latency
+        with self._lock:
+            self._sleep(seconds)
+            self.meter.record(self.device, seconds)
+
+    def read_long(self, registeraddress, functioncode=3, signed=False, byteorder=0, number_of_registers=2):
+        self._transaction("read_long")
+        if self.device == "scale" and registeraddress == 0x0000:
+            return self.plant.read_grams()
+        return self._registers.get(registeraddress, 0)
+
+    def read_register(self, registeraddress, number_of_decimals=0, functioncode=3, signed=False):
+        self._transaction("read_register")
+        return self._read(registeraddress)
+
+    def read_registers(self, registeraddress, number_of_registers, functioncode=3):
+        self._transaction("read_registers", extra_response=2 * number_of_registers)
+        return [self._read(registeraddress + n) for n in range(number_of_registers)]
+
+    def _read(self, address):
+        if self.device == "vfd":
+            self.plant.advance()
+            if address == 0x2000:
+                return self.plant.vfd_state
+            if address == 0x2001:
+                return self.plant.vfd_speed
+            if address == 0x2002:
+                return 1 if self.plant.vfd_state == self.plant.run_command else 0
+        return self._registers.get(address, 0)
+
+    def write_register(self, registeraddress, value, number_of_decimals=0, functioncode=16, signed=False):
+        self._transaction("write_register")
+        self._registers[registeraddress] = value
+        if self.device == "vfd":
+            self.plant.advance()
+            if registeraddress == 0x2000:
+                self.plant.vfd_state = value
+            elif registeraddress == 0x2001:
+                self.plant.vfd_speed = value
+
+    def write_bit(self, registeraddress, value, functioncode=5):
+        self._transaction("write_bit")
+        self.plant.advance()
+        if value:
+            self.plant.coil_mask |= 1 << registeraddress
+        else:
+            self.plant.coil_mask &= ~(1 << registeraddress)
+
+    def write_bits(self, registeraddress, values):
+        self._transaction("write_bits")
+        self.plant.advance()
+        mask = self.plant.coil_mask
+        for offset, value in enumerate(values):
+            bit = 1 << (registeraddress + offset)
+            mask = mask | bit if value else mask & ~bit
+        self.plant.coil_mask = mask
+
+    def read_bits(self, registeraddress, number_of_bits, functioncode=2):
+        self._transaction("read_bits")
+        return [(self.plant.coil_mask >> (registeraddress + n)) & 1 for n in range(number_of_bits)]
+
+
+class NullMqtt:
+    """MQTT stand-in that keeps the last payload per topic instead of publishing."""
+
+    def __init__(self):
+        self.last = {}
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        self.last[topic] = payload
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,109 @@
+# machine/speed_profile.py
+
+import math
+
+
+class SpeedProfile:
+    """
+    Pump speed as a function of the mass still to pour into the mould.
+    `points` are (remaining kg, Hz) breakpoints. Stepped, a point's speed
+    applies once the remaining mass has fallen to its breakpoint; with
+    `interpolate` the speed ramps linearly between breakpoints instead.
+    Above the largest breakpoint the first point's speed applies. With
+    `relative`, breakpoints are fractions of the target volume.
+    """
+
+    def __init__(self, points, interpolate: bool = False, relative: bool = False,
+                 ramp_up: float = None, ramp_down: float = None, name: str = None):
+        points = sorted(((float(bp), float(hz)) for bp, hz in points), reverse=True)
+        if not points:
+            raise ValueError("SpeedProfile needs at least one (remaining, Hz) point")
+        self.points      = points
+        self.interpolate = interpolate
+        self.relative    = relative
+        self.ramp_up     = ramp_up        # Hz/s, None for unlimited
+        self.ramp_down   = ramp_down      # Hz/s, None for unlimited
+        self.name        = name or self._default_name()
+
+    def _default_name(self) -> str:
+        kind = "ramp" if self.interpolate else "steps"
+        return f"{kind}:" + ",".join(f"{bp:g}@{hz:g}" for bp, hz in self.points)
+
+    @classmethod
+    def from_config(cls, spec: dict, name: str = None) -> "SpeedProfile":
+        """
+        Build a profile from its config.json form, e.g.
+        {"points": [[0.3, 15], [0.1, 5], [0.03, 2]], "interpolate": true,
+         "relative": false, "ramp_up": 30, "ramp_down": 60}
+        """
+        return cls(spec["points"],
+                   interpolate=spec.get("interpolate", False),
+                   relative=spec.get("relative", False),
+                   ramp_up=spec.get("ramp_up"),
+                   ramp_down=spec.get("ramp_down"),
+                   name=spec.get("name", name))
+
+    @property
+    def top_speed(self) -> float:
+        """Highest speed anywhere in the profile (Hz)."""
+        return max(hz for _, hz in self.points)
+
+    def speed(self, remaining: float, target: float = 1.0) -> float:
+        """
+        Speed (Hz) for `remaining` kg still to pour; `target` scales
+        relative breakpoints.
+        """
+        scale = target if self.relative else 1.0
+        points = [(bp * scale, hz) for bp, hz in self.points]
+        if remaining >= points[0][0]:
+            return points[0][1]
+        for (bp_hi, hz_hi), (bp_lo, hz_lo) in zip(points, points[1:]):
+            if remaining >= bp_lo:
+                if not self.interpolate or math.isinf(bp_hi) or bp_hi == bp_lo:
+                    return hz_hi if remaining > bp_lo else hz_lo
+                return hz_lo + (hz_hi - hz_lo) * (remaining - bp_lo) / (bp_hi - bp_lo)
+        return points[-1][1]
+
+
+def legacy_profile(fast: float, slow: float, fill_tol: float, adaptive: bool, target: float) -> SpeedProfile:
+    """
+    The original fast/slow pair as a profile for a `target` kg fill: fast
+    until within `fill_tol` of the target, then slow, stepping down to 75%
+    and 50% of slow at 0.10 and 0.05 kg remaining when adaptive. Named as
+    the compensation table has always keyed it.
+    """
+    points = [(float("inf"), fast), (target * fill_tol, slow)]
+    name = f"{fast:g}-{slow:g}Hz"
+    if adaptive:
+        points += [(0.10, slow * 0.75), (0.05, slow * 0.50)]
+        name += "-adaptive"
+    return SpeedProfile(points, name=name)
+
+
+class RampLimiter:
+    """
+    Limits how fast the speed reference sent to the VFD may change.
+    Stops bypass the limiter: the pump must stop at the cut-off at once.
+    """
+
+    def __init__(self):
+        self._hz   = None
+        self._time = None
+
+    def reset(self, hz: float = None) -> None:
+        """Forget the ramp; `hz` is the speed the next ramp starts from (None: no limit)."""
+        self._hz, self._time = hz, None
+
+    def limit(self, hz: float, now: float, ramp_up: float = None, ramp_down: float = None) -> float:
+        """
+        Move from the last returned speed towards `hz` by at most the
+        allowed rate (Hz/s) since the previous call.
+        """
+        if self._hz is not None:
+            dt = 0.0 if self._time is None else max(0.0, now - self._time)
+            if ramp_up is not None and hz > self._hz:
+                hz = min(hz, self._hz + ramp_up * dt)
+            elif ramp_down is not None and hz < self._hz:
+                hz = max(hz, self._hz - ramp_down * dt)
+        self._hz, self._time = hz, now
+        return hz
@@ -0,0 +1,99 @@
+# machine/stability.py
+
+import math
+
+from machine.flow import least_squares_slope
+from machine.scale_buffer import ScaleBuffer
+
+
+class StabilityDetector:
+    """
+    Decides when the scale has settled.
+    The scale counts as stable once the last `samples` readings have a
+    standard deviation of at most `max_std` kg and a least-squares slope of
+    at most `max_slope` kg/s in magnitude.
+    """
+
+    def __init__(self, samples: int = 8, max_std: float = 0.003, max_slope: float = 0.01):
+        if samples < 2:
+            raise ValueError(f"StabilityDetector needs at least 2 samples: {samples}")
+        self.samples   = samples
+        self.max_std   = max_std
+        self.max_slope = max_slope
+
+    def check(self, samples: list) -> bool:
+        """
+        Return True if the newest `self.samples` of `samples` are stable.
+        """
+        if len(samples) < self.samples:
+            return False
+        window = samples[-self.samples:]
+        mean = sum(s.kg for s in window) / len(window)
+        std = math.sqrt(sum((s.kg - mean) ** 2 for s in window) / len(window))
+        if std > self.max_std:
+            return False
+        slope = least_squares_slope(window)
+        return slope is not None and abs(slope) <= self.max_slope
+
+    @staticmethod
+    def mean(samples: list) -> float:
+        """Mean smoothed weight of `samples`, or None if empty."""
+        if not samples:
+            return None
+        return sum(s.kg for s in samples) / len(samples)
+
+    def wait_until_stable(self, buffer: ScaleBuffer, max_wait: float) -> tuple:
+        """
+        Block until the samples arriving after this call are stable, or
+        `max_wait` seconds pass.
+        Args:
+            buffer (ScaleBuffer): Source of scale samples.
+            max_wait (float): Upper bound on the wait in seconds.
+        Returns:
+            tuple: (stable, mean weight in kg of the last window). The mean
+            is None if no sample arrived at all.
+        """
+        watch = self.watch(buffer, max_wait)
+        while True:
+            seen = buffer.sequence
+            result = watch.poll()
+            if result is not None:
+                return result
+            buffer.wait_for_next_sample(after=seen - 1, timeout=max(0.0, watch.deadline - buffer.clock()))
+
+    def watch(self, buffer: ScaleBuffer, max_wait: float, now: float = None) -> "SettleWatch":
+        """Start a non-blocking wait for the samples arriving after this call to settle."""
+        return SettleWatch(self, buffer, max_wait, now)
+
+
+class SettleWatch:
+    """
+    Non-blocking form of `StabilityDetector.wait_until_stable` for callers
+    that must not block, such as state machine tick handlers: call `poll()`
+    on every tick until it returns a result.
+    """
+
+    def __init__(self, detector: StabilityDetector, buffer: ScaleBuffer, max_wait: float,
+                 now: float = None):
+        self.detector = detector
+        self.buffer   = buffer
+        self.start    = buffer.sequence
+        self.deadline = (buffer.clock() if now is None else now) + max_wait
+        self.result   = None
+
+    def poll(self, now: float = None) -> tuple:
+        """
+        Check the samples that arrived since the watch started.
+        Returns:
+            tuple: (stable, mean weight in kg of the last window) once the
+            scale settled or `max_wait` passed, otherwise None. The mean is
+            None if no sample arrived at all.
+        """
+        if self.result is None:
+            samples = self.buffer.since(self.start)
+            window = samples[-self.detector.samples:]
+            if self.detector.check(samples):
+                self.result = (True, self.detector.mean(window))
+            elif (self.buffer.clock() if now is None else now) >= self.deadline:
+                self.result = (False, self.detector.mean(window))
+        return self.result
@@ -0,0 +1,134 @@
+# machine/state_machine.py
+
+import heapq
+import itertools
+import logging
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# One state change: monotonic time (s), wall-clock time (s), previous and new state
+Transition = namedtuple("Transition", ["t", "wall", "old", "new"])
+
+
+class State:
+    """
+    One row of a StateMachine's transition table.
+    `on_enter(now)` runs when the state is entered, `on_tick(now)` on every
+    tick while it is current and `on_exit(now)` when it is left. `on_enter`
+    and `on_tick` return the name of the next state, or None to stay.
+    """
+
+    def __init__(self, name: str, on_enter=None, on_tick=None, on_exit=None):
+        self.name     = name
+        self.on_enter = on_enter
+        self.on_tick  = on_tick
+        self.on_exit  = on_exit
+
+
+class StateMachine:
+    """
+    Table-driven state machine advanced by a single loop calling `tick()`.
+    Handlers must not block: a delay inside a state is a timer set with
+    `after()`, which fires on the first tick at or past its due time and is
+    cancelled when the state is left. Every transition is timestamped and
+    kept in `history`.
+    """
+
+    def __init__(self, states, initial: str, clock=time.monotonic, wall_clock=time.time,
+                 history: int = 256):
+        self._states = {state.name: state for state in states}
+        if initial not in self._states:
+            raise ValueError(f"Unknown initial state: {initial}")
+        self._clock      = clock
+        self._wall_clock = wall_clock
+        self._state      = initial
+        self._entered    = clock()
+        self._timers     = []                   # heap of (due, seq, callback)
+        self._seq        = itertools.count()
+        self._listeners  = []
+        self.history     = deque(maxlen=history)
+
+    @property
+    def states(self) -> list:
+        """Names of all states, in table order."""
+        return list(self._states)
+
+    @property
+    def state(self) -> str:
+        """Name of the current state."""
+        return self._state
+
+    def time_in_state(self, now: float = None) -> float:
+        """Seconds since the current state was entered."""
+        return (self._clock() if now is None else now) - self._entered
+
+    def add_listener(self, callback) -> None:
+        """Call `callback(old, new)` after every transition."""
+        self._listeners.append(callback)
+
+    def after(self, delay: float, callback, now: float = None) -> None:
+        """
+        Call `callback(now)` on the first tick `delay` seconds from now,
+        unless the state is left first. Like a tick handler, the callback
+        may return the name of the next state.
+        """
+        due = (self._clock() if now is None else now) + delay
+        heapq.heappush(self._timers, (due, next(self._seq), callback))
+
+    def pending(self) -> bool:
+        """True while a timer of the current state has yet to fire."""
+        return bool(self._timers)
+
+    def idle_time(self, limit: float, now: float = None) -> float:
+        """Seconds until the next timer is due, at most `limit`."""
+        if not self._timers:
+            return limit
+        now = self._clock() if now is None else now
+        return max(0.0, min(limit, self._timers[0][0] - now))
+
+    def reset(self, name: str) -> None:
+        """Force the current state without running handlers or recording it."""
+        if name not in self._states:
+            raise ValueError(f"Unknown state: {name}")
+        self._timers.clear()
+        self._state   = name
+        self._entered = self._clock()
+
+    def tick(self, now: float = None) -> None:
+        """Fire due timers, then run the current state's tick handler."""
+        now = self._clock() if now is None else now
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback = heapq.heappop(self._timers)
+            target = callback(now)
+            if target is not None:
+                self.transition(target, now)
+                return
+        handler = self._states[self._state].on_tick
+        if handler is not None:
+            target = handler(now)
+            if target is not None:
+                self.transition(target, now)
+
+    def transition(self, name: str, now: float = None) -> None:
+        """
+        Leave the current state and enter `name`, following any further
+        transition requested by its enter handler.
+        """
+        now = self._clock() if now is None else now
+        while name is not None:
+            if name not in self._states:
+                raise ValueError(f"Unknown state: {name}")
+            old = self._state
+            if self._states[old].on_exit is not None:
+                self._states[old].on_exit(now)
+            self._timers.clear()
+            self._state   = name
+            self._entered = now
+            self.history.append(Transition(now, self._wall_clock(), old, name))
+            logger.debug("State %s -> %s", old, name)
+            for callback in self._listeners:
+                callback(old, name)
+            handler = self._states[name].on_enter
+            name = handler(now) if handler is not None else None
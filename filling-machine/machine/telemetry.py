@@ -0,0 +1,120 @@
+# machine/telemetry.py
+
+import json
+import logging
+import struct
+import time
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+# Field order and struct codes for the "struct" encoding; the packed record
+# is prefixed with the sample time as a little-endian double
+STRUCT_LAYOUT = (
+    ("ActualWeight", "f"),
+    ("VFDState",     "B"),
+    ("VFDSpeed",     "f"),
+    ("Valve1State",  "B"),
+    ("Valve2State",  "B"),
+    ("FillStatus",   "H"),
+)
+STRUCT_FORMAT = "<d" + "".join(code for _, code in STRUCT_LAYOUT)
+
+
+def decode_struct(payload: bytes) -> dict:
+    """Unpack a "struct"-encoded telemetry record into a field dict."""
+    values = struct.unpack(STRUCT_FORMAT, payload)
+    fields = {"t": values[0]}
+    fields.update((name, value) for (name, _), value in zip(STRUCT_LAYOUT, values[1:]))
+    return fields
+
+
+class TelemetryPublisher:
+    """
+    Publishes controller state over MQTT without flooding the broker.
+    Each call to `publish()` is one sampling tick:
+      - per-field topics (`<prefix>/<field>`) are sent only when the value
+        changed by more than its deadband since it was last sent;
+      - one combined message (`<prefix>/Telemetry`) is sent per `interval`;
+      - every `snapshot_interval` all field topics and the combined message
+        are re-sent with retain=True so new subscribers see the full state.
+    """
+
+    def __init__(self, mqtt, prefix: str = "FillingMachine", interval: float = 1.0,
+                 snapshot_interval: float = 30.0, deadbands: dict = None,
+                 encoding: str = "json", clock=time.monotonic, wall_clock=time.time):
+        """
+        Args:
+            mqtt: Client with `publish(topic, payload, qos=0, retain=False)`.
+            prefix (str): Topic prefix.
+            interval (float): Seconds between combined messages.
+            snapshot_interval (float): Seconds between retained snapshots.
+            deadbands (dict): Field name -> minimum change worth publishing.
+            encoding (str): Combined payload format: 'json', 'cbor' or 'struct'.
+            clock: Monotonic time source.
+            wall_clock: Wall-clock time source for message timestamps.
+        """
+        if encoding == "cbor" and cbor2 is None:
+            logger.warning("cbor2 not installed; telemetry falls back to JSON")
+            encoding = "json"
+        if encoding not in ("json", "cbor", "struct"):
+            raise ValueError(f"Unknown telemetry encoding: {encoding}")
+        self.mqtt              = mqtt
+        self.prefix            = prefix
+        self.interval          = interval
+        self.snapshot_interval = snapshot_interval
+        self.deadbands         = dict(deadbands or {})
+        self.encoding          = encoding
+        self._clock            = clock
+        self._wall_clock       = wall_clock
+        self._sent             = {}       # field -> last value sent on its topic
+        self._last_batch       = None
+        self._last_snapshot    = None
+        self.messages          = 0
+
+    def encode(self, fields: dict, timestamp: float) -> bytes:
+        """Encode the combined message in the configured format."""
+        if self.encoding == "struct":
+            return struct.pack(STRUCT_FORMAT, timestamp, *(fields[name] for name, _ in STRUCT_LAYOUT))
+        record = dict(fields, t=round(timestamp, 3))
+        if self.encoding == "cbor":
+            return cbor2.dumps(record)
+        return json.dumps(record, separators=(",", ":"))
+
+    def _changed(self, name: str, value) -> bool:
+        if name not in self._sent:
+            return True
+        last = self._sent[name]
+        deadband = self.deadbands.get(name, 0.0)
+        if isinstance(value, (int, float)) and isinstance(last, (int, float)):
+            return abs(value - last) > deadband
+        return value != last
+
+    def _send(self, topic: str, payload, retain: bool = False) -> None:
+        self.mqtt.publish(f"{self.prefix}/{topic}", payload, retain=retain)
+        self.messages += 1
+
+    def publish(self, fields: dict, now: float = None) -> None:
+        """
+        Sample one tick of telemetry.
+        Args:
+            fields (dict): Field name -> current value.
+            now (float): Monotonic time of the sample; defaults to the clock.
+        """
+        now = self._clock() if now is None else now
+        snapshot = self._last_snapshot is None or now - self._last_snapshot >= self.snapshot_interval
+
+        for name, value in fields.items():
+            if snapshot or self._changed(name, value):
+                self._send(name, value, retain=snapshot)
+                self._sent[name] = value
+
+        if snapshot or self._last_batch is None or now - self._last_batch >= self.interval:
+            self._send("Telemetry", self.encode(fields, self._wall_clock()), retain=snapshot)
+            self._last_batch = now
+        if snapshot:
+            self._last_snapshot = now
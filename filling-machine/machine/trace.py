@@ -0,0 +1,133 @@
+# machine/trace.py
+
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAGIC   = b"FMTRACE1"
+HEADER  = struct.Struct("<8sI")          # magic, JSON metadata length
+# Fixed 32-byte record: monotonic time (ns), kind, code, padding, two values
+RECORD  = struct.Struct("<qBB6xdd")
+
+KIND_SAMPLE   = 1     # a = raw kg, b = smoothed kg
+KIND_SETPOINT = 2     # code = index into SETPOINTS, a = value
+KIND_STATE    = 3     # code = index into the state table, a = empty baseline, b = tare
+
+# Actuator setpoints, by controller attribute, in code order
+SETPOINTS = ("vfd_state", "vfd_speed", "valve1", "valve2")
+
+
+class TraceRecorder:
+    """
+    Appends scale samples, actuator setpoint changes and fill state
+    transitions to a compact binary trace. A file starts with a JSON header
+    (machine state needed to replay it) padded to the record size, followed
+    by fixed-size records, so a trace can be memory-mapped and read with
+    `struct.iter_unpack`. A new file is started with `start()`; the oldest
+    files beyond `keep` are deleted.
+    """
+
+    def __init__(self, directory: str, states, keep: int = 50, flush_interval: float = 1.0):
+        self.directory      = directory
+        self.states         = list(states)
+        self.keep           = keep
+        self.flush_interval = flush_interval
+        self.path           = None
+        self.records        = 0
+        self._state_codes   = {name: i for i, name in enumerate(self.states)}
+        self._lock          = threading.Lock()
+        self._file          = None
+        self._last_flush    = 0.0
+
+    def start(self, meta: dict) -> str:
+        """
+        Close the current trace and begin a new one.
+        Args:
+            meta (dict): JSON-serialisable state the trace starts from.
+        Returns:
+            str: Path of the new trace file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        path = os.path.join(self.directory, f"trace_{stamp}.ftr")
+        header = dict(meta, states=self.states, setpoints=list(SETPOINTS), record_size=RECORD.size)
+        body = json.dumps(header).encode("utf-8")
+        size = HEADER.size + len(body)
+        body += b" " * (-size % RECORD.size)             # records start record-aligned
+        with self._lock:
+            self._close_file()
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, len(body)) + body)
+            self.path, self.records = path, 0
+        self._prune()
+        logger.info("Recording trace to %s", path)
+        return path
+
+    def _prune(self) -> None:
+        if not self.keep:
+            return
+        old = sorted(glob.glob(os.path.join(self.directory, "trace_*.ftr")))[:-self.keep]
+        for path in old:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not remove old trace %s: %s", path, e)
+
+    def _write(self, t: float, kind: int, code: int, a: float, b: float) -> None:
+        record = RECORD.pack(int(t * 1e9), kind, code, a, b)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(record)
+            self.records += 1
+            if t - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = t
+
+    def sample(self, t: float, raw: float, kg: float) -> None:
+        self._write(t, KIND_SAMPLE, 0, raw, kg)
+
+    def setpoint(self, t: float, name: str, value) -> None:
+        self._write(t, KIND_SETPOINT, SETPOINTS.index(name), float(value), 0.0)
+
+    def transition(self, t: float, state: str, baseline: float, tare: float) -> None:
+        self._write(t, KIND_STATE, self._state_codes[state], baseline, tare)
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        """Flush and close the current trace."""
+        with self._lock:
+            self._close_file()
+
+
+def read_trace(path: str):
+    """
+    Read a trace written by TraceRecorder.
+    Returns:
+        tuple: (header dict, list of (t seconds, kind, code, a, b) records).
+        A record cut short by a crash at the end of the file is ignored.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path!r} is not a filling machine trace")
+        header = json.loads(bytes(data[HEADER.size:HEADER.size + length]))
+        start = HEADER.size + length
+        end = start + (len(data) - start) // RECORD.size * RECORD.size
+        view = memoryview(data)[start:end]
+        try:
+            records = [(t / 1e9, kind, code, a, b) for t, kind, code, a, b in RECORD.iter_unpack(view)]
+        finally:
+            view.release()
+    return header, records
@@ -1,5 +1,8 @@
 from config import Config
+from logging_setup import SuppressedCountFormatter, setup_logging
 from machine.modbus_interface import ModbusInterface
+from machine.async_bus        import AsyncModbusInterface
+from machine.async_runtime    import AsyncRuntime, ControllerProxy, MqttBridge
 from machine.mqtt_client      import MqttClient
 from machine.controller       import MachineController
 from ui.ui_manager            import UIManager
@@ -16,51 +19,68 @@ os.makedirs("logs", exist_ok=True)
 log_filename = datetime.now().strftime("logs/filling_machine_%Y%m%d_%H%M%S.log")
 
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
 # File handler with date/time-based log filename
 file_handler = logging.FileHandler(log_filename)
 file_handler.setLevel(logging.DEBUG)
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_formatter = SuppressedCountFormatter('%(asctime)s - %(levelname)s - %(message)s')
 file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
 # Syslog handler (UDP to remote syslog server)
 syslog_handler = logging.handlers.SysLogHandler(address=('192.168.15.6', 1514), socktype=socket.SOCK_DGRAM)
-syslog_formatter = logging.Formatter('%(name)s: %(levelname)s %(message)s')
+syslog_formatter = SuppressedCountFormatter('%(name)s: %(levelname)s %(message)s')
 syslog_handler.setFormatter(syslog_formatter)
 syslog_handler.setLevel(logging.DEBUG)
-logger.addHandler(syslog_handler)
 
 def main():
+    # 1. Load configuration, then hand all log output to a background
+    #    listener so file/syslog I/O never blocks the control threads
+    cfg = Config()
+    log_listener = setup_logging(cfg, [file_handler, syslog_handler])
+
     # Kill any process holding the serial ports ttyCH9344USB0 through ttyCH9344USB7
     for i in range(8):
         dev = f"/dev/ttyCH9344USB{i}"
         try:
             subprocess.run(["fuser", "-k", dev], check=True)
-            logger.info(f"Killed processes using {dev}")
+            logger.info("Killed processes using %s", dev)
         except Exception as e:
-            logger.warning(f"Failed to kill processes using {dev}: {e}")
-    # 1. Load configuration
-    cfg = Config()
-
-    # 2. Initialize hardware interfaces
-    modbus = ModbusInterface(cfg)
+            logger.warning("Failed to kill processes using %s: %s", dev, e)
+    # 2. Initialize hardware interfaces; the "asyncio" runtime runs the
+    #    bus and every control loop on one event loop instead of threads
+    use_asyncio = cfg.get("runtime", "threads") == "asyncio"
+    modbus = AsyncModbusInterface(cfg) if use_asyncio else ModbusInterface(cfg)
     time.sleep(1)
-    mqtt   = MqttClient(cfg.get("mqttBroker"))
+    mqtt   = MqttClient(
+        cfg.get("mqttBroker"),
+        spool_path=cfg.sibling_path(cfg.get("mqtt_spool_file", "mqtt_spool.db")),
+        max_spooled=cfg.get("mqtt_spool_max", 50000),
+        drain_rate=cfg.get("mqtt_drain_rate", 50.0),
+        reconnect_max=cfg.get("mqtt_reconnect_max", 60.0),
+    )
 
-    # 3. Create controller and UI
-    controller = MachineController(cfg, modbus, mqtt)
-    ui = UIManager(controller)
+    # 3. Create controller and UI; with the asyncio runtime the UI talks
+    #    to the controller through the runtime's command queue
+    if use_asyncio:
+        controller = MachineController(cfg, modbus, MqttBridge(mqtt))
+        runtime = AsyncRuntime(controller, modbus)
+        ui = UIManager(ControllerProxy(runtime))
+    else:
+        controller = MachineController(cfg, modbus, mqtt)
+        runtime = controller
+        ui = UIManager(controller)
 
     # 4. Start the machine threads and UI loop
     try:
-        controller.start()
+        runtime.start()
         ui.run()
     finally:
         # Ensure we always cleanly shut down the hardware threads
-        controller.stop()
+        runtime.stop()
+        if not use_asyncio:
+            modbus.close()
         logger.info("Application exited cleanly")
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
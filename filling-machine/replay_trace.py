@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Replay recorded traces (see `trace_dir` in config.json) through the fill
+state machine on a virtual clock and report, cycle by cycle, whether it
+makes the same transitions at the same times. Use --set to check how a
+config change would have behaved on real data.
+Usage:
+    python replay_trace.py traces/trace_20260301_080000_000000.ftr
+    python replay_trace.py traces/*.ftr --set predictive_cutoff=false --tolerance 0.05
+"""
+import argparse
+import json
+import logging
+
+from machine.replay import replay_trace
+
+
+def parse_override(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="+", help="trace files to replay")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a recorded config value (JSON-parsed)")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="largest transition time difference (s) counted as a match")
+    parser.add_argument("--verbose", action="store_true", help="print diverging cycles in full")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    overrides = dict(parse_override(override) for override in args.set)
+    for path in args.traces:
+        report = replay_trace(path, overrides, tolerance=args.tolerance)
+        print(f"{path}: {report['matched']}/{report['cycles']} cycles matched, {report['samples']} samples")
+        if args.verbose:
+            for cycle in report["diverged"]:
+                print(f"  cycle {cycle['cycle']}")
+                print(f"    recorded: {cycle['recorded']}")
+                print(f"    replayed: {cycle['replayed']}")
+
+
+if __name__ == "__main__":
+    main()
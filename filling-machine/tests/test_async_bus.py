@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from machine.async_bus import AsyncModbusInterface, SerialLine
+from machine.bus_scheduler import PRIORITY_COMMAND, PRIORITY_CRITICAL, PRIORITY_REFRESH
+from machine.modbus_slave import LoadCellSlave, RelayBoardSlave, VfdSlave, VirtualSerialPort
+
+READ_WEIGHT = bytes.fromhex("0300000002")
+
+def test_devices_over_rtu_and_ascii_ptys():
+    load_cell = LoadCellSlave(address=1)
+    load_cell.weight = -1.25
+    relays = RelayBoardSlave(address=1)
+    vfd = VfdSlave(address=2)
+    with VirtualSerialPort([load_cell], baudrate=9600) as scale_port, \
+         VirtualSerialPort([relays], baudrate=9600) as valve_port, \
+         VirtualSerialPort([vfd], baudrate=19200, ascii_mode=True) as vfd_port:
+        cfg = {
+            "vfd_port": vfd_port.port, "scale_port": scale_port.port, "valve_port": valve_port.port,
+            "vfd_timeout": 0.2, "scale_timeout": 0.2, "valve_timeout": 0.2,
+        }
+        bus = AsyncModbusInterface(cfg)
+        async def run():
+            bus.open()
+            try:
+                sample = await bus.read_load_cell_sample()
+                written = await bus.set_vfd_speed(1500), await bus.set_vfd_speed(1500)
+                block = await bus.read_vfd_block()
+                await bus.set_valves(bus.VALVE_LEFT | bus.VALVE_RIGHT)
+                return sample, written, block
+            finally:
+                bus.close()
+        sample, written, block = asyncio.run(run())
+    assert sample == (-1.25, -1.25)
+    assert written == (True, False)             # the second write is in the command shadow
+    assert block[1] == 1500
+    assert relays.mask == 0x03
+    assert bus.stats.snapshot()["scale/read"]["ok"] == 1
+
+def test_cancelled_transaction_does_not_leak_into_the_next():
+    load_cell = LoadCellSlave(address=1)
+    load_cell.weight = 1.0
+    with VirtualSerialPort([load_cell], baudrate=9600, turnaround=0.2) as port:
+        line = SerialLine(port.port, 9600, timeout=0.3)
+        async def run():
+            line.open()
+            try:
+                task = asyncio.create_task(line.exchange(1, READ_WEIGHT))
+                await asyncio.sleep(0.05)
+                started = time.monotonic()
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                cancel_time = time.monotonic() - started
+                load_cell.weight = 2.0
+                return cancel_time, await line.exchange(1, READ_WEIGHT)
+            finally:
+                line.close()
+        cancel_time, reply = asyncio.run(run())
+    assert cancel_time < 0.05
+    assert reply == bytes.fromhex("0304000007d0")    # 2000 g, not the abandoned 1000 g reply
+
+def test_waiting_transactions_go_in_priority_order():
+    with VirtualSerialPort([LoadCellSlave(address=1)], baudrate=9600) as port:
+        line = SerialLine(port.port, 9600, timeout=0.2)
+        order = []
+        async def request(name, priority):
+            await line.exchange(1, READ_WEIGHT, priority)
+            order.append(name)
+        async def run():
+            line.open()
+            try:
+                first = asyncio.create_task(request("first", PRIORITY_COMMAND))
+                await asyncio.sleep(0)
+                await asyncio.gather(first, request("refresh", PRIORITY_REFRESH),
+                                     request("critical", PRIORITY_CRITICAL))
+            finally:
+                line.close()
+        asyncio.run(run())
+    assert order == ["first", "critical", "refresh"]
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from config import Config
+from machine.async_bus import AsyncModbusInterface
+from machine.async_runtime import AsyncRuntime, ControllerProxy, MqttBridge
+from machine.controller import MachineController
+from machine.modbus_slave import LoadCellSlave, RelayBoardSlave, VfdSlave, VirtualSerialPort
+from machine.simulation import NullMqtt
+
+class DisconnectingMqtt(NullMqtt):
+    disconnected = False
+    def disconnect(self):
+        self.disconnected = True
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+@pytest.fixture
+def config(tmp_path):
+    cfg = Config()
+    cfg.set("trace_dir", None)
+    cfg.set("cycle_record_dir", str(tmp_path / "records"))
+    cfg.set("compensation_file", str(tmp_path / "compensation.json"))
+    cfg.set("flow_split_file", str(tmp_path / "flow_split.json"))
+    cfg.set("initial_tare_delay", 0.1)
+    for device in ("vfd", "scale", "valve"):
+        cfg.set(f"{device}_timeout", 0.2)
+    return cfg
+
+def test_control_tasks_drive_the_bus_and_stop_safely(config):
+    load_cell = LoadCellSlave(address=1)
+    load_cell.weight = 0.5
+    relays = RelayBoardSlave(address=1)
+    vfd = VfdSlave(address=2, run_command=config.get("vfd_run_command"))
+    with VirtualSerialPort([load_cell], baudrate=9600) as scale_port, \
+         VirtualSerialPort([relays], baudrate=9600) as valve_port, \
+         VirtualSerialPort([vfd], baudrate=19200, ascii_mode=True) as vfd_port:
+        for key, port in (("vfd_port", vfd_port), ("scale_port", scale_port), ("valve_port", valve_port)):
+            config.set(key, port.port)
+        mqtt = DisconnectingMqtt()
+        bus = AsyncModbusInterface(config)
+        controller = MachineController(config, bus, MqttBridge(mqtt))
+        runtime = AsyncRuntime(controller, bus)
+        ui = ControllerProxy(runtime)
+        runtime.start()
+        try:
+            assert wait_until(lambda: controller._initial_tare_done)
+            assert controller._tare_weight == pytest.approx(0.5)
+            ui.valve1 = True
+            ui.vfd_state = config.get("vfd_run_command")
+            ui.vfd_speed = 1234
+            assert wait_until(lambda: relays.mask == 0x01 and vfd.registers[0x2001] == 1234)
+            assert vfd.registers[0x2000] == config.get("vfd_run_command")
+            assert ui.actual_weight == pytest.approx(0.5)
+        finally:
+            ui.stop()
+            runtime.stop()
+        assert relays.mask == 0
+        assert (vfd.registers[0x2000], vfd.registers[0x2001]) == (config.get("vfd_stop_command"), 0)
+    assert mqtt.disconnected
+    assert "ActualWeight" in str(mqtt.last)
+    assert controller.loops.stats()["scale"]["runs"] > 0
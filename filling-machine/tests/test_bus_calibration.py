@@ -0,0 +1,80 @@
+import time
+
+import minimalmodbus
+import pytest
+
+from machine.bus_calibration import apply_calibration, calibrate_bus, calibrate_device
+from machine.modbus_interface import ModbusInterface
+
+class TimingInstrument:
+    """
+    Answers after `latency` seconds; fails with a checksum error when polled
+    sooner than `min_gap` after the previous reply and times out when the
+    serial timeout is shorter than `latency`.
+    """
+    def __init__(self, latency=0.001, min_gap=0.004):
+        self.latency = latency
+        self.min_gap = min_gap
+        self._last   = None
+        class SerialStub: pass
+        self.serial = SerialStub()
+        self.serial.timeout = 0.05
+
+    def _reply(self, value):
+        now = time.perf_counter()
+        too_soon = self._last is not None and now - self._last < self.min_gap
+        time.sleep(self.latency)
+        self._last = time.perf_counter()
+        if self.serial.timeout < self.latency:
+            raise minimalmodbus.NoResponseError("No communication with the instrument (no answer)")
+        if too_soon:
+            raise minimalmodbus.InvalidResponseError("Checksum error in rtu mode")
+        return value
+
+    def read_long(self, *args, **kwargs):
+        return self._reply(1000)
+
+    def read_register(self, *args, **kwargs):
+        return self._reply(0)
+
+    def read_bits(self, address, count, functioncode=1):
+        return self._reply([0] * count)
+
+def make_interface():
+    instruments = {"vfd": TimingInstrument(), "scale": TimingInstrument(latency=0.003), "valves": TimingInstrument()}
+    config = {"vfd_poll_interval": 0.05, "scale_poll_interval": 0.05, "valve_poll_interval": 0.05,
+              "modbus_retries": 2}
+    return ModbusInterface(config, instruments=instruments)
+
+def test_finds_fastest_interval_and_shortest_timeout():
+    m = make_interface()
+    result = calibrate_device(m, "scale", intervals=(0.02, 0.01, 0.006, 0.001, 0.0),
+                              timeouts=(0.05, 0.01, 0.002), transactions=10, margin=1.0)
+    m.close()
+    # Intervals run start to start: a 3 ms reply plus the 4 ms gap needs more than 6 ms
+    assert result["interval"] == pytest.approx(0.01)
+    assert result["timeout"] == pytest.approx(0.01)
+    assert result["error_rate"] == 0.0
+
+def test_calibrate_bus_restores_timing_and_retries():
+    m = make_interface()
+    results = calibrate_bus(m, devices=("vfd",), intervals=(0.01, 0.0), timeouts=(0.05,), transactions=5)
+    assert m.retries == 2
+    assert m.vfd_interval == 0.05
+    assert m.vfd.serial.timeout == 0.05
+    m.close()
+    assert results["vfd"]["interval"] == pytest.approx(0.012)
+
+def test_unreachable_device_is_not_applied():
+    m = make_interface()
+    m.valves.latency = 0.2
+    results = calibrate_bus(m, devices=("valves",), intervals=(0.01,), timeouts=(0.05,), transactions=2)
+    m.close()
+    assert results["valves"] is None
+
+    class DictConfig(dict):
+        def set(self, key, value):
+            self[key] = value
+    cfg = DictConfig()
+    changed = apply_calibration(cfg, dict(results, scale={"interval": 0.012, "timeout": 0.024}))
+    assert changed == cfg == {"scale_poll_interval": 0.012, "scale_timeout": 0.024}
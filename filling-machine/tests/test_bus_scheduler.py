@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from machine.bus_scheduler import (BusScheduler, TransactionDropped, PRIORITY_CRITICAL,
+                                   PRIORITY_COMMAND, PRIORITY_REFRESH)
+from machine.clock import SimClock
+
+def blocked_scheduler(**kwargs):
+    """A scheduler whose worker is held inside a first transaction until released."""
+    scheduler = BusScheduler("test", **kwargs)
+    gate, started = threading.Event(), threading.Event()
+    def hold():
+        started.set()
+        gate.wait(2.0)
+    scheduler.submit(hold, "dev")
+    assert started.wait(1.0)
+    return scheduler, gate
+
+def test_most_urgent_class_goes_first():
+    scheduler, gate = blocked_scheduler()
+    order = []
+    txns = [scheduler.submit(lambda name=name: order.append(name), "dev", priority)
+            for name, priority in (("refresh", PRIORITY_REFRESH), ("command", PRIORITY_COMMAND),
+                                   ("stop", PRIORITY_CRITICAL))]
+    gate.set()
+    for txn in txns:
+        txn.result(1.0)
+    scheduler.close()
+    assert order == ["stop", "command", "refresh"]
+
+def test_earliest_deadline_first_within_a_class():
+    scheduler, gate = blocked_scheduler()
+    order = []
+    a = scheduler.submit(lambda: order.append("a"), "dev", PRIORITY_COMMAND, deadline=0.5)
+    b = scheduler.submit(lambda: order.append("b"), "dev", PRIORITY_COMMAND, deadline=0.1)
+    gate.set()
+    a.result(1.0), b.result(1.0)
+    scheduler.close()
+    assert order == ["b", "a"]
+
+def test_superseded_write_is_coalesced():
+    scheduler, gate = blocked_scheduler()
+    written = []
+    old = scheduler.submit(lambda: written.append(500), "vfd", PRIORITY_REFRESH, key=("vfd", 0x2001))
+    new = scheduler.submit(lambda: written.append(0), "vfd", PRIORITY_CRITICAL, key=("vfd", 0x2001))
+    gate.set()
+    with pytest.raises(TransactionDropped):
+        old.result(1.0)
+    new.result(1.0)
+    scheduler.close()
+    assert written == [0]
+    assert scheduler.stats()["refresh"]["coalesced"] == 1
+
+def test_late_droppable_transactions_are_abandoned():
+    scheduler, gate = blocked_scheduler()
+    ran = []
+    txn = scheduler.submit(lambda: ran.append(1), "dev", PRIORITY_REFRESH, deadline=0.0, drop_late=True)
+    gate.set()
+    with pytest.raises(TransactionDropped):
+        txn.result(1.0)
+    scheduler.close()
+    assert ran == []
+    assert scheduler.stats()["refresh"]["dropped"] == 1
+
+def test_errors_reach_the_caller_and_stats_count_waits():
+    scheduler = BusScheduler("test")
+    def fail():
+        raise IOError("no response")
+    with pytest.raises(IOError):
+        scheduler.call(fail, "dev", PRIORITY_CRITICAL, timeout=1.0)
+    assert scheduler.call(lambda: 42, "dev", PRIORITY_CRITICAL, timeout=1.0) == 42
+    stats = scheduler.stats()["critical"]
+    scheduler.close()
+    assert stats["count"] == 2
+    assert stats["wait_max"] >= stats["wait_mean"] >= 0.0
+    with pytest.raises(RuntimeError):
+        scheduler.submit(lambda: None, "dev")
+
+def test_device_spacing_lets_other_devices_go_ahead():
+    scheduler = BusScheduler("test", intervals={"slow": 0.2})
+    order = []
+    scheduler.call(lambda: order.append("slow1"), "slow", timeout=1.0)
+    second = scheduler.submit(lambda: order.append("slow2"), "slow", PRIORITY_CRITICAL)
+    other = scheduler.submit(lambda: order.append("fast"), "fast", PRIORITY_REFRESH)
+    second.result(1.0), other.result(1.0)
+    scheduler.close()
+    assert order == ["slow1", "fast", "slow2"]
+
+def test_device_interval_runs_from_transaction_start():
+    clock = SimClock()
+    scheduler = BusScheduler("test", intervals={"scale": 0.03}, clock=clock)
+    starts = []
+    def read():
+        starts.append(round(clock(), 6))
+        clock.sleep(0.02)
+    for _ in range(3):
+        scheduler.call(read, "scale", PRIORITY_CRITICAL)
+    scheduler.close()
+    assert starts == [0.0, 0.03, 0.06]
@@ -0,0 +1,43 @@
+import minimalmodbus
+import pytest
+
+from machine.bus_stats import BusStats, LatencyHistogram, classify_error
+
+def test_histogram_percentiles_within_bucket_precision():
+    h = LatencyHistogram()
+    for ms in range(1, 101):
+        h.record(ms / 1000.0)
+    s = h.summary()
+    assert s["count"] == 100
+    assert s["p50"] == pytest.approx(0.050, rel=0.07)
+    assert s["p99"] == pytest.approx(0.099, rel=0.07)
+    assert s["max"] == pytest.approx(0.100)
+    assert s["mean"] == pytest.approx(0.0505, rel=1e-3)
+
+def test_histogram_clamps_values_beyond_range():
+    h = LatencyHistogram(max_value_us=1000)
+    h.record(5.0)
+    assert h.percentile(0.5) == pytest.approx(5.0)
+
+def test_empty_histogram_reports_zeros():
+    assert LatencyHistogram().summary()["p99"] == 0.0
+
+def test_errors_are_classified():
+    assert classify_error(minimalmodbus.NoResponseError("no answer")) == "timeout"
+    assert classify_error(minimalmodbus.InvalidResponseError("Checksum error in rtu mode")) == "crc"
+    assert classify_error(ValueError("bad")) == "error"
+
+def test_bus_stats_snapshot_per_device_and_operation():
+    stats = BusStats()
+    stats.record("scale", "read", 0.010)
+    stats.count("scale", "read", "timeout")
+    stats.count("scale", "read", "retry")
+    stats.record("scale", "read", 0.060)
+    stats.record("vfd", "write_speed", 0.020, ok=False)
+    snap = stats.snapshot()
+    assert list(snap) == ["scale/read", "vfd/write_speed"]
+    assert snap["scale/read"]["count"] == 2
+    assert snap["scale/read"]["ok"] == 2
+    assert snap["scale/read"]["timeout"] == 1 and snap["scale/read"]["retry"] == 1
+    assert snap["vfd/write_speed"]["ok"] == 0
+    assert "scale/read" in stats.format()
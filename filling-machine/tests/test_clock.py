@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from config import Config
+from machine.benchmark import run_benchmark
+from machine.clock import SimClock
+
+def test_sleep_advances_simulated_time_only():
+    clock = SimClock(start=100.0, epoch=1_000_000.0)
+    started = time.monotonic()
+    clock.sleep(3600.0)
+    assert clock() == pytest.approx(3700.0)
+    assert clock.time() == pytest.approx(1_003_600.0)
+    assert time.monotonic() - started < 1.0
+
+def test_threads_interleave_in_simulated_time_order():
+    clock = SimClock()
+    log = []
+    def worker(name, period):
+        for _ in range(3):
+            clock.sleep(period)
+            log.append((round(clock(), 3), name))
+    threads = [clock.thread(lambda n=n, p=p: worker(n, p)) for n, p in (("a", 0.3), ("b", 0.2))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        clock.join(t)
+    assert [t for t, _ in log] == [0.2, 0.3, 0.4, 0.6, 0.6, 0.9]
+    assert sorted(log) == [(0.2, "b"), (0.3, "a"), (0.4, "b"), (0.6, "a"), (0.6, "b"), (0.9, "a")]
+    assert clock() == pytest.approx(0.9)
+
+def test_event_wait_times_out_or_is_set():
+    clock = SimClock()
+    event = clock.event()
+    assert not event.wait(5.0)
+    assert clock() == pytest.approx(5.0)
+    setter = clock.timer(2.0, event.set)
+    setter.start()
+    assert event.wait(10.0)
+    assert clock() == pytest.approx(7.0)
+
+def test_condition_wakes_waiter_when_notified():
+    clock = SimClock()
+    cond = clock.condition()
+    box = []
+    def producer():
+        clock.sleep(1.5)
+        with cond:
+            box.append(1)
+            cond.notify_all()
+    clock.thread(producer).start()
+    with cond:
+        assert cond.wait_for(lambda: box, timeout=10.0)
+    assert clock() == pytest.approx(1.5)
+
+def test_lock_holder_sleeping_does_not_stall_time():
+    clock = SimClock()
+    lock = clock.rlock()
+    order = []
+    def holder():
+        with lock:
+            clock.sleep(1.0)
+            order.append("holder")
+    clock.thread(holder).start()
+    clock.sleep(0.1)
+    with lock:
+        order.append("main")
+    assert order == ["holder", "main"]
+    assert clock() == pytest.approx(1.0)
+
+def test_benchmark_runs_faster_than_real_time(tmp_path):
+    started = time.monotonic()
+    report = run_benchmark(Config(), trays=2, plant_options={"seed": 1}, clock=SimClock(),
+                           scratch_dir=str(tmp_path))
+    assert report["trays"] == 2
+    assert report["cycle_time_mean"] > 5.0
+    assert time.monotonic() - started < report["cycle_time_mean"]
@@ -0,0 +1,35 @@
+import json
+import pytest
+
+from machine.compensation import OvershootCompensation
+
+def test_offset_defaults_to_zero(tmp_path):
+    comp = OvershootCompensation(str(tmp_path / "comp.json"))
+    assert comp.offset("Brie", "left", "15-3Hz") == 0.0
+
+def test_update_is_exponentially_weighted(tmp_path):
+    comp = OvershootCompensation(str(tmp_path / "comp.json"), alpha=0.5)
+    assert comp.update("Brie", "left", "p", 0.04) == pytest.approx(0.04)
+    assert comp.update("Brie", "left", "p", 0.02) == pytest.approx(0.03)
+    assert comp.offset("Brie", "left", "p") == pytest.approx(0.03)
+    assert comp.offset("Brie", "right", "p") == 0.0
+
+def test_update_is_clamped(tmp_path):
+    comp = OvershootCompensation(str(tmp_path / "comp.json"), max_offset=0.05)
+    assert comp.update("Brie", "left", "p", 0.5) == pytest.approx(0.05)
+    assert comp.update("Brie", "right", "p", -0.5) == pytest.approx(-0.05)
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "comp.json")
+    comp = OvershootCompensation(path)
+    comp.update("Brie", "left", "p", 0.03)
+    comp.save()
+    reloaded = OvershootCompensation(path)
+    assert reloaded.offset("Brie", "left", "p") == pytest.approx(0.03)
+    assert json.loads((tmp_path / "comp.json").read_text())["Brie/left/p"]["count"] == 1
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / "comp.json"
+    path.write_text("{ not json", encoding="utf-8")
+    comp = OvershootCompensation(str(path))
+    assert comp.offset("Brie", "left", "p") == 0.0
@@ -45,3 +45,19 @@ def test_config_invalid_json(tmp_path):
     invalid_file.write_text("{ invalid json }", encoding="utf-8")
     with pytest.raises(ValueError):
         Config(str(invalid_file))
+
+def test_config_sibling_path(tmp_config_file):
+    path, _ = tmp_config_file
+    cfg = Config(path)
+    assert cfg.sibling_path("comp.json") == os.path.join(os.path.dirname(path), "comp.json")
+
+def test_config_speed_profile_falls_back_to_default(tmp_path):
+    path = tmp_path / "cfg.json"
+    brie = {"points": [[0.2, 10], [0.05, 3]]}
+    default = {"points": [[0.3, 15]]}
+    path.write_text(json.dumps({"speed_profiles": {"Brie": brie, "default": default}}), encoding="utf-8")
+    cfg = Config(str(path))
+    assert cfg.speed_profile("Brie") == brie
+    assert cfg.speed_profile("Essent_Mozz") == default
+    path.write_text(json.dumps({}), encoding="utf-8")
+    assert Config(str(path)).speed_profile("Brie") is None
@@ -11,20 +11,28 @@ class DummyModbus:
         self.vfd_states = []
         self.vfd_speeds = []
         self.valve_actions = []
+        self.valve_masks = []
     def set_vfd_state(self, state):
         self.vfd_states.append(state)
     def set_vfd_speed(self, speed):
         self.vfd_speeds.append(speed)
     def set_valve(self, valve, action):
         self.valve_actions.append((valve, action))
+    def set_valves(self, mask):
+        self.valve_masks.append(mask)
+    def verify_vfd(self, state, speed):
+        self.vfd_states.append(("verify", state))
+        return {"state": state, "speed": speed, "status": 1, "written": []}
     def read_load_cell(self):
         return 0.0  # constant for loop tests
+    def read_load_cell_sample(self):
+        return 0.0, 0.0
 
 class DummyMqtt:
     def __init__(self):
         self.published = []
         self.disconnected = False
-    def publish(self, topic, payload):
+    def publish(self, topic, payload, qos=0, retain=False):
         self.published.append((topic, payload))
     def disconnect(self):
         self.disconnected = True
@@ -105,3 +113,207 @@ def test_stop_cleanup(controller):
     assert ("right","close") in controller.modbus.valve_actions
     # MQTT disconnected
     assert controller.mqtt.disconnected is True
+
+def test_setpoint_change_wakes_actuator_threads(controller):
+    # With a long refresh interval, only the setpoint notification can
+    # explain a prompt write
+    controller._vfd_interval = 5.0
+    controller._valve_interval = 5.0
+    controller.kill_all.clear()
+    threads = [threading.Thread(target=fn, daemon=True)
+               for fn in (controller._vfd_loop, controller._valve_loop)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    controller.modbus.vfd_speeds.clear()
+    controller.modbus.valve_masks.clear()
+
+    controller.vfd_speed = 1500
+    controller.valve1 = True
+    time.sleep(0.1)
+    assert controller.modbus.vfd_speeds == [1500]
+    assert controller.modbus.valve_masks == [0x01]
+
+    controller.kill_all.set()
+    controller._wake_actuators()
+    for t in threads:
+        t.join(timeout=1.0)
+        assert not t.is_alive()
+
+def test_shutdown_writes_unsent_setpoints(controller, monkeypatch):
+    class SlowModbus(DummyModbus):
+        def set_vfd_speed(self, speed):
+            time.sleep(0.05)
+            super().set_vfd_speed(speed)
+    controller.modbus = SlowModbus()
+    monkeypatch.setattr(controller, "close", lambda: None)
+    monkeypatch.setattr(controller._clock, "sleep", lambda seconds: None)
+    controller._vfd_interval = 5.0
+    controller._valve_interval = 5.0
+    controller.kill_all.clear()
+    controller.vfd_state = controller.vfd_run_cmd
+    controller.vfd_speed = 1500
+    controller.valve1 = True
+    controller._threads = [threading.Thread(target=fn, daemon=True)
+                           for fn in (controller._vfd_loop, controller._valve_loop)]
+    for t in controller._threads:
+        t.start()
+    time.sleep(0.02)                          # the 1500 write is still on the bus
+    controller.stop()
+    assert not any(t.is_alive() for t in controller._threads)
+    assert controller.modbus.vfd_speeds[-1] == 0
+    assert controller.modbus.vfd_states[-1] == controller.vfd_stop_cmd
+    assert controller.modbus.valve_masks[-1] == 0
+
+def test_vfd_refresh_reads_back_the_drive(controller):
+    controller._vfd_verify = True
+    controller._vfd_interval = 0.01
+    controller._vfd_verify_interval = 5.0
+    controller.kill_all.clear()
+    controller.vfd_speed = 1500
+    thread = threading.Thread(target=controller._vfd_loop, daemon=True)
+    thread.start()
+    time.sleep(0.1)
+    # One write for the change, then a single read-back until the interval elapses
+    assert controller.modbus.vfd_speeds == [1500]
+    assert [s for s in controller.modbus.vfd_states if isinstance(s, tuple)] == [("verify", controller.vfd_state)]
+    controller.kill_all.set()
+    controller._wake_actuators()
+    thread.join(timeout=1.0)
+    fields = controller.telemetry_fields()
+    assert fields["VFDSpeedReference"] == 1500 and fields["VFDStatus"] == 1
+
+def test_predictive_cutoff_stops_early(controller):
+    controller.desired_volume = 1.0
+    controller._cutoff_lag = 0.5
+    controller.predictive_cutoff = True
+    # Steady 0.2 kg/s flow ending at 0.92 kg net
+    now = time.monotonic()
+    for n in range(10):
+        controller.scale_buffer.append(0.0, 0.74 + 0.02 * n, t=now - 0.9 + n * 0.1)
+    assert controller.flow_rate == 0.0
+    assert controller._fill_target_reached(0.85, "left") is False
+    assert controller._fill_target_reached(0.92, "left") is True
+    assert controller.flow_rate == pytest.approx(0.2)
+
+    controller.predictive_cutoff = False
+    assert controller._fill_target_reached(0.92, "left") is False
+    assert controller._fill_target_reached(1.0, "left") is True
+
+def test_learned_overshoot_applied_to_next_fill(controller, tmp_path):
+    from machine.compensation import OvershootCompensation
+    controller.compensation = OvershootCompensation(str(tmp_path / "comp.json"), alpha=0.5)
+    controller.predictive_cutoff = False
+    controller.desired_volume = 1.0
+    controller.select_flavour("Brie")
+    controller.desired_volume = 1.0
+
+    assert controller._fill_target_reached(0.97, "left") is False
+    controller._learn_overshoot("left", 1.04)
+    # Next left fill stops 0.04 kg early; the right side is unaffected
+    assert controller._fill_target_reached(0.97, "left") is True
+    assert controller._fill_target_reached(0.97, "right") is False
+
+def test_fill_cutoff_does_not_block_the_loop(controller, tmp_path):
+    from machine.compensation import OvershootCompensation
+    controller.compensation = OvershootCompensation(str(tmp_path / "comp.json"))
+    controller.predictive_cutoff = False
+    controller.desired_volume = 1.0
+    controller._post_fill_delay = 0.2
+    controller._settle_timeout = 0.3
+    controller._tare_weight = controller._left_tare = 2.0
+    controller._fsm.transition(controller.STATE_FILL_LEFT_SLOW)
+    controller.valve1 = True
+    controller.actual_weight = 3.01
+
+    start = time.monotonic()
+    controller._fsm.tick(start)
+    assert time.monotonic() - start < 0.1
+    assert controller.vfd_speed == 0
+    assert controller.valve1 is True          # closes after post_fill_delay
+    controller._fsm.tick(start + 0.1)
+    assert controller.valve1 is True
+    controller._fsm.tick(start + 0.25)
+    assert controller.valve1 is False
+    assert controller._state == controller.STATE_FILL_LEFT_SLOW
+
+    for n in range(8):
+        controller.scale_buffer.append(3.02, 3.02, t=start + 0.3 + n * 0.01)
+    controller._fsm.tick(start + 0.4)
+    assert controller._state == controller.STATE_PREP_RIGHT
+    assert controller._last_left_pour == pytest.approx(1.02)
+    assert controller._right_tare == pytest.approx(3.02)
+
+def test_tray_removal_confirmed_by_time_not_tick_count(controller):
+    controller._baseline_empty = 0.0
+    controller.actual_weight = 0.01
+    start = time.monotonic()
+    controller._fsm.transition(controller.STATE_WAIT_REMOVAL, start)
+    for n in range(100):                      # many fast ticks within confirm_removal_time
+        controller._fsm.tick(start + n * 0.01)
+    assert controller._state == controller.STATE_WAIT_REMOVAL
+    controller.actual_weight = 1.0            # tray lifted back on: start over
+    controller._fsm.tick(start + 1.0)
+    controller.actual_weight = 0.01
+    controller._fsm.tick(start + 1.1)
+    controller._fsm.tick(start + 1.1 + controller._confirm_removal_time - 0.01)
+    assert controller._state == controller.STATE_WAIT_REMOVAL
+    controller._fsm.tick(start + 1.1 + controller._confirm_removal_time)
+    assert controller._state == controller.STATE_WAITING_FOR_MOULD
+
+def test_parallel_fill_closes_lead_valve_and_finishes_other(controller, tmp_path):
+    from machine.compensation import OvershootCompensation
+    from machine.flow_split import FlowSplit
+    controller.compensation = OvershootCompensation(str(tmp_path / "comp.json"))
+    controller.flow_split = FlowSplit(str(tmp_path / "split.json"), fixed={controller.flavour: 0.6})
+    controller.parallel_flavours = {controller.flavour}
+    controller.predictive_cutoff = False
+    controller.desired_volume = 1.0
+    assert controller._use_parallel_fill() is True
+
+    controller._parallel = True
+    controller._tare_weight = controller._mould_tare = controller._left_tare = controller._right_tare = 2.0
+    controller._fsm.transition(controller.STATE_FILL_BOTH)
+    controller.valve1 = controller.valve2 = True
+    controller.actual_weight = 3.5            # left ~0.9, right ~0.6
+    controller._fsm.tick()
+    assert controller._state == controller.STATE_FILL_BOTH
+    assert controller.current_left_pour == pytest.approx(0.9)
+
+    controller.actual_weight = 3.7            # left ~1.02 reaches its target first
+    controller._fsm.tick()
+    assert controller.valve1 is False and controller.valve2 is True
+    assert controller._state == controller.STATE_FILL_RIGHT_FAST
+    # Right continues as if its 0.68 kg share were measured from its own tare
+    assert controller.actual_weight - controller._right_tare == pytest.approx(0.68, abs=0.01)
+    assert controller._speed_profile_key().endswith("-parallel")
+
+def test_configured_speed_profile_drives_fill_speed(controller):
+    controller.config.set("speed_profiles", {"Brie": {"points": [[0.5, 20], [0.1, 4]], "name": "brie-gentle"}})
+    controller.select_flavour("Brie")
+    controller.desired_volume = 1.0
+    controller._set_fill_speed(0.3, 0.0)
+    assert controller.vfd_speed == 2000
+    controller._set_fill_speed(0.05, 0.1)
+    assert controller.vfd_speed == 400
+    assert controller._speed_profile_key() == "brie-gentle"
+    # Without a profile the live fast/slow settings keep their compensation key
+    controller.config.set("speed_profiles", {})
+    controller.select_flavour("Brie")
+    assert controller._speed_profile_key().startswith(f"{controller.speed_fast:g}-{controller.speed_slow:g}Hz")
+
+def test_flow_loop_takes_over_from_profile(controller):
+    controller.flow_control = True
+    controller.desired_volume = 1.0
+    controller._flow_max, controller._flow_approach = 0.3, 1.0
+    controller._start_pump_ramp()
+    now = time.monotonic()
+    # 0.05 kg/s measured against a 0.1 kg/s setpoint with 0.1 kg to go
+    for n in range(10):
+        controller.scale_buffer.append(0.0, 2.0 + 0.005 * n, t=now - 0.9 + n * 0.1)
+    controller._set_fill_speed(0.1, now)
+    open_loop = controller.vfd_speed
+    assert open_loop == int(controller._fill_profile().speed(0.1, 1.0) * 100)
+    controller._set_fill_speed(0.1, now + 0.05)
+    assert controller.vfd_speed > open_loop
+    assert controller._speed_profile_key().endswith("-pi")
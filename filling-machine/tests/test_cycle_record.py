@@ -0,0 +1,72 @@
+import csv
+from datetime import datetime
+
+import pytest
+
+from machine.cycle_record import CycleRecord, CycleWriter
+
+EVENTS = ("fill_left_fast", "left_cutoff", "fill_right_fast", "right_cutoff")
+
+def _record(started):
+    rec = CycleRecord("Brie", 1.3, 0.25, "15-3Hz", started)
+    rec.mark("fill_left_fast", started + 1.0)
+    rec.mark("left_cutoff", started + 4.5)
+    rec.mark("left_cutoff", started + 9.0)      # later marks are ignored
+    rec.update(left_pour=1.30123456, left_tare=0.5)
+    rec.finish(started + 12.0)
+    return rec
+
+def test_row_has_relative_timestamps_and_fill_time():
+    started = datetime(2026, 3, 1, 8, 0, 0).timestamp()
+    row = _record(started).as_row()
+    assert row["cycle_start"].startswith("2026-03-01T08:00:00")
+    assert row["cycle_time"] == pytest.approx(12.0)
+    assert row["t_left_cutoff"] == pytest.approx(4.5)
+    assert row["left_fill_time"] == pytest.approx(3.5)
+    assert row["left_pour"] == pytest.approx(1.3012)
+    assert "right_fill_time" not in row
+
+def test_columns_append_event_timestamps():
+    cols = CycleRecord.columns(EVENTS)
+    assert cols[:len(CycleRecord.FIELDS)] == CycleRecord.FIELDS
+    assert cols[-1] == "t_right_cutoff"
+
+def test_writer_rotates_daily_files(tmp_path):
+    writer = CycleWriter(str(tmp_path), CycleRecord.columns(EVENTS), flush_interval=0.05)
+    day1 = datetime(2026, 3, 1, 23, 59).timestamp()
+    day2 = datetime(2026, 3, 2, 0, 1).timestamp()
+    writer.write(_record(day1).as_row())
+    writer.write(_record(day1 + 30).as_row())
+    writer.write(_record(day2).as_row())
+    writer.close()
+    assert writer.rows_written == 3
+    with open(writer.path_for("2026-03-01"), newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 2
+    assert rows[0]["flavour"] == "Brie"
+    assert rows[0]["t_left_cutoff"] == "4.5"
+    with open(writer.path_for("2026-03-02"), newline="") as f:
+        assert len(list(csv.DictReader(f))) == 1
+
+def test_writer_appends_without_repeating_header(tmp_path):
+    cols = CycleRecord.columns(EVENTS)
+    started = datetime(2026, 3, 1, 9, 0).timestamp()
+    for _ in range(2):
+        writer = CycleWriter(str(tmp_path), cols, flush_interval=0.05)
+        writer.write(_record(started).as_row())
+        writer.close()
+    lines = open(writer.path_for("2026-03-01")).read().splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith("cycle_start,")
+
+def test_writer_moves_aside_file_with_other_columns(tmp_path):
+    started = datetime(2026, 3, 1, 9, 0).timestamp()
+    writer = CycleWriter(str(tmp_path), CycleRecord.columns(EVENTS[:2]), flush_interval=0.05)
+    writer.write(_record(started).as_row())
+    writer.close()
+    writer = CycleWriter(str(tmp_path), CycleRecord.columns(EVENTS), flush_interval=0.05)
+    writer.write(_record(started).as_row())
+    writer.close()
+    path = writer.path_for("2026-03-01")
+    assert open(path).readline().rstrip().endswith("t_right_cutoff")
+    assert (tmp_path / "cycles_2026-03-01.1.csv").exists()
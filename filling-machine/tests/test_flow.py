@@ -0,0 +1,28 @@
+import pytest
+
+from machine.flow import FlowEstimator, least_squares_slope
+from machine.scale_buffer import ScaleBuffer, ScaleSample
+
+def test_least_squares_slope_linear():
+    samples = [ScaleSample(t, 0.0, 1.0 + 0.2 * t) for t in (0.0, 0.1, 0.2, 0.3)]
+    assert least_squares_slope(samples) == pytest.approx(0.2)
+
+def test_least_squares_slope_degenerate():
+    assert least_squares_slope([ScaleSample(1.0, 0.0, 1.0)]) is None
+    assert least_squares_slope([ScaleSample(1.0, 0.0, 1.0), ScaleSample(1.0, 0.0, 2.0)]) is None
+
+def test_flow_estimator_uses_recent_window():
+    buf = ScaleBuffer()
+    # Fast flow long ago, then a steady 0.05 kg/s in the last half second
+    for n in range(10):
+        buf.append(0.0, 0.5 * n, t=float(n) * 0.1)
+    for n in range(10):
+        buf.append(0.0, 5.0 + 0.005 * n, t=10.0 + n * 0.1)
+    est = FlowEstimator(window=0.5)
+    assert est.rate(buf, now=10.9) == pytest.approx(0.05)
+
+def test_flow_estimator_needs_min_samples():
+    buf = ScaleBuffer()
+    buf.append(0.0, 0.0, t=0.0)
+    buf.append(0.0, 0.1, t=0.1)
+    assert FlowEstimator(window=1.0, min_samples=4).rate(buf, now=0.1) is None
@@ -0,0 +1,38 @@
+import pytest
+
+from machine.flow_control import PIController, flow_setpoint
+
+def test_setpoint_decays_towards_target():
+    assert flow_setpoint(1.0, 0.3, 0.02, 1.5) == 0.3
+    assert flow_setpoint(0.15, 0.3, 0.02, 1.5) == pytest.approx(0.1)
+    assert flow_setpoint(0.0, 0.3, 0.02, 1.5) == 0.02
+    assert flow_setpoint(0.1, 0.3, 0.02, 0.0) == 0.3
+
+def test_pi_starts_bumpless_from_seeded_output():
+    pi = PIController(kp=10.0, ki=5.0, out_min=1.0, out_max=20.0)
+    assert not pi.active
+    pi.reset(8.0)
+    assert pi.active
+    assert pi.update(0.2, 0.2, 0.0) == pytest.approx(8.0)
+    # Too little flow: proportional kick plus integral growth
+    assert pi.update(0.3, 0.2, 1.0) == pytest.approx(8.0 + 1.0 + 0.5)
+
+def test_pi_tracks_plant_with_changing_gain():
+    pi = PIController(kp=5.0, ki=100.0, out_min=0.0, out_max=50.0)
+    pi.reset(0.0)
+    gain, flow = 0.02, 0.0
+    for step in range(400):
+        if step == 200:
+            gain = 0.01                     # product thickens: half the flow per Hz
+        hz = pi.update(0.2, flow, step * 0.05)
+        flow = gain * hz
+    assert flow == pytest.approx(0.2, rel=0.02)
+    assert hz == pytest.approx(20.0, rel=0.02)
+
+def test_pi_anti_windup_recovers_immediately():
+    pi = PIController(kp=1.0, ki=10.0, out_min=0.0, out_max=10.0)
+    pi.reset(10.0)
+    for step in range(100):                 # saturated for 10 s
+        assert pi.update(5.0, 0.0, step * 0.1) == 10.0
+    # Once the error flips sign the output leaves the limit at once
+    assert pi.update(0.0, 1.0, 10.0) < 10.0
@@ -0,0 +1,39 @@
+import pytest
+
+from machine.flow_split import FlowSplit
+
+def test_share_defaults_to_even(tmp_path):
+    split = FlowSplit(str(tmp_path / "split.json"))
+    assert split.share("Brie", "left") == 0.5
+    assert split.samples("Brie") == 0
+
+def test_share_follows_single_valve_flow(tmp_path):
+    split = FlowSplit(str(tmp_path / "split.json"))
+    split.update("Brie", "left", 0.30, 15.0)
+    split.update("Brie", "right", 0.20, 10.0)
+    split.update("Brie", "right", 0.10, 10.0)
+    assert split.samples("Brie") == 1
+    # 0.02 kg/s/Hz left against 0.8 * 0.02 + 0.2 * 0.01 = 0.018 right
+    assert split.share("Brie", "left") == pytest.approx(0.02 / 0.038)
+    assert split.share("Brie", "left") + split.share("Brie", "right") == pytest.approx(1.0)
+
+def test_invalid_measurements_are_ignored(tmp_path):
+    split = FlowSplit(str(tmp_path / "split.json"))
+    split.update("Brie", "left", None, 15.0)
+    split.update("Brie", "left", -0.1, 15.0)
+    split.update("Brie", "left", 0.3, 0.0)
+    assert split.samples("Brie") == 0
+
+def test_fixed_split_overrides_learning(tmp_path):
+    split = FlowSplit(str(tmp_path / "split.json"), fixed={"Brie": 0.6})
+    split.update("Brie", "left", 0.1, 10.0)
+    assert split.share("Brie", "right") == pytest.approx(0.4)
+    assert split.samples("Brie") == float("inf")
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "split.json")
+    split = FlowSplit(path)
+    split.update("Brie", "left", 0.3, 10.0)
+    split.update("Brie", "right", 0.1, 10.0)
+    split.save()
+    assert FlowSplit(path).share("Brie", "left") == pytest.approx(0.75)
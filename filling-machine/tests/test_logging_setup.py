@@ -0,0 +1,89 @@
+import logging
+import queue
+import threading
+import pytest
+
+from logging_setup import DeferredQueueHandler, RateLimitFilter, SuppressedCountFormatter, setup_logging
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = []
+    def emit(self, record):
+        self.records.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+def make_record(msg="tick %d", args=(1,), level=logging.DEBUG, lineno=10):
+    return logging.LogRecord("machine.test", level, "test.py", lineno, msg, args, None)
+
+@pytest.fixture
+def restore_root():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.getLogger("machine.noisy").setLevel(logging.NOTSET)
+
+def test_rate_limit_allows_burst_then_refills():
+    clock = ManualClock()
+    limiter = RateLimitFilter(rate=2.0, burst=3, clock=clock)
+    passed = [limiter.filter(make_record()) for _ in range(5)]
+    assert passed == [True, True, True, False, False]
+    clock.now = 0.5                                  # one token back
+    record = make_record()
+    assert limiter.filter(record)
+    assert record.getMessage() == "tick 1"
+    assert SuppressedCountFormatter("%(message)s").format(record) == "tick 1 [2 similar suppressed]"
+    assert not limiter.filter(make_record())
+
+def test_rate_limit_leaves_literal_percent_alone():
+    clock = ManualClock()
+    limiter = RateLimitFilter(rate=1.0, burst=1, clock=clock)
+    assert limiter.filter(make_record("valve 100% open", ()))
+    assert not limiter.filter(make_record("valve 100% open", ()))
+    clock.now = 1.0
+    record = make_record("valve 100% open", ())
+    assert limiter.filter(record)
+    assert record.msg == "valve 100% open" and record.args == ()
+    assert SuppressedCountFormatter("%(message)s").format(record) == "valve 100% open [1 similar suppressed]"
+
+def test_rate_limit_is_per_call_site_and_spares_warnings():
+    limiter = RateLimitFilter(rate=1.0, burst=1, clock=ManualClock())
+    assert limiter.filter(make_record(lineno=1))
+    assert not limiter.filter(make_record(lineno=1))
+    assert limiter.filter(make_record(lineno=2))
+    assert limiter.filter(make_record(lineno=1, level=logging.WARNING))
+
+def test_deferred_handler_does_not_format_on_caller():
+    q = queue.SimpleQueue()
+    handler = DeferredQueueHandler(q)
+    record = make_record("weight %.3f", (1.23456,))
+    handler.handle(record)
+    queued = q.get_nowait()
+    assert queued.msg == "weight %.3f" and queued.args == (1.23456,)
+    assert queued.getMessage() == "weight 1.235"
+
+def test_setup_logging_routes_through_listener(restore_root):
+    out = ListHandler()
+    config = {"log_levels": {"machine.noisy": "warning"}, "log_rate_limit": {"rate": 1.0, "burst": 2}}
+    listener = setup_logging(config, [out])
+    try:
+        logging.getLogger("machine.quiet").info("hello %s", "world")
+        logging.getLogger("machine.noisy").info("dropped by level")
+        for n in range(5):
+            logging.getLogger("machine.quiet").debug("spam %d", n)
+    finally:
+        listener.stop()
+    assert out.records == ["hello world", "spam 0", "spam 1"]
+    assert all(thread is not threading.current_thread() for thread in out.threads)
@@ -9,25 +9,50 @@ class FakeInstrument:
     """
     def __init__(self, port, slaveaddr):
         self._regs = {}
+        self.writes = []
         class SerialStub: pass
         self.serial = SerialStub()
 
-    def read_long(self, address, functioncode):
+    def read_long(self, address, functioncode=3, *args, **kwargs):
         return self._regs.get(address, 0)
 
-    def write_register(self, address, value):
+    def read_registers(self, address, count, *args, **kwargs):
+        self.writes.append(("read", address, count))
+        return [self._regs.get(address + n, 0) for n in range(count)]
+
+    def write_register(self, address, value, *args, **kwargs):
+        self.writes.append((address, value))
         self._regs[address] = value
 
-    def write_bit(self, coil, on):
+    def write_bit(self, coil, on, *args, **kwargs):
+        self.writes.append((f"coil{coil}", on))
         self._regs[f"coil{coil}"] = on
 
+    def write_bits(self, address, values):
+        self.writes.append(("coils", tuple(values)))
+        for offset, on in enumerate(values):
+            self._regs[f"coil{address + offset}"] = on
+
 @pytest.fixture(autouse=True)
 def patch_minimalmodbus(monkeypatch):
     """
     Replace minimalmodbus.Instrument with FakeInstrument
     """
     monkeypatch.setattr(minimalmodbus, "Instrument",
-                        lambda port, addr: FakeInstrument(port, addr))
+                        lambda port, addr, *args: FakeInstrument(port, addr))
+
+
+def make_interface(**overrides):
+    """
+    Build a ModbusInterface with zero poll intervals so tests never sleep.
+    """
+    cfg = {
+        "vfd_poll_interval": 0.0,
+        "scale_poll_interval": 0.0,
+        "valve_poll_interval": 0.0,
+    }
+    cfg.update(overrides)
+    return ModbusInterface(cfg)
 
 
 def test_read_load_cell_signed_conversion():
@@ -80,3 +105,117 @@ def test_set_valve_invalid_action():
     m = ModbusInterface()
     with pytest.raises(ValueError):
         m.set_valve("left", "stop")
+
+
+def test_shadow_skips_unchanged_writes():
+    m = make_interface(command_keepalive_interval=None)
+    assert m.set_vfd_speed(500) is True
+    assert m.set_vfd_speed(500) is False
+    assert m.set_vfd_state(2) is True
+    assert m.set_vfd_state(2) is False
+    assert m.vfd.writes == [(0x2001, 500), (0x2000, 2)]
+
+    m.set_valve("left", "open")
+    m.set_valve("left", "open")
+    m.set_valve("both", "open")
+    assert m.valves.writes == [("coils", (1, 0, 0, 0, 0, 0, 0, 0)),
+                               ("coils", (1, 1, 0, 0, 0, 0, 0, 0))]
+    assert m.shadow_stats() == {"written": 4, "skipped": 3}
+
+
+def test_shadow_writes_on_change():
+    m = make_interface(command_keepalive_interval=None)
+    m.set_vfd_speed(500)
+    m.set_vfd_speed(300)
+    assert m.vfd.writes == [(0x2001, 500), (0x2001, 300)]
+
+
+def test_shadow_keepalive_refresh():
+    m = make_interface(command_keepalive_interval=0.0)
+    m.set_vfd_state(1)
+    m.set_vfd_state(1)
+    assert len(m.vfd.writes) == 2
+    assert m.shadow_stats()["skipped"] == 0
+
+
+def test_shadow_invalidated_after_write_error():
+    m = make_interface(command_keepalive_interval=None)
+    m.set_vfd_speed(500)
+
+    def failing_write(*args, **kwargs):
+        raise IOError("no response")
+    m.vfd.write_register = failing_write
+    with pytest.raises(IOError):
+        m.set_vfd_speed(600)
+
+    # After the failure the old value must be rewritten, not skipped
+    del m.vfd.write_register
+    assert m.set_vfd_speed(500) is True
+
+
+def test_set_valves_single_transaction():
+    m = make_interface(command_keepalive_interval=None)
+    m.set_valves(m.VALVE_LEFT | m.VALVE_RIGHT | 0x80)
+    assert m.valves.writes == [("coils", (1, 1, 0, 0, 0, 0, 0, 1))]
+    # Single-valve commands keep the other relays as they were
+    m.set_valve("left", "close")
+    assert m.valves.writes[-1] == ("coils", (0, 1, 0, 0, 0, 0, 0, 1))
+
+
+def test_set_valves_invalid_mask():
+    m = make_interface()
+    with pytest.raises(ValueError):
+        m.set_valves(0x100)
+
+
+def test_read_load_cell_sample_returns_raw_and_smoothed():
+    m = make_interface()
+    m.scale._regs[0x0000] = 1000
+    assert m.read_load_cell_sample() == pytest.approx((1.0, 1.0))
+    m.scale._regs[0x0000] = 2000
+    assert m.read_load_cell_sample() == pytest.approx((2.0, 1.5))
+
+
+def test_stop_and_close_commands_are_critical():
+    m = make_interface(command_keepalive_interval=None, vfd_stop_command=1)
+    m.set_vfd_state(2)
+    m.set_vfd_state(1)
+    m.set_valves(m.VALVE_LEFT)
+    m.set_valves(0)
+    stats = m.scheduler_stats()
+    m.close()
+    counts = {name: sum(port[name]["count"] for port in stats.values()) for name in ("critical", "command")}
+    assert counts == {"critical": 2, "command": 2}
+
+
+def test_timeouts_are_retried_and_counted():
+    m = make_interface(modbus_retries=1)
+    m.scale._regs[0x0000] = 1000
+    real_read = m.scale.read_long
+    failures = [minimalmodbus.NoResponseError("no answer")]
+    def flaky_read(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return real_read(*args, **kwargs)
+    m.scale.read_long = flaky_read
+    assert m.read_load_cell_sample()[0] == pytest.approx(1.0)
+    stats = m.transaction_stats()["scale/read"]
+    m.close()
+    assert (stats["count"], stats["ok"], stats["timeout"], stats["retry"]) == (1, 1, 1, 1)
+
+
+def test_verify_vfd_rewrites_only_diverging_registers():
+    m = make_interface(command_keepalive_interval=1.0)
+    m.set_vfd_state(2)
+    m.set_vfd_speed(500)
+    m.vfd._regs[0x2001] = 0          # drive lost the speed reference
+    m.vfd._regs[0x2002] = 1
+    m.vfd.writes.clear()
+    reported = m.verify_vfd(2, 500)
+    assert reported == {"state": 2, "speed": 0, "status": 1, "written": [0x2001]}
+    assert m.vfd.writes == [("read", 0x2000, 3), (0x2001, 500)]
+
+    m.vfd.writes.clear()
+    assert m.verify_vfd(2, 500)["written"] == []
+    assert m.vfd.writes == [("read", 0x2000, 3)]
+    m.close()
@@ -0,0 +1,71 @@
+import time
+import minimalmodbus
+import pytest
+
+from machine.modbus_frames import (FrameError, crc16, decode_ascii, decode_rtu,
+                                   encode_ascii, encode_rtu, lrc)
+from machine.modbus_interface import ModbusInterface
+from machine.modbus_slave import (LoadCellSlave, ModbusSlave, RelayBoardSlave,
+                                  VfdSlave, VirtualSerialPort)
+
+def test_crc16_known_vector():
+    # Read holding registers 0x0000 x2 from slave 1
+    assert encode_rtu(1, bytes.fromhex("0300000002")) == bytes.fromhex("010300000002C40B")
+    assert crc16(b"123456789") == 0x4B37
+
+def test_rtu_roundtrip_and_crc_check():
+    frame = encode_rtu(2, b"\x06\x20\x01\x05\xdc")
+    assert decode_rtu(frame) == (2, b"\x06\x20\x01\x05\xdc")
+    with pytest.raises(FrameError):
+        decode_rtu(frame[:-1] + bytes([frame[-1] ^ 0xFF]))
+
+def test_ascii_roundtrip_and_lrc_check():
+    frame = encode_ascii(2, b"\x06\x20\x00\x00\x02")
+    assert frame == b":020620000002D6\r\n"
+    assert lrc(b"\x02\x06\x20\x00\x00\x02") == 0xD6
+    assert decode_ascii(frame) == (2, b"\x06\x20\x00\x00\x02")
+    with pytest.raises(FrameError):
+        decode_ascii(b":020620000002D5\r\n")
+
+def test_slave_rejects_unknown_address_and_function():
+    slave = ModbusSlave(1, registers={0: 7})
+    assert slave.handle(b"\x03\x00\x00\x00\x01") == b"\x03\x02\x00\x07"
+    assert slave.handle(b"\x03\x00\x05\x00\x01") == b"\x83\x02"
+    assert slave.handle(b"\x2b\x0e\x01\x00") == b"\xab\x01"
+
+def test_vfd_over_ascii_pty():
+    with VirtualSerialPort([VfdSlave(address=2, run_command=2)], baudrate=19200, ascii_mode=True) as port:
+        inst = minimalmodbus.Instrument(port.port, 2, minimalmodbus.MODE_ASCII)
+        inst.serial.baudrate = 19200
+        inst.serial.timeout = 0.2
+        inst.write_register(0x2001, 1500, 0, functioncode=6)
+        inst.write_register(0x2000, 2, 0, functioncode=6)
+        assert inst.read_registers(0x2000, 3) == [2, 1500, 1]
+        inst.serial.close()
+
+def test_load_cell_and_relays_through_modbus_interface():
+    load_cell = LoadCellSlave(address=1)
+    load_cell.weight = -1.25
+    relays = RelayBoardSlave(address=1)
+    vfd = VfdSlave(address=2)
+    with VirtualSerialPort([load_cell], baudrate=9600) as scale_port, \
+         VirtualSerialPort([relays], baudrate=9600) as valve_port, \
+         VirtualSerialPort([vfd], baudrate=19200, ascii_mode=True) as vfd_port:
+        cfg = {
+            "vfd_poll_interval": 0.0, "scale_poll_interval": 0.0, "valve_poll_interval": 0.0,
+            "vfd_port": vfd_port.port, "scale_port": scale_port.port, "valve_port": valve_port.port,
+        }
+        m = ModbusInterface(cfg)
+        m.scale.serial.timeout = m.vfd.serial.timeout = m.valves.serial.timeout = 0.2
+
+        t0 = time.perf_counter()
+        assert m.read_load_cell() == pytest.approx(-1.25)
+        # 8-byte request + 9-byte response at 9600 baud is ~17.7 ms on the wire
+        assert time.perf_counter() - t0 >= 0.017
+
+        m.set_valves(m.VALVE_RIGHT | 0x10)
+        assert relays.mask == 0x12
+        m.set_vfd_speed(750)
+        assert vfd.registers[0x2001] == 750
+        for inst in (m.vfd, m.scale, m.valves):
+            inst.serial.close()
@@ -2,10 +2,20 @@
 
 import pytest
 import logging
+import time
 import paho.mqtt.client as real_mqtt
 
 from machine.mqtt_client import MqttClient
 
+class DummyInfo:
+    """Stand-in for paho's MQTTMessageInfo."""
+    def __init__(self, mid, published=True):
+        self.rc = real_mqtt.MQTT_ERR_SUCCESS
+        self.mid = mid
+        self.published = published
+    def is_published(self):
+        return self.published
+
 class DummyClient:
     """
     Fake Paho MQTT Client to capture connect, publish, loop and disconnect calls.
@@ -21,11 +31,17 @@ class DummyClient:
     def connect(self, broker, keepalive=60):
         self.connected = True
 
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        self.reconnect_delays = (min_delay, max_delay)
+
     def loop_start(self):
         self.loop_started = True
+        if self.connected:                  # the broker accepts: CONNACK rc=0
+            self.on_connect(self, None, {}, 0)
 
     def publish(self, topic, payload, qos=0, retain=False):
         self.publishes.append((topic, payload, qos, retain))
+        return DummyInfo(len(self.publishes))
 
     def loop_stop(self):
         self.loop_stopped = True
@@ -33,6 +49,12 @@ class DummyClient:
     def disconnect(self):
         self.disconnected = True
 
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
 @pytest.fixture(autouse=True)
 def patch_mqtt_client(monkeypatch):
     """
@@ -56,8 +78,9 @@ def test_publish_success(caplog):
     caplog.set_level(logging.ERROR)
     mqtt = MqttClient("broker_address")
     mqtt.publish("topic/name", "payload", qos=1, retain=True)
-    # Should record the publish in DummyClient
-    assert ("topic/name", "payload", 1, True) in mqtt._client.publishes
+    # Should record the publish in DummyClient, via the spool for QoS 1
+    assert wait_for(lambda: ("topic/name", "payload", 1, True) in mqtt._client.publishes)
+    assert wait_for(lambda: len(mqtt.spool) == 0)
 
 def test_publish_failure_logs(monkeypatch, caplog):
     # Create a client whose publish method raises
@@ -70,4 +93,88 @@ def test_publish_failure_logs(monkeypatch, caplog):
     mqtt = MqttClient("broker_address")
     mqtt.publish("bad/topic", "data")
     # Ensure error was logged
-    assert "MQTT publish error (bad/topic)" in caplog.text
\ No newline at end of file
+    assert "MQTT publish error (bad/topic)" in caplog.text
+
+class SilentBrokerClient(DummyClient):
+    """TCP connect succeeds but no CONNACK ever arrives."""
+    def loop_start(self):
+        self.loop_started = True
+
+def test_not_connected_until_connack(monkeypatch):
+    monkeypatch.setattr(real_mqtt, "Client", lambda client_id: SilentBrokerClient(client_id))
+    mqtt = MqttClient("broker_address")
+    assert not mqtt.connected
+    mqtt.publish("a/b", "early")
+    assert mqtt._client.publishes == []
+    assert len(mqtt.spool) == 1
+    mqtt._client.on_connect(mqtt._client, None, {}, 5)      # refused
+    assert not mqtt.connected
+    mqtt.disconnect()
+
+class OfflineClient(DummyClient):
+    """Broker unreachable until `on_connect` is fired by the test."""
+    def connect(self, broker, keepalive=60):
+        raise ConnectionRefusedError("broker down")
+
+def test_publishes_spooled_while_offline_and_drained_in_order(monkeypatch):
+    monkeypatch.setattr(real_mqtt, "Client", lambda client_id: OfflineClient(client_id))
+    mqtt = MqttClient("broker_address", drain_rate=0)
+    assert mqtt._client.loop_started is True       # paho keeps retrying with backoff
+    for n in range(5):
+        mqtt.publish("FillingMachine/Telemetry", n)
+    assert mqtt._client.publishes == []
+    assert len(mqtt.spool) == 5
+
+    mqtt._client.on_connect(mqtt._client, None, {}, 0)
+    deadline = time.time() + 2.0
+    while len(mqtt.spool) and time.time() < deadline:
+        time.sleep(0.01)
+    assert [payload for _, payload, _, _ in mqtt._client.publishes] == [0, 1, 2, 3, 4]
+
+    mqtt._client.on_disconnect(mqtt._client, None, 1)
+    mqtt.publish("FillingMachine/Telemetry", "late")
+    assert len(mqtt.spool) == 1
+    mqtt.disconnect()
+
+class UnackedClient(OfflineClient):
+    """Accepts publishes but the broker never acknowledges them."""
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.publishes.append((topic, payload, qos, retain))
+        info = DummyInfo(len(self.publishes), published=False)
+        self.infos.append(info)
+        return info
+
+def test_drained_messages_kept_until_acknowledged(monkeypatch):
+    monkeypatch.setattr(real_mqtt, "Client", lambda client_id: UnackedClient(client_id))
+    mqtt = MqttClient("broker_address", drain_rate=0)
+    mqtt._client.infos = []
+    mqtt.publish("a/b", 1, qos=1)
+    mqtt.publish("a/b", 2, qos=1)
+    mqtt._client.on_connect(mqtt._client, None, {}, 0)
+    assert wait_for(lambda: len(mqtt._client.publishes) == 2)
+    time.sleep(0.05)
+    assert len(mqtt.spool) == 2                    # handed to paho, not yet acknowledged
+
+    # The connection drops before the PUBACKs: both are sent again
+    mqtt._client.on_disconnect(mqtt._client, None, 1)
+    time.sleep(0.05)
+    mqtt._client.on_connect(mqtt._client, None, {}, 0)
+    assert wait_for(lambda: len(mqtt._client.publishes) == 4)
+    assert [payload for _, payload, _, _ in mqtt._client.publishes] == [1, 2, 1, 2]
+
+    for info in mqtt._client.infos[2:]:
+        info.published = True
+        mqtt._client.on_publish(mqtt._client, None, info.mid)
+    assert wait_for(lambda: len(mqtt.spool) == 0)
+    mqtt.disconnect()
+
+def test_spool_persists_across_restarts(tmp_path, monkeypatch):
+    monkeypatch.setattr(real_mqtt, "Client", lambda client_id: OfflineClient(client_id))
+    path = str(tmp_path / "spool.db")
+    mqtt = MqttClient("broker_address", spool_path=path)
+    mqtt.publish("a/b", b"\x01\x02", qos=1, retain=True)
+    mqtt.disconnect()
+
+    again = MqttClient("broker_address", spool_path=path)
+    assert [row[1:] for row in again.spool.peek()] == [("a/b", b"\x01\x02", 1, True)]
+    again.disconnect()
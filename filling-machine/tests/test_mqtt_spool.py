@@ -0,0 +1,26 @@
+from machine.mqtt_spool import MessageSpool
+
+def test_fifo_order_and_remove():
+    spool = MessageSpool()
+    for n in range(3):
+        spool.put("t", n)
+    rows = spool.peek()
+    assert [payload for _, _, payload, _, _ in rows] == [0, 1, 2]
+    spool.remove([rows[0][0]])
+    assert len(spool) == 2
+    assert spool.peek(1)[0][2] == 1
+
+def test_bounded_drops_oldest():
+    spool = MessageSpool(max_messages=3)
+    for n in range(5):
+        spool.put("t", f"m{n}")
+    assert len(spool) == 3
+    assert spool.dropped == 2
+    assert [payload for _, _, payload, _, _ in spool.peek()] == ["m2", "m3", "m4"]
+
+def test_payload_types_round_trip():
+    spool = MessageSpool()
+    for payload in (1.5, 7, "text", b"\x00\xff", None):
+        spool.put("t", payload, qos=1, retain=True)
+    assert [row[2] for row in spool.peek()] == [1.5, 7, "text", b"\x00\xff", None]
+    assert all(row[3] == 1 and row[4] is True for row in spool.peek())
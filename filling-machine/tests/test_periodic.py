@@ -0,0 +1,50 @@
+import pytest
+
+from machine.clock import SimClock
+from machine.periodic import PeriodicSchedule, PeriodicScheduler
+
+def test_work_time_does_not_stretch_the_period():
+    clock = SimClock()
+    schedule = PeriodicSchedule("loop", 0.1, clock)
+    starts = []
+    for _ in range(5):
+        schedule.wait()
+        starts.append(round(clock(), 6))
+        clock.sleep(0.03)                        # the loop's own work
+    assert starts == [0.1, 0.2, 0.3, 0.4, 0.5]
+    stats = schedule.stats()
+    assert (stats["runs"], stats["missed"], stats["jitter_max"]) == (5, 0, 0.0)
+
+def test_overrun_skips_missed_deadlines_instead_of_bursting():
+    clock = SimClock()
+    schedule = PeriodicSchedule("loop", 0.1, clock)
+    schedule.wait()
+    clock.sleep(0.25)                            # overruns into the third period
+    assert schedule.wait()
+    assert clock() == pytest.approx(0.35)
+    schedule.wait()
+    assert clock() == pytest.approx(0.4)
+    stats = schedule.stats()
+    assert stats["missed"] == 1
+    assert stats["jitter_max"] == pytest.approx(0.15, abs=1e-4)   # late for the 0.2 s deadline
+
+def test_poll_and_stop():
+    clock = SimClock()
+    schedule = PeriodicSchedule("loop", 1.0, clock)
+    assert not schedule.poll()
+    assert schedule.remaining() == pytest.approx(1.0)
+    stop = clock.event()
+    clock.timer(0.5, stop.set).start()
+    assert not schedule.wait(stop)
+    assert clock() == pytest.approx(0.5)
+    assert schedule.stats()["runs"] == 0
+
+def test_scheduler_reports_every_loop():
+    clock = SimClock()
+    loops = PeriodicScheduler(clock)
+    loops.schedule("scale", 0.03).wait()
+    loops.schedule("vfd", 0.1)
+    stats = loops.stats()
+    assert list(stats) == ["scale", "vfd"]
+    assert stats["scale"]["runs"] == 1
+    assert "scale" in loops.format()
@@ -0,0 +1,53 @@
+import threading
+import time
+import pytest
+
+from machine.scale_buffer import ScaleBuffer
+
+def test_latest_and_wraparound():
+    buf = ScaleBuffer(capacity=4)
+    assert buf.latest() is None
+    for n in range(6):
+        buf.append(raw=n, kg=n * 10, t=float(n))
+    assert buf.sequence == 6
+    assert buf.latest() == (5.0, 5, 50)
+    # Only the last `capacity` samples are retained
+    assert [s.raw for s in buf.since(0)] == [2, 3, 4, 5]
+
+def test_window_and_mean_since():
+    buf = ScaleBuffer(capacity=16)
+    for n in range(10):
+        buf.append(raw=n, kg=n + 0.5, t=100.0 + n)
+    assert [s.raw for s in buf.window(2.0, now=109.0)] == [7, 8, 9]
+    assert buf.mean_since(107.0) == pytest.approx(8.5)
+    assert buf.mean_since(107.0, raw=True) == pytest.approx(8.0)
+    assert buf.mean_since(200.0) is None
+
+def test_wait_for_next_sample_times_out():
+    buf = ScaleBuffer()
+    buf.append(1.0, 1.0)
+    assert buf.wait_for_next_sample(timeout=0.01) is None
+    # An older sequence number is satisfied immediately
+    assert buf.wait_for_next_sample(after=-1, timeout=0.01).raw == 1.0
+
+def test_wait_for_samples_counts_each_sample_once():
+    buf = ScaleBuffer(capacity=64)
+    buf.append(-1.0, -1.0)
+
+    def producer():
+        for n in range(5):
+            time.sleep(0.005)
+            buf.append(float(n), float(n))
+    t = threading.Thread(target=producer)
+    t.start()
+    samples = buf.wait_for_samples(5, timeout=1.0)
+    t.join()
+    assert [s.raw for s in samples] == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_wait_for_samples_returns_partial_on_stall():
+    buf = ScaleBuffer()
+    assert buf.wait_for_samples(3, timeout=0.01) == []
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        ScaleBuffer(capacity=0)
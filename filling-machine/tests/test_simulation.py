@@ -0,0 +1,75 @@
+import pytest
+
+from machine.modbus_interface import ModbusInterface
+from machine.simulation import BusMeter, SimulatedPlant
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def make_plant(**kwargs):
+    clock = ManualClock()
+    plant = SimulatedPlant(noise=0.0, pump_tau=0.01, filter_tau=0.01, clock=clock, **kwargs)
+    return plant, clock
+
+def test_flow_only_with_drive_running_and_valve_open():
+    plant, clock = make_plant(run_command=2, flow_per_hz=0.02)
+    plant.place_tray(1.0)
+    plant.vfd_speed = 1000            # 10 Hz -> 0.2 kg/s
+    plant.vfd_state = 2
+    clock.now = 1.0
+    plant.advance()
+    assert plant.mould_mass["left"] == 0.0
+
+    plant.coil_mask = 0x01
+    clock.now = 2.0
+    plant.advance()
+    assert plant.mould_mass["left"] == pytest.approx(0.2, abs=0.01)
+    assert plant.mould_mass["right"] == 0.0
+
+def test_split_between_open_valves():
+    plant, clock = make_plant(split_left=0.6)
+    plant.place_tray(1.0)
+    plant.vfd_state, plant.vfd_speed, plant.coil_mask = 2, 1000, 0x03
+    clock.now = 5.0
+    plant.advance()
+    total = plant.mould_mass["left"] + plant.mould_mass["right"]
+    assert plant.mould_mass["left"] / total == pytest.approx(0.6)
+
+def test_load_cell_reports_tray_and_product_in_grams():
+    plant, clock = make_plant()
+    plant.place_tray(1.2)
+    clock.now = 1.0
+    assert plant.read_grams() == 1200
+    assert plant.remove_tray() == {"left": 0.0, "right": 0.0}
+    clock.now = 2.0
+    assert plant.read_grams() == 0
+
+def test_modbus_interface_drives_plant():
+    plant, clock = make_plant(run_command=2)
+    meter = BusMeter()
+    cfg = {"vfd_poll_interval": 0.0, "scale_poll_interval": 0.0, "valve_poll_interval": 0.0}
+    instruments = plant.instruments(meter, baudrates={"vfd": 10**7, "scale": 10**7, "valves": 10**7}, latency=0.0)
+    m = ModbusInterface(cfg, instruments=instruments)
+    plant.place_tray(0.5)
+    m.set_vfd_speed(1500)
+    m.set_vfd_state(2)
+    m.set_valves(m.VALVE_RIGHT)
+    assert (plant.vfd_state, plant.vfd_speed, plant.coil_mask) == (2, 1500, 0x02)
+    clock.now = 1.0
+    assert m.read_load_cell() == pytest.approx(0.5 + 0.3, abs=0.01)
+    assert meter.count == {"vfd": 2, "valves": 1, "scale": 1}
+
+def test_flow_drift_changes_flow_per_hz():
+    plant, clock = make_plant(run_command=2, flow_per_hz=0.02, flow_drift=-0.5)
+    plant.place_tray(1.0)
+    plant.vfd_state, plant.vfd_speed, plant.coil_mask = 2, 1000, 0x01
+    clock.now = 60.0
+    plant.advance()
+    before = plant.mould_mass["left"]
+    clock.now = 61.0
+    plant.advance()
+    # Half the flow per Hz after a minute of -50 %/min drift
+    assert plant.mould_mass["left"] - before == pytest.approx(0.1, abs=0.005)
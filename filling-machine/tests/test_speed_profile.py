@@ -0,0 +1,42 @@
+import pytest
+
+from machine.speed_profile import RampLimiter, SpeedProfile, legacy_profile
+
+def test_steps_apply_once_remaining_reaches_breakpoint():
+    profile = SpeedProfile([[0.05, 3], [0.3, 15], [0.1, 6]])
+    assert [profile.speed(r) for r in (1.0, 0.3, 0.2, 0.1, 0.07, 0.05, -0.01)] == [15, 15, 15, 6, 6, 3, 3]
+    assert profile.top_speed == 15
+
+def test_interpolated_ramp_between_breakpoints():
+    profile = SpeedProfile([[0.3, 15], [0.1, 5]], interpolate=True)
+    assert profile.speed(0.5) == 15
+    assert profile.speed(0.2) == pytest.approx(10)
+    assert profile.speed(0.0) == 5
+
+def test_relative_breakpoints_scale_with_target():
+    profile = SpeedProfile.from_config({"points": [[1.0, 20], [0.2, 4]], "relative": True, "ramp_up": 30})
+    assert profile.speed(0.5, target=2.0) == 20
+    assert profile.speed(0.4, target=2.0) == 4
+    assert profile.ramp_up == 30 and profile.ramp_down is None
+
+def test_legacy_profile_matches_fast_slow_pair():
+    profile = legacy_profile(15.0, 3.0, 0.2, True, 1.3)
+    assert profile.name == "15-3Hz-adaptive"
+    assert profile.speed(0.27, 1.3) == 15
+    assert profile.speed(0.26, 1.3) == 3
+    assert profile.speed(0.08, 1.3) == pytest.approx(2.25)
+    assert profile.speed(0.05, 1.3) == pytest.approx(1.5)
+    assert legacy_profile(15.0, 3.0, 0.2, False, 1.3).speed(0.01, 1.3) == 3
+
+def test_empty_profile_rejected():
+    with pytest.raises(ValueError):
+        SpeedProfile([])
+
+def test_ramp_limiter():
+    ramp = RampLimiter()
+    assert ramp.limit(40.0, 0.0, ramp_up=20.0) == 40.0       # nothing to ramp from
+    assert ramp.limit(10.0, 0.5, ramp_down=30.0) == pytest.approx(25.0)
+    assert ramp.limit(10.0, 1.0, ramp_down=30.0) == pytest.approx(10.0)
+    ramp.reset(0.0)
+    assert ramp.limit(40.0, 2.0, ramp_up=20.0) == 0.0          # soft start
+    assert ramp.limit(40.0, 2.5, ramp_up=20.0) == pytest.approx(10.0)
@@ -0,0 +1,46 @@
+import threading
+import time
+import pytest
+
+from machine.scale_buffer import ScaleBuffer, ScaleSample
+from machine.stability import StabilityDetector
+
+def samples(weights, dt=0.05):
+    return [ScaleSample(n * dt, w, w) for n, w in enumerate(weights)]
+
+def test_check_needs_full_window():
+    det = StabilityDetector(samples=4)
+    assert det.check(samples([1.0, 1.0, 1.0])) is False
+    assert det.check(samples([1.0, 1.0, 1.0, 1.0])) is True
+
+def test_check_rejects_noise_and_drift():
+    det = StabilityDetector(samples=4, max_std=0.002, max_slope=0.01)
+    assert det.check(samples([1.0, 1.01, 0.99, 1.0])) is False
+    # Tiny spread but still creeping upwards at 0.02 kg/s
+    assert det.check(samples([1.000, 1.001, 1.002, 1.003])) is False
+    assert det.check(samples([1.0005, 1.0, 1.0005, 1.0])) is True
+
+def test_wait_until_stable_returns_window_mean():
+    det = StabilityDetector(samples=4)
+    buf = ScaleBuffer()
+    # Old, unsettled samples must not count towards stability
+    for w in (0.5, 0.9):
+        buf.append(w, w)
+
+    def producer():
+        for w in (1.2, 1.05, 1.0, 1.0, 1.0, 1.0):
+            time.sleep(0.005)
+            buf.append(w, w)
+    t = threading.Thread(target=producer)
+    t.start()
+    stable, mean = det.wait_until_stable(buf, max_wait=1.0)
+    t.join()
+    assert stable is True
+    assert mean == pytest.approx(1.0)
+
+def test_wait_until_stable_times_out():
+    det = StabilityDetector(samples=4)
+    buf = ScaleBuffer()
+    stable, mean = det.wait_until_stable(buf, max_wait=0.02)
+    assert stable is False
+    assert mean is None
@@ -0,0 +1,71 @@
+import pytest
+
+from machine.state_machine import State, StateMachine
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def make_machine(log):
+    clock = ManualClock()
+    def tick_idle(now):
+        return "busy" if log.get("go") else None
+    def enter_busy(now):
+        log.setdefault("entered", []).append(now)
+        fsm.after(1.0, lambda now: "done", now)
+    fsm = StateMachine([
+        State("idle", on_tick=tick_idle),
+        State("busy", on_enter=enter_busy, on_exit=lambda now: log.setdefault("exited", []).append(now)),
+        State("done"),
+    ], initial="idle", clock=clock, wall_clock=clock)
+    return fsm, clock
+
+def test_tick_handler_drives_transitions():
+    log = {}
+    fsm, clock = make_machine(log)
+    fsm.tick()
+    assert fsm.state == "idle"
+    log["go"] = True
+    clock.now = 0.5
+    fsm.tick()
+    assert fsm.state == "busy"
+    assert log["entered"] == [0.5]
+    assert fsm.time_in_state(0.75) == pytest.approx(0.25)
+
+def test_timers_fire_on_tick_and_are_timestamped():
+    log = {"go": True}
+    fsm, clock = make_machine(log)
+    seen = []
+    fsm.add_listener(lambda old, new: seen.append((old, new)))
+    fsm.tick()
+    assert fsm.pending()
+    assert fsm.idle_time(5.0) == pytest.approx(1.0)
+    clock.now = 0.9
+    fsm.tick()
+    assert fsm.state == "busy"
+    clock.now = 1.2
+    fsm.tick()
+    assert fsm.state == "done"
+    assert not fsm.pending()
+    assert log["exited"] == [1.2]
+    assert seen == [("idle", "busy"), ("busy", "done")]
+    assert [(t.t, t.old, t.new) for t in fsm.history] == [(0.0, "idle", "busy"), (1.2, "busy", "done")]
+
+def test_leaving_a_state_cancels_its_timers():
+    log = {"go": True}
+    fsm, clock = make_machine(log)
+    fsm.tick()
+    fsm.transition("idle")
+    log["go"] = False
+    clock.now = 2.0
+    fsm.tick()
+    assert fsm.state == "idle"
+
+def test_unknown_states_are_rejected():
+    fsm, _ = make_machine({})
+    with pytest.raises(ValueError):
+        fsm.transition("nowhere")
+    with pytest.raises(ValueError):
+        StateMachine([State("a")], initial="b")
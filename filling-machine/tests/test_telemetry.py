@@ -0,0 +1,58 @@
+import json
+import pytest
+
+from machine.telemetry import TelemetryPublisher, decode_struct
+
+class RecordingMqtt:
+    def __init__(self):
+        self.published = []
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload, retain))
+    def topics(self):
+        return [topic for topic, _, _ in self.published]
+
+FIELDS = {"ActualWeight": 1.0, "VFDState": 1, "VFDSpeed": 0, "Valve1State": 0, "Valve2State": 0, "FillStatus": 0}
+
+def make_publisher(**kwargs):
+    mqtt = RecordingMqtt()
+    options = dict(interval=1.0, snapshot_interval=10.0, deadbands={"ActualWeight": 0.01})
+    options.update(kwargs)
+    return mqtt, TelemetryPublisher(mqtt, **options)
+
+def test_first_tick_is_a_retained_snapshot():
+    mqtt, pub = make_publisher()
+    pub.publish(FIELDS, now=0.0)
+    assert len(mqtt.published) == len(FIELDS) + 1
+    assert all(retain for _, _, retain in mqtt.published)
+    combined = json.loads(mqtt.published[-1][1])
+    assert combined["ActualWeight"] == 1.0 and "t" in combined
+
+def test_fields_only_sent_on_change_beyond_deadband():
+    mqtt, pub = make_publisher()
+    pub.publish(FIELDS, now=0.0)
+    mqtt.published.clear()
+    pub.publish(dict(FIELDS, ActualWeight=1.005), now=0.1)   # inside deadband
+    assert mqtt.topics() == []
+    pub.publish(dict(FIELDS, ActualWeight=1.02, Valve1State=1), now=0.2)
+    assert mqtt.topics() == ["FillingMachine/ActualWeight", "FillingMachine/Valve1State"]
+    assert not any(retain for _, _, retain in mqtt.published)
+
+def test_combined_message_once_per_interval_and_periodic_snapshot():
+    mqtt, pub = make_publisher()
+    for tick in range(120):                                # 12 s at 10 Hz
+        pub.publish(FIELDS, now=tick * 0.1)
+    combined = [retain for topic, _, retain in mqtt.published if topic == "FillingMachine/Telemetry"]
+    assert 12 <= len(combined) <= 13
+    assert combined.count(True) == 2                       # t=0 and t=10 snapshots
+    assert mqtt.topics().count("FillingMachine/VFDState") == 2
+
+def test_struct_encoding_round_trips():
+    mqtt, pub = make_publisher(encoding="struct")
+    pub.publish(dict(FIELDS, VFDSpeed=25.5, FillStatus=3), now=0.0)
+    decoded = decode_struct(mqtt.published[-1][1])
+    assert decoded["VFDSpeed"] == pytest.approx(25.5)
+    assert decoded["FillStatus"] == 3
+
+def test_unknown_encoding_rejected():
+    with pytest.raises(ValueError):
+        TelemetryPublisher(RecordingMqtt(), encoding="xml")
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from machine.replay import VirtualClock, _same_cycle
+from machine.trace import KIND_SAMPLE, KIND_SETPOINT, KIND_STATE, RECORD, TraceRecorder, read_trace
+
+STATES = ("waiting_for_mould", "confirming_mould", "fill_left_fast")
+
+def test_round_trip(tmp_path):
+    rec = TraceRecorder(str(tmp_path), STATES)
+    path = rec.start({"flavour": "Brie", "tare_weight": 0.25})
+    rec.sample(10.0, 1.5, 1.49)
+    rec.setpoint(10.01, "vfd_speed", 30.0)
+    rec.transition(10.02, "confirming_mould", 0.5, 0.25)
+    rec.close()
+    assert os.path.getsize(path) % RECORD.size == 0
+    header, records = read_trace(path)
+    assert header["flavour"] == "Brie"
+    assert header["states"] == list(STATES)
+    assert [r[1] for r in records] == [KIND_SAMPLE, KIND_SETPOINT, KIND_STATE]
+    t, kind, code, a, b = records[2]
+    assert t == pytest.approx(10.02)
+    assert header["states"][code] == "confirming_mould"
+    assert (a, b) == (0.5, 0.25)
+    assert header["setpoints"][records[1][2]] == "vfd_speed"
+
+def test_truncated_record_is_ignored(tmp_path):
+    rec = TraceRecorder(str(tmp_path), STATES)
+    path = rec.start({})
+    rec.sample(1.0, 0.1, 0.1)
+    rec.sample(2.0, 0.2, 0.2)
+    rec.close()
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+    _, records = read_trace(path)
+    assert len(records) == 1
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_trace.ftr"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        read_trace(str(path))
+
+def test_old_traces_are_pruned(tmp_path):
+    rec = TraceRecorder(str(tmp_path), STATES, keep=2)
+    paths = [rec.start({}) for _ in range(4)]
+    rec.close()
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths[-2:])
+
+def test_same_cycle_needs_same_states_within_tolerance():
+    recorded = [(1.0, "confirming_mould"), (2.0, "fill_left_fast")]
+    assert _same_cycle(recorded, [(1.05, "confirming_mould"), (1.95, "fill_left_fast")], 0.1)
+    assert not _same_cycle(recorded, [(1.2, "confirming_mould"), (2.0, "fill_left_fast")], 0.1)
+    assert not _same_cycle(recorded, [(1.0, "confirming_mould")], 0.1)
+
+def test_virtual_clock_only_moves_when_set():
+    clock = VirtualClock(5.0)
+    assert clock() == 5.0
+    clock.now = 7.5
+    assert clock() == 7.5
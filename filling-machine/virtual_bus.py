@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Emulate the filler's Modbus devices on pseudo-terminals: the VFD (ASCII),
+the load cell and the Waveshare relay board (RTU). Prints the config.json
+port overrides to point ModbusInterface at them, and can profile real
+minimalmodbus transactions against them.
+Usage:
+    python virtual_bus.py                      # serve until Ctrl-C
+    python virtual_bus.py --profile 200        # time 200 transactions per device
+    python virtual_bus.py --scale-baud 19200 --profile 200 --no-clear-buffers
+"""
+import argparse
+import json
+import statistics
+import time
+
+from machine.modbus_interface import ModbusInterface
+from machine.modbus_slave import (LoadCellSlave, RelayBoardSlave,
+                                  VfdSlave, VirtualSerialPort)
+
+
+def profile(config, count, clear_buffers):
+    modbus = ModbusInterface(config)
+    for instrument in (modbus.vfd, modbus.scale, modbus.valves):
+        instrument.clear_buffers_before_each_transaction = clear_buffers
+    modbus.keepalive_interval = 0.0      # time every write, never skip
+
+    operations = {
+        "scale read":  lambda n: modbus.read_load_cell(),
+        "vfd speed":   lambda n: modbus.set_vfd_speed(n % 2000),
+        "valve mask":  lambda n: modbus.set_valves(n % 4),
+    }
+    for name, operation in operations.items():
+        times, errors = [], 0
+        for n in range(count):
+            t0 = time.perf_counter()
+            try:
+                operation(n)
+                times.append(time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+        if times:
+            print(f"{name:<11} n={len(times)} errors={errors} "
+                  f"mean={statistics.mean(times) * 1000:.1f}ms "
+                  f"p50={statistics.median(times) * 1000:.1f}ms max={max(times) * 1000:.1f}ms")
+        else:
+            print(f"{name:<11} all {count} transactions failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vfd-baud", type=int, default=19200)
+    parser.add_argument("--scale-baud", type=int, default=9600)
+    parser.add_argument("--valve-baud", type=int, default=9600)
+    parser.add_argument("--turnaround", type=float, default=0.002, help="device turnaround (s)")
+    parser.add_argument("--weight", type=float, default=1.0, help="load-cell weight (kg)")
+    parser.add_argument("--profile", type=int, default=0, metavar="N",
+                        help="time N transactions per device through ModbusInterface, then exit")
+    parser.add_argument("--no-clear-buffers", action="store_true",
+                        help="profile with clear_buffers_before_each_transaction disabled")
+    args = parser.parse_args()
+
+    load_cell = LoadCellSlave(address=1)
+    load_cell.weight = args.weight
+    ports = {
+        "vfd":   VirtualSerialPort([VfdSlave(address=2)], args.vfd_baud, ascii_mode=True, turnaround=args.turnaround),
+        "scale": VirtualSerialPort([load_cell], args.scale_baud, turnaround=args.turnaround),
+        "valve": VirtualSerialPort([RelayBoardSlave(address=1)], args.valve_baud, turnaround=args.turnaround),
+    }
+    for port in ports.values():
+        port.start()
+
+    config = {
+        "vfd_port": ports["vfd"].port, "vfd_baudrate": args.vfd_baud,
+        "scale_port": ports["scale"].port, "scale_baudrate": args.scale_baud,
+        "valve_port": ports["valve"].port, "valve_baudrate": args.valve_baud,
+    }
+    print(json.dumps(config, indent=2))
+    try:
+        if args.profile:
+            config.update({"vfd_poll_interval": 0.0, "scale_poll_interval": 0.0, "valve_poll_interval": 0.0})
+            profile(config, args.profile, not args.no_clear_buffers)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for port in ports.values():
+            port.stop()
+
+
+if __name__ == "__main__":
+    main()